@@ -352,3 +352,89 @@ def get_narrative_logs(cache_key: str) -> list:
         return logs
     finally:
         cnx.close()
+
+def get_narrative_template(signature_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve the narrative template for an event signature
+    
+    Args:
+        signature_key: Hash of the event signature
+    
+    Returns:
+        Dictionary with template_text, confidence, samples and hits, or None if not found
+    """
+    cnx = conn()
+    try:
+        return one(
+            cnx,
+            """
+            SELECT template_text, confidence, samples, hits
+            FROM narrative_templates
+            WHERE signature_key = %s
+            """,
+            (signature_key,)
+        )
+    finally:
+        cnx.close()
+
+def save_narrative_template(
+    signature_key: str,
+    signature: Any,
+    template_text: str,
+    confidence: float
+) -> Optional[Dict[str, Any]]:
+    """
+    Record one LLM narrative's template for an event signature
+    
+    The stored template is replaced only by one of at least the same confidence;
+    the sample count always goes up.
+    
+    Args:
+        signature_key: Hash of the event signature
+        signature: Event signature (stored as JSON for inspection)
+        template_text: Parameterized narrative
+        confidence: Share of data values that were parameterized
+    
+    Returns:
+        The stored template after the update (template_text, confidence, samples, hits)
+    """
+    cnx = conn()
+    try:
+        rows = q(
+            cnx,
+            """
+            INSERT INTO narrative_templates (signature_key, signature, template_text, confidence)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (signature_key) DO UPDATE SET
+                template_text = CASE WHEN EXCLUDED.confidence >= narrative_templates.confidence
+                                     THEN EXCLUDED.template_text ELSE narrative_templates.template_text END,
+                confidence = GREATEST(EXCLUDED.confidence, narrative_templates.confidence),
+                samples = narrative_templates.samples + 1,
+                updated_at = NOW()
+            RETURNING template_text, confidence, samples, hits
+            """,
+            (signature_key, json.dumps(signature), template_text, confidence)
+        )
+        return rows[0] if rows else None
+    finally:
+        cnx.close()
+
+def record_template_hit(signature_key: str) -> bool:
+    """
+    Count a reuse of a narrative template
+    
+    Args:
+        signature_key: Hash of the event signature
+    
+    Returns:
+        True if the template exists
+    """
+    cnx = conn()
+    try:
+        return execute(
+            cnx,
+            "UPDATE narrative_templates SET hits = hits + 1 WHERE signature_key = %s",
+            (signature_key,)
+        ) > 0
+    finally:
+        cnx.close()
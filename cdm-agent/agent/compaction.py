@@ -0,0 +1,197 @@
+"""
+Compaction of MCP tool results before they are handed to the LLM
+
+Each tool's output is first rewritten into a denser but lossless form (lineage rows
+as column/row tuples, diffs reduced to the fields that changed, nulls and CDM
+cross-reference keys dropped). Only if that still exceeds the token budget are
+long lists, long strings and deep branches elided, with explicit markers, so the
+model always receives valid JSON.
+"""
+import math
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from common import codec
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken is optional (and may not have its encoding files offline); fall back
+    # to a character-based estimate, which is close enough to size a budget
+    tiktoken = None  # type: ignore[assignment]
+    _ENCODING = None
+
+# Average characters per token for compact JSON; deliberately on the low side
+CHARS_PER_TOKEN = 3.5
+
+# CDM cross-reference identifiers: hashes that carry no business meaning
+REFERENCE_KEYS = frozenset(("globalKey", "externalKey", "globalReference", "externalReference"))
+
+# (list items kept, string characters kept, nesting depth kept) per shrinking round
+_SHRINK_STEPS: Tuple[Tuple[int, int, Optional[int]], ...] = (
+    (32, 400, None),
+    (16, 200, None),
+    (8, 120, 8),
+    (4, 80, 6),
+    (2, 40, 4),
+    (1, 20, 3),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a prompt fragment"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prune(node: Any) -> Any:
+    """Drop nulls, empty values and CDM reference keys; unwrap bare {"value": x} wrappers
+
+    Only dict entries are dropped: list items are pruned but kept, since lists such
+    as [from, to] changes and [op, path, value] patch entries mean something by position.
+    """
+    if isinstance(node, dict):
+        pruned = {}
+        for key, value in node.items():
+            if key in REFERENCE_KEYS:
+                continue
+            value = prune(value)
+            if value is None or value == "" or value == [] or value == {}:
+                continue
+            pruned[key] = value
+        if len(pruned) == 1 and "value" in pruned:
+            # CDM FieldWithMeta whose metadata was all references
+            return pruned["value"]
+        return pruned
+    if isinstance(node, list):
+        return [prune(item) for item in node]
+    return node
+
+
+def columnar(rows: Sequence[Dict[str, Any]], order: Sequence[str] = (), skip: Sequence[str] = ()) -> Dict[str, Any]:
+    """Rewrite a list of records as {"columns": [...], "rows": [[...], ...]}
+
+    Columns come in `order` first, then in first-seen order; columns that are
+    null in every row and those in `skip` are left out.
+    """
+    present: Dict[str, None] = {}
+    for row in rows:
+        for key, value in row.items():
+            if value is not None and value != [] and key not in skip:
+                present[key] = None
+    columns = [key for key in order if key in present] + [key for key in present if key not in order]
+    return {
+        "columns": columns,
+        "rows": [[prune(row.get(key)) for key in columns] for row in rows]
+    }
+
+
+def _compact_trade_lineage(result: Dict[str, Any]) -> Dict[str, Any]:
+    timeline = result.get("timeline") or []
+    # after_state_ids mirror the next rows' before_state_id; as_of only adds
+    # information where it differs from the effective date
+    skip = ["after_state_ids"]
+    if all(entry.get("as_of") in (None, entry.get("date")) for entry in timeline):
+        skip.append("as_of")
+    return {
+        "trade_id": result.get("trade_id"),
+        **columnar(timeline, order=(
+            "version", "trade_state_id", "event_id", "event_type", "intent", "date",
+            "position_state", "closed_state", "before_state_id"
+        ), skip=skip)
+    }
+
+
+def _compact_trade_states(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "trade_id": result.get("trade_id"),
+        **columnar(result.get("states") or [], order=("version", "trade_state_id"), skip=("trade_id",))
+    }
+
+
+def _compact_diff(result: Dict[str, Any]) -> Dict[str, Any]:
+    changes = {
+        field: [change.get("from"), change.get("to")]
+        for field, change in (result.get("changes") or {}).items()
+        if isinstance(change, dict) and change.get("changed")
+    }
+    patch = []
+    for op in result.get("patch") or []:
+        if op.get("path", "").rsplit("/", 1)[-1] in REFERENCE_KEYS:
+            continue
+        entry = [op.get("op"), op.get("path")]
+        if "value" in op:
+            entry.append(prune(op["value"]))
+        patch.append(entry)
+    return prune({
+        "header": result.get("header"),
+        "changes": changes,
+        "appends": result.get("appends"),
+        "patch": patch
+    })
+
+
+COMPACTORS: Dict[str, Callable[[Any], Any]] = {
+    "get_trade_lineage": _compact_trade_lineage,
+    "get_trade_states": _compact_trade_states,
+    "diff_states": _compact_diff,
+}
+
+
+def _shrink(node: Any, max_items: int, max_chars: int, depth: Optional[int]) -> Any:
+    """Elide list items, string tails and branches below `depth`, leaving markers"""
+    if isinstance(node, str):
+        if len(node) > max_chars:
+            return f"{node[:max_chars]}…(+{len(node) - max_chars} chars)"
+        return node
+    if isinstance(node, dict):
+        if depth == 0:
+            return {"_omitted_keys": len(node)} if node else node
+        child_depth = None if depth is None else depth - 1
+        return {key: _shrink(value, max_items, max_chars, child_depth) for key, value in node.items()}
+    if isinstance(node, list):
+        if depth == 0:
+            return [{"_omitted_items": len(node)}] if node else node
+        child_depth = None if depth is None else depth - 1
+        if len(node) > 2 * max_items:
+            # Keep both ends: the first and the latest states/events matter most
+            head = [_shrink(item, max_items, max_chars, child_depth) for item in node[:max_items]]
+            tail = [_shrink(item, max_items, max_chars, child_depth) for item in node[-max_items:]]
+            return head + [{"_omitted_items": len(node) - 2 * max_items}] + tail
+        return [_shrink(item, max_items, max_chars, child_depth) for item in node]
+    return node
+
+
+def fit_budget(node: Any, max_tokens: int) -> Tuple[Any, str]:
+    """Shrink `node` until its JSON fits `max_tokens`; returns (node, json text)"""
+    text = codec.dumps(node)
+    if estimate_tokens(text) <= max_tokens:
+        return node, text
+    for max_items, max_chars, depth in _SHRINK_STEPS:
+        node_shrunk = _shrink(node, max_items, max_chars, depth)
+        text = codec.dumps(node_shrunk)
+        if estimate_tokens(text) <= max_tokens:
+            break
+    # The last round is returned even if it is still over budget
+    return node_shrunk, text
+
+
+def compact_result(tool_name: str, result: Any, max_tokens: int) -> Tuple[Any, str]:
+    """Compact one tool result for the LLM
+
+    Args:
+        tool_name: Tool that produced the result (selects the compaction)
+        result: Decoded tool result
+        max_tokens: Token budget for the serialized result
+
+    Returns:
+        (compacted result, its JSON text)
+    """
+    compactor = COMPACTORS.get(tool_name)
+    if isinstance(result, dict) and compactor is not None:
+        result = compactor(result)
+    else:
+        result = prune(result)
+    return fit_budget(result, max_tokens)
+
@@ -0,0 +1,338 @@
+"""
+LLM backends for the narrative agent
+
+Every backend exposes the `chat.completions.create(...)` surface of the OpenAI SDK
+that the narrative agent uses, so they are interchangeable (CDM_LLM_BACKEND):
+- "azure" (default): AsyncAzureOpenAI configured from the AZURE_OPENAI_* variables
+- "replay": in-process fake that replays recorded tool-calling transcripts with a
+  configurable latency / token-rate profile, for offline load tests and profiling
+
+Transcripts (CDM_LLM_REPLAY_FILE, JSON) are a list of conversations; the first one
+whose "match" regex is found in the prompt is replayed turn by turn:
+
+    [{"match": "Trade State ID:", "turns": [
+        {"tool_calls": [{"name": "get_lineage", "arguments": {"trade_state_id": "{trade_state_id}"}}]},
+        {"content": "The trade was reset...", "usage": {"completion_tokens": 42}}
+    ]}]
+
+"{trade_id}", "{event_id}" and "{trade_state_id}" are filled in from the prompt.
+"""
+import asyncio
+import collections
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from openai import APITimeoutError, AsyncAzureOpenAI, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_message_tool_call import Function
+from openai.types.completion_usage import CompletionUsage
+
+from agent.compaction import estimate_tokens
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("CDM_LLM_BACKEND", "azure").lower()
+LLM_REPLAY_FILE = os.getenv("CDM_LLM_REPLAY_FILE", "")
+# Named profile or "<time to first token ms>,<tokens per second>"
+LLM_REPLAY_PROFILE = os.getenv("CDM_LLM_REPLAY_PROFILE", "azure")
+# Simulated deployment quota (tokens per minute, 0 = unlimited); requests over it get a 429
+LLM_REPLAY_TOKENS_PER_MINUTE = int(os.getenv("CDM_LLM_REPLAY_TOKENS_PER_MINUTE", "0"))
+
+# Interval over which tokens-per-minute quotas are enforced (seconds)
+QUOTA_WINDOW_S = 10.0
+
+# (time to first token in ms, completion tokens per second)
+REPLAY_PROFILES: Dict[str, Tuple[float, float]] = {
+    "instant": (0.0, float("inf")),
+    "fast": (150.0, 300.0),
+    "azure": (600.0, 80.0),
+    "slow": (2000.0, 25.0),
+}
+
+# Used when no transcript file is configured: one context lookup, then the narrative
+DEFAULT_TRANSCRIPTS: List[Dict[str, Any]] = [
+    {
+        "match": r"Trade State ID:",
+        "turns": [
+            {"tool_calls": [{"name": "get_lineage", "arguments": {"trade_state_id": "{trade_state_id}"}}]},
+            {"content": "Event {event_id} updated trade {trade_id} (state {trade_state_id}). "
+                        "The change was processed and the trade remains in its current lifecycle state."}
+        ]
+    },
+    {
+        "match": r"Trade ID:",
+        "turns": [
+            {"tool_calls": [{"name": "get_trade_lineage", "arguments": {"trade_id": "{trade_id}"}}]},
+            {"content": "Trade {trade_id} was executed and has progressed through its recorded lifecycle events. "
+                        "Each state transition was captured in the lineage, and the trade now reflects its latest "
+                        "confirmed terms."}
+        ]
+    }
+]
+
+# Identifiers the narrative prompts carry, available as transcript placeholders
+_PROMPT_FIELDS = {
+    "trade_id": re.compile(r"^Trade ID:\s*(\S+)", re.MULTILINE),
+    "event_id": re.compile(r"^Event ID:\s*(\S+)", re.MULTILINE),
+    "trade_state_id": re.compile(r"^Trade State ID:\s*(\S+)", re.MULTILINE),
+}
+
+
+_PLACEHOLDER = re.compile(r"\{(" + "|".join(_PROMPT_FIELDS) + r")\}")
+
+
+def _fill(value: Any, fields: Dict[str, str]) -> Any:
+    """Substitute prompt fields into transcript strings (recursively)"""
+    if isinstance(value, str):
+        return _PLACEHOLDER.sub(lambda m: fields.get(m.group(1), ""), value)
+    if isinstance(value, dict):
+        return {key: _fill(item, fields) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, fields) for item in value]
+    return value
+
+
+def message_dict(message: Any) -> Dict[str, Any]:
+    """Chat message as a plain request dict (SDK response messages carry extra, output-only fields)"""
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(include={"role", "content", "tool_calls"}, exclude_none=True)
+
+
+def parse_profile(spec: str) -> Tuple[float, float]:
+    """Latency profile by name, or from "<first token ms>,<tokens per second>" """
+    if spec in REPLAY_PROFILES:
+        return REPLAY_PROFILES[spec]
+    first_token_ms, tokens_per_s = spec.split(",")
+    return float(first_token_ms), float(tokens_per_s)
+
+
+class QuotaWindow:
+    """
+    Tokens charged over a sliding window, the way deployment quotas are enforced
+
+    Azure evaluates a tokens-per-minute quota over short intervals, so a minute's
+    quota can't be spent in one burst: the window holds `tokens_per_minute`
+    scaled to `window_s` seconds.
+    """
+
+    def __init__(self, tokens_per_minute: int, window_s: float = QUOTA_WINDOW_S):
+        self.window_s = window_s
+        self.limit = tokens_per_minute * window_s / 60.0
+        self._entries: "collections.deque[List[float]]" = collections.deque()  # [charged at, tokens]
+        self.tokens = 0.0
+
+    def _expire(self, now: float) -> None:
+        while self._entries and self._entries[0][0] <= now - self.window_s:
+            self.tokens -= self._entries.popleft()[1]
+
+    def wait(self, tokens: float, now: Optional[float] = None) -> float:
+        """Seconds until `tokens` fit in the window (0 if they fit now)
+
+        A request larger than the whole window fits once the window is empty.
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        needed = self.tokens + min(tokens, self.limit) - self.limit
+        if needed <= 0 or not self._entries:
+            return 0.0
+        released = 0.0
+        for at, spent in self._entries:
+            released += spent
+            if released >= needed:
+                break
+        return max(0.0, at + self.window_s - now)
+
+    def charge(self, tokens: float, now: Optional[float] = None) -> List[float]:
+        """Record `tokens` as spent now; returns the entry, for `settle()`"""
+        entry = [time.monotonic() if now is None else now, tokens]
+        self._entries.append(entry)
+        self.tokens += tokens
+        return entry
+
+    def settle(self, entry: List[float], tokens: float) -> None:
+        """Correct a charge once the actual token count is known"""
+        if self._entries and entry[0] >= self._entries[0][0]:
+            self.tokens += tokens - entry[1]
+            entry[1] = tokens
+
+
+class _ReplayCompletions:
+    def __init__(self, backend: "ReplayBackend"):
+        self._backend = backend
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        return await self._backend.create(**kwargs)
+
+
+class _ReplayChat:
+    def __init__(self, backend: "ReplayBackend"):
+        self.completions = _ReplayCompletions(backend)
+
+
+class ReplayBackend:
+    """
+    Deterministic stand-in for the chat completions API
+
+    Which turn to replay follows from the conversation itself (the number of
+    assistant messages so far), so one instance serves any number of concurrent
+    conversations. Latency is simulated as time-to-first-token plus completion
+    tokens at the profile's token rate, and honours the request timeout. With a
+    `tokens_per_minute` quota, requests whose prompt plus max_tokens would exceed
+    it (see QuotaWindow) are rejected with a 429 and a Retry-After, like Azure.
+    """
+
+    name = "replay"
+
+    def __init__(self, transcripts: Optional[List[Dict[str, Any]]] = None, profile: str = "azure",
+                 tokens_per_minute: int = 0):
+        self.transcripts = [
+            {**transcript, "pattern": re.compile(transcript["match"])}
+            for transcript in (transcripts if transcripts is not None else DEFAULT_TRANSCRIPTS)
+        ]
+        self.first_token_s, self.tokens_per_s = parse_profile(profile)
+        self.first_token_s /= 1000.0
+        self.chat = _ReplayChat(self)
+        self.calls = 0
+        self.model_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.quota = QuotaWindow(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.rate_limited = 0
+
+    @classmethod
+    def from_env(cls) -> "ReplayBackend":
+        transcripts = None
+        if LLM_REPLAY_FILE:
+            with open(LLM_REPLAY_FILE, "rb") as f:
+                transcripts = codec.loads(f.read())
+        return cls(transcripts, LLM_REPLAY_PROFILE, LLM_REPLAY_TOKENS_PER_MINUTE)
+
+    def _select_turn(self, messages: List[Dict[str, Any]], tools_offered: bool) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        prompt = "\n".join(str(m.get("content") or "") for m in messages if m.get("role") in ("system", "user"))
+        transcript = next((t for t in self.transcripts if t["pattern"].search(prompt)), None)
+        if transcript is None:
+            raise ValueError("No replay transcript matches this conversation")
+
+        fields = {}
+        for name, pattern in _PROMPT_FIELDS.items():
+            found = pattern.search(prompt)
+            if found:
+                fields[name] = found.group(1)
+
+        turns = transcript["turns"]
+        index = min(sum(1 for m in messages if m.get("role") == "assistant"), len(turns) - 1)
+        if not tools_offered:
+            # Forced completion: skip ahead to the narrative
+            index = next((i for i in range(index, len(turns)) if "content" in turns[i]), len(turns) - 1)
+        return turns[index], fields
+
+    def _check_quota(self, tokens: int) -> None:
+        """Charge `tokens` to the quota window, or raise a 429 with a Retry-After"""
+        if self.quota is None:
+            return
+        wait = self.quota.wait(tokens)
+        if wait > 0:
+            self.rate_limited += 1
+            request = httpx.Request("POST", "replay://chat/completions")
+            response = httpx.Response(429, request=request, headers={"retry-after-ms": str(max(1, int(wait * 1000)))})
+            raise RateLimitError("Rate limit exceeded (replay quota)", response=response, body=None)
+        self.quota.charge(tokens)
+
+    async def create(self, *, model: str, messages: List[Any], tools: Optional[List[Any]] = None,
+                     timeout: Optional[float] = None, max_tokens: Optional[int] = None, **kwargs) -> ChatCompletion:
+        """Replay the next turn of the matching transcript"""
+        messages = [message_dict(m) for m in messages]
+        turn, fields = self._select_turn(messages, bool(tools))
+        turn = _fill(turn, fields)
+
+        tool_calls = None
+        content = turn.get("content")
+        if turn.get("tool_calls"):
+            tool_calls = [
+                ChatCompletionMessageToolCall(
+                    id=f"call_{self.calls}_{i}",
+                    type="function",
+                    function=Function(name=call["name"], arguments=codec.dumps(call.get("arguments", {})))
+                )
+                for i, call in enumerate(turn["tool_calls"])
+            ]
+            content = None
+
+        usage = turn.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or estimate_tokens(codec.dumps([messages, tools or []]))
+        completion_tokens = usage.get("completion_tokens") or estimate_tokens(
+            content or codec.dumps(turn.get("tool_calls"))
+        )
+
+        self._check_quota(prompt_tokens + (max_tokens or completion_tokens))
+
+        delay = self.first_token_s + completion_tokens / self.tokens_per_s
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise APITimeoutError(request=httpx.Request("POST", "replay://chat/completions"))
+        await asyncio.sleep(delay)
+
+        self.calls += 1
+        self.model_seconds += delay
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+        return ChatCompletion(
+            id=f"replay-{self.calls}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=model,
+            choices=[Choice(
+                index=0,
+                finish_reason="tool_calls" if tool_calls else "stop",
+                message=ChatCompletionMessage(role="assistant", content=content, tool_calls=tool_calls)
+            )],
+            usage=CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls made and simulated model time, to separate it from pipeline overhead"""
+        return {
+            "backend": self.name,
+            "calls": self.calls,
+            "model_seconds": self.model_seconds,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "rate_limited": self.rate_limited,
+            "profile": {"first_token_ms": self.first_token_s * 1000.0, "tokens_per_s": self.tokens_per_s},
+        }
+
+
+def create_client() -> Any:
+    """Create the chat completions client for the configured backend"""
+    if LLM_BACKEND == "replay":
+        logger.info(f"Using replay LLM backend (profile: {LLM_REPLAY_PROFILE}, "
+                    f"transcripts: {LLM_REPLAY_FILE or 'built-in'})")
+        return ReplayBackend.from_env()
+    if LLM_BACKEND != "azure":
+        raise ValueError(f"Unknown CDM_LLM_BACKEND: {LLM_BACKEND}")
+    # Retries are left to the narrative agent's scheduler, which backs off for all callers
+    return AsyncAzureOpenAI(
+        max_retries=0,
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
+
+
+def client_stats(client: Any) -> Dict[str, Any]:
+    """Backend statistics (only the replay backend keeps any)"""
+    if isinstance(client, ReplayBackend):
+        return client.stats()
+    return {"backend": LLM_BACKEND}
@@ -0,0 +1,224 @@
+"""
+Scheduling of chat completion requests against the LLM deployment's quota
+
+All narrative generations share one scheduler, which:
+- caps the number of requests in flight (adaptively: halved on a rate-limit
+  response, grown back by one after a window of successful requests)
+- spends a tokens-per-minute budget over the same sliding window the quota is
+  enforced on, charging each request its estimated prompt tokens plus its
+  max_tokens (what the quota counts) up front
+- admits waiting requests in priority order (interactive before background)
+- retries rate-limited and transient failures after the server's Retry-After, or
+  an exponential backoff; a rate limit pauses all admissions meanwhile so a
+  burst doesn't keep hitting it
+
+Every wait is bounded by the request deadline (common.deadline).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from agent.compaction import estimate_tokens
+from agent.llm_backend import QuotaWindow, message_dict
+from common import codec, tracing
+from common.deadline import DeadlineExceeded, remaining, timeout_for
+
+logger = logging.getLogger(__name__)
+
+# Admission priorities (lower is served first)
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Backoff when the server gives no Retry-After (seconds)
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 30.0
+
+
+def estimate_request_tokens(messages: List[Any], tools: Optional[List[Any]], max_tokens: int) -> int:
+    """Tokens a request counts against the quota: prompt estimate plus max_tokens"""
+    prompt = codec.dumps([[message_dict(m) for m in messages], tools or []])
+    return estimate_tokens(prompt) + max_tokens
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Server-requested delay (seconds) from a failed response, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return None
+
+
+class LLMScheduler:
+    """
+    Admission control for chat completions
+
+    Args:
+        max_concurrency: Upper bound on requests in flight
+        tokens_per_minute: Deployment quota in tokens per minute (0 disables token budgeting)
+        max_retries: Retries per request on rate-limit and transient errors
+    """
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 0, max_retries: int = 4):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.quota = QuotaWindow(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.limit = self.max_concurrency
+        self.active = 0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []  # (priority, seq, cost, admission)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.requests = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.queued_seconds = 0.0
+
+    def _dispatch(self) -> None:
+        """Admit waiting requests, highest priority first, while capacity allows"""
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            _, _, cost, future = self._waiters[0]
+            if future.done():
+                # Cancelled or timed out while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self.active >= self.limit:
+                return
+            wait = self._paused_until - now
+            if self.quota is not None:
+                wait = max(wait, self.quota.wait(cost, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.active += 1
+            future.set_result(self.quota.charge(cost, now) if self.quota is not None else None)
+
+    def _poke(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def _acquire(self, cost: float, priority: int) -> Optional[List[float]]:
+        """Wait to be admitted; returns the quota charge (None without budgeting)"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), cost, future))
+        self._poke()
+        if future.done():
+            return future.result()
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(future, remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded while queued for the LLM")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as we were cancelled: hand the slot on
+                self._release(future.result(), None)
+            raise
+        finally:
+            self.queued_seconds += time.monotonic() - started
+
+    def _release(self, charge: Optional[List[float]], used: Optional[float]) -> None:
+        self.active -= 1
+        if charge is not None and used is not None:
+            # Settle the up-front prompt estimate against the reported prompt tokens
+            self.quota.settle(charge, used)
+        self._poke()
+
+    def _on_rate_limited(self, delay: float) -> None:
+        self.rate_limited += 1
+        self._successes = 0
+        self.limit = max(1, self.limit // 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning(f"LLM rate limited; pausing {delay:.1f}s, concurrency limit now {self.limit}")
+
+    def _on_success(self) -> None:
+        self._successes += 1
+        if self.limit < self.max_concurrency and self._successes >= self.limit:
+            self.limit += 1
+            self._successes = 0
+
+    async def complete(self, client: Any, *, priority: int = INTERACTIVE, timeout_s: Optional[float] = None, **kwargs) -> Any:
+        """Run `client.chat.completions.create(**kwargs)` under the scheduler
+
+        Args:
+            client: Chat completions client (see agent.llm_backend)
+            priority: INTERACTIVE or BACKGROUND
+            timeout_s: Per-attempt timeout, capped by the request deadline
+
+        Raises:
+            DeadlineExceeded: If the deadline passes while queued
+        """
+        max_tokens = kwargs.get("max_tokens") or 0
+        cost = estimate_request_tokens(kwargs.get("messages", []), kwargs.get("tools"), max_tokens)
+        self.requests += 1
+        attempt = 0
+        while True:
+            with tracing.span("llm.queue", {"llm.priority": priority, "llm.attempt": attempt}):
+                charge = await self._acquire(cost, priority)
+            used: Optional[float] = None
+            backoff = 0.0
+            try:
+                with tracing.span("llm.request", {"llm.attempt": attempt}, kind=tracing.CLIENT):
+                    response = await client.chat.completions.create(**kwargs, timeout=timeout_for(timeout_s))
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    used = usage.prompt_tokens + max_tokens
+                self._on_success()
+                return response
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:
+                if isinstance(e, RateLimitError):
+                    # Rejected requests don't count against the quota
+                    used = 0.0
+                if isinstance(e, APITimeoutError) or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.0)
+                left = remaining()
+                if left is not None and left <= delay:
+                    raise
+                if isinstance(e, RateLimitError):
+                    # Pauses every admission, this request's retry included
+                    self._on_rate_limited(delay)
+                else:
+                    backoff = delay
+                attempt += 1
+                self.retries += 1
+                logger.info(f"Retrying LLM request in {delay:.2f}s after {type(e).__name__} (attempt {attempt})")
+            finally:
+                self._release(charge, used)
+            if backoff:
+                await asyncio.sleep(backoff)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, limits and rate-limit counters"""
+        return {
+            "active": self.active,
+            "queued": sum(1 for *_, future in self._waiters if not future.done()),
+            "concurrency_limit": self.limit,
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "quota_window_tokens": self.quota.tokens if self.quota is not None else None,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "queued_seconds": self.queued_seconds,
+        }
@@ -1,19 +1,288 @@
 """
 MCP Client Manager for connecting to MCP servers and managing tool discovery
-Implements MCP protocol via direct JSON-RPC over stdio for reliability
+Implements MCP protocol via direct JSON-RPC over stdio (or Unix sockets to provider daemons)
 """
 import asyncio
-import json
+import hashlib
 import logging
 import os
 import sys
+import time
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Awaitable, Callable, Sequence, Union
 import asyncio.subprocess as subprocess
+from agent.tool_cache import CachePolicy, ToolResultCache
+from common import codec, metrics, tracing
+from common.db import listen
+from common.deadline import timeout_for
+from common.framing import (
+    FRAMING_NDJSON, FRAMING_LENGTH_PREFIXED, COMPRESSION_ZLIB, encode_frame, read_frame
+)
+from common.mcp_server import CACHE_STATS, METRICS_SNAPSHOT, QUERY_STATS
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Framing offered to providers at initialize; CDM_MCP_FRAMING=ndjson keeps line mode
+MCP_FRAMING = os.getenv("CDM_MCP_FRAMING", FRAMING_LENGTH_PREFIXED)
+MCP_COMPRESSION = os.getenv("CDM_MCP_COMPRESSION", "") == COMPRESSION_ZLIB
+# StreamReader limit for line mode (the asyncio default of 64 KiB is too small for payloads)
+MCP_LINE_LIMIT = int(os.getenv("CDM_MCP_LINE_LIMIT", str(64 * 1024 * 1024)))
+# Directory holding provider daemon sockets (<dir>/<server>.sock); unset spawns stdio children
+MCP_SOCKET_DIR = os.getenv("CDM_MCP_SOCKET_DIR", "")
+# Connections per provider daemon
+MCP_POOL_SIZE = int(os.getenv("CDM_MCP_POOL_SIZE", "4"))
+# Default bound on a single tool call; the request deadline (common.deadline) can shorten it
+MCP_CALL_TIMEOUT_S = float(os.getenv("CDM_MCP_CALL_TIMEOUT_S", "30"))
+# Spawn a provider only on the first call to one of its tools (needs cached tool schemas)
+MCP_LAZY = os.getenv("CDM_MCP_LAZY", "false").lower() in ("1", "true", "yes")
+# On-disk cache of discovered tool schemas, keyed by a fingerprint of each provider script
+MCP_TOOL_CACHE = os.getenv(
+    "CDM_MCP_TOOL_CACHE", str(Path(__file__).parent.parent.resolve() / ".mcp_tools_cache.json")
+)
+MCP_PROTOCOL_VERSION = "2024-11-05"
+# Supervision of spawned providers: ping interval/timeout, how long a single request may
+# run before the provider is considered hung, and restart backoff bounds
+MCP_HEALTH_INTERVAL_S = float(os.getenv("CDM_MCP_HEALTH_INTERVAL_S", "15"))
+MCP_PING_TIMEOUT_S = float(os.getenv("CDM_MCP_PING_TIMEOUT_S", "5"))
+MCP_HANG_TIMEOUT_S = float(os.getenv("CDM_MCP_HANG_TIMEOUT_S", "120"))
+MCP_RESTART_BACKOFF_S = float(os.getenv("CDM_MCP_RESTART_BACKOFF_S", "0.5"))
+MCP_RESTART_BACKOFF_MAX_S = float(os.getenv("CDM_MCP_RESTART_BACKOFF_MAX_S", "30"))
+# A provider that stayed up this long gets its backoff reset
+MCP_RESTART_STABLE_S = 60.0
+# Tool-result cache (per-tool policies come from the providers' tool metadata); it is
+# dropped on every NOTIFY on the channel below (see migrations/004_trade_data_notify.sql)
+MCP_RESULT_CACHE = os.getenv("CDM_MCP_RESULT_CACHE", "true").lower() in ("1", "true", "yes")
+MCP_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("CDM_MCP_RESULT_CACHE_MAX_ENTRIES", "4096"))
+MCP_RESULT_CACHE_CHANNEL = os.getenv("CDM_MCP_RESULT_CACHE_CHANNEL", "cdm_trade_data_changed")
+
+mcp_call_seconds = metrics.histogram(
+    "cdm_mcp_call_duration_seconds",
+    "MCP tools/call round trip to a provider (result cache hits excluded)",
+    ("server", "tool", "outcome")
+)
+
+# Provider stderr lines usually start with a logging level ("WARNING:name:message")
+_STDERR_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+
+class MCPConnection:
+    """
+    One JSON-RPC stream to a provider (a child's stdio pipes or a Unix socket)
+
+    After the initialize handshake a background task reads responses and hands
+    each to the caller waiting on its id, so several requests can be in flight.
+    A caller that times out or is cancelled sends `notifications/cancelled`;
+    the server's late response, if any, is dropped.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.framing = FRAMING_NDJSON
+        self.compression: Optional[str] = None
+        self._pending: Dict[Any, asyncio.Future] = {}  # request id -> response future
+        self._started: Dict[Any, float] = {}  # request id -> monotonic send time
+        self._write_lock = asyncio.Lock()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._error: Optional[ConnectionError] = None
+
+    @property
+    def busy_since(self) -> Optional[float]:
+        """Monotonic send time of the oldest request still waiting for a response"""
+        return min(self._started.values()) if self._started else None
+
+    def set_framing(self, framing: str, compression: Optional[str] = None):
+        """Switch framing after the initialize response has been read"""
+        self.framing = framing
+        self.compression = compression
+
+    def _encode(self, message: Dict[str, Any]) -> bytes:
+        body = codec.dumpb(message)
+        if self.framing == FRAMING_LENGTH_PREFIXED:
+            return encode_frame(body, compress=self.compression == COMPRESSION_ZLIB)
+        return body + b"\n"
+
+    async def _read_message(self) -> Dict[str, Any]:
+        try:
+            if self.framing == FRAMING_LENGTH_PREFIXED:
+                message = await read_frame(self.reader)
+            else:
+                message = await self.reader.readline()
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Server closed the connection mid-response")
+        if not message:
+            raise ConnectionError("Server closed the connection")
+        return codec.loads(message)
+
+    async def handshake(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Send the initialize request and read its response directly (before the reader starts)"""
+        self.writer.write(self._encode(request))
+        await self.writer.drain()
+        return await self._read_message()
+
+    async def _read_loop(self):
+        error = ConnectionError("Connection closed")
+        try:
+            while True:
+                response = await self._read_message()
+                future = self._pending.get(response.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except ConnectionError as e:
+            error = e
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = ConnectionError(f"Unreadable response: {e}")
+        finally:
+            self._error = error
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    def _notify_cancelled(self, request_id: Any, reason: str):
+        """Best-effort cancellation notice; written without awaiting so it works while unwinding"""
+        notification = {
+            "jsonrpc": "2.0",
+            "method": "notifications/cancelled",
+            "params": {"requestId": request_id, "reason": reason}
+        }
+        try:
+            self.writer.write(self._encode(notification))
+        except Exception:
+            pass
+
+    async def request(self, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Send a JSON-RPC request and wait for its response
+
+        Raises:
+            ConnectionError: If the server went away before answering
+            asyncio.TimeoutError: If no response arrived within `timeout` seconds
+        """
+        if self._error is not None:
+            raise self._error
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+        request_id = request["id"]
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._started[request_id] = time.monotonic()
+        try:
+            async with self._write_lock:
+                self.writer.write(self._encode(request))
+                await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._notify_cancelled(request_id, f"timed out after {timeout:.1f}s")
+            raise
+        except asyncio.CancelledError:
+            self._notify_cancelled(request_id, "caller cancelled")
+            raise
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise ConnectionError(str(e) or "Connection lost")
+        finally:
+            self._pending.pop(request_id, None)
+            self._started.pop(request_id, None)
+            if future.done() and not future.cancelled():
+                # Mark a connection failure that raced the write as retrieved
+                future.exception()
+
+    async def close(self):
+        """Stop reading and close the write side (stdio children see EOF and exit)"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class MCPSocketPool:
+    """
+    Pool of initialized connections to a provider daemon listening on a Unix socket
+    Connections are opened on demand up to `size`; broken ones are dropped and reopened
+    """
+
+    def __init__(self, path: str, size: int, initialize: Callable[[MCPConnection], Awaitable[None]]):
+        self.path = path
+        self.size = max(1, size)
+        self._initialize = initialize
+        self._idle: List[MCPConnection] = []
+        self._open = 0
+        self._available = asyncio.Condition()
+
+    async def _connect(self) -> MCPConnection:
+        reader, writer = await asyncio.open_unix_connection(self.path, limit=MCP_LINE_LIMIT)
+        connection = MCPConnection(reader, writer)
+        try:
+            await self._initialize(connection)
+        except Exception:
+            await connection.close()
+            raise
+        return connection
+
+    async def _acquire(self) -> MCPConnection:
+        async with self._available:
+            while not self._idle and self._open >= self.size:
+                await self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        try:
+            return await self._connect()
+        except Exception:
+            async with self._available:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    async def _release(self, connection: MCPConnection, healthy: bool):
+        async with self._available:
+            if healthy:
+                self._idle.append(connection)
+            else:
+                self._open -= 1
+            self._available.notify()
+        if not healthy:
+            await connection.close()
+
+    async def warm(self):
+        """Open one connection up front so a missing daemon fails fast"""
+        await self._release(await self._acquire(), healthy=True)
+
+    async def request(self, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Send a request on an idle pooled connection"""
+        connection = await self._acquire()
+        healthy = False
+        try:
+            try:
+                response = await connection.request(request, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # The connection itself is fine; the late response will be dropped
+                healthy = True
+                raise
+            healthy = True
+            return response
+        finally:
+            await self._release(connection, healthy)
+
+    async def close(self):
+        """Close all idle connections"""
+        async with self._available:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for connection in idle:
+            await connection.close()
+
 
 class MCPClientManager:
     """
@@ -22,11 +291,20 @@ class MCPClientManager:
     """
 
     def __init__(self):
-        self.processes: Dict[str, subprocess.Process] = {}  # server_name -> process
+        self.server_configs: Dict[str, Dict[str, Any]] = {}  # server_name -> config
+        self.processes: Dict[str, subprocess.Process] = {}  # server_name -> spawned stdio process
+        self.connections: Dict[str, Union[MCPConnection, MCPSocketPool]] = {}  # server_name -> transport
         self.server_tools: Dict[str, List[Dict[str, Any]]] = {}  # server_name -> tools
         self.tool_to_server: Dict[str, str] = {}  # tool_name -> server_name
         self.available_tools: List[Dict[str, Any]] = []  # Azure OpenAI format
         self.next_id = 1  # JSON-RPC message ID counter
+        self._connect_locks: Dict[str, asyncio.Lock] = {}  # server_name -> connect/restart lock
+        self._stderr_tasks: Dict[str, asyncio.Task] = {}  # server_name -> stderr pump
+        self._restarts: Dict[str, tuple] = {}  # server_name -> (consecutive restarts, last restart time)
+        self._health_task: Optional[asyncio.Task] = None
+        self.cache_policies: Dict[str, CachePolicy] = {}  # tool_name -> result cache policy
+        self.result_cache = ToolResultCache(MCP_RESULT_CACHE_MAX_ENTRIES)
+        self._invalidation_task: Optional[asyncio.Task] = None
         self._initialized = False
     
     async def start(self):
@@ -57,33 +335,248 @@ class MCPClientManager:
             }
         ]
 
-        # Connect to each server
-        for config in servers_config:
+        self.server_configs = {config["name"]: config for config in servers_config}
+        tool_cache = self._load_tool_cache()
+
+        async def bring_up(config: Dict[str, Any]) -> List[Dict[str, Any]]:
             server_name = config["name"]
-            script_path = config["script_path"]
+            cached = tool_cache.get(server_name, {})
+            tools = cached.get("tools") if cached.get("fingerprint") == config["fingerprint"] else None
+            if MCP_LAZY and tools is not None:
+                logger.info(f"⏸ Deferring {server_name} MCP server until its first tool call")
+                return tools
+            await self._connect_server(server_name)
+            if tools is None:
+                tools = await self._list_server_tools(server_name)
+            return tools
+
+        # Bring all servers up concurrently; startup takes as long as the slowest one
+        for config in servers_config:
+            config["fingerprint"] = self._server_fingerprint(config["script_path"])
+        results = await asyncio.gather(*(bring_up(config) for config in servers_config), return_exceptions=True)
 
-            logger.info(f"Connecting to MCP server: {server_name} ({script_path})")
+        for config, result in zip(servers_config, results):
+            if isinstance(result, BaseException):
+                server_name = config["name"]
+                logger.error(f"❌ Failed to connect to {server_name} MCP server: {result}")
+                # Fail fast - cleanup and raise
+                await self.shutdown()
+                raise RuntimeError(f"Failed to connect to MCP server '{server_name}': {result}")
+
+        # Register tools in configuration order so the tool list is stable
+        for config, tools in zip(servers_config, results):
+            self._register_tools(config["name"], tools)
+        self._save_tool_cache({
+            config["name"]: {"fingerprint": config["fingerprint"], "tools": tools}
+            for config, tools in zip(servers_config, results)
+        }, tool_cache)
+
+        if MCP_HEALTH_INTERVAL_S > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+        if MCP_RESULT_CACHE and self.cache_policies and MCP_RESULT_CACHE_CHANNEL:
+            self._invalidation_task = asyncio.create_task(
+                listen(MCP_RESULT_CACHE_CHANNEL, self._on_trade_data_changed)
+            )
 
+        self._initialized = True
+        logger.info(f"✅ MCP client initialized with {len(self.server_configs)} servers "
+                    f"({len(self.connections)} connected) and {len(self.available_tools)} tools")
+
+    async def _connect_server(self, server_name: str):
+        """
+        Connect to a server (daemon socket or spawned process) and initialize it
+        """
+        script_path = self.server_configs[server_name]["script_path"]
+        logger.info(f"Connecting to MCP server: {server_name} ({script_path})")
+
+        socket_path = self._daemon_socket_path(server_name)
+        transport: Union[MCPConnection, MCPSocketPool]
+        if socket_path:
+            # Share a long-lived provider daemon instead of spawning a child
+            transport = MCPSocketPool(socket_path, MCP_POOL_SIZE, self._initialize_connection)
+            logger.info(f"✅ Using {server_name} MCP daemon at {socket_path} (pool size {MCP_POOL_SIZE})")
+        else:
+            process = await self._start_server_process(server_name, script_path)
+            self.processes[server_name] = process
+            transport = MCPConnection(process.stdout, process.stdin)
+            self._stderr_tasks[server_name] = asyncio.create_task(self._pump_stderr(server_name, process))
+            logger.info(f"✅ Started {server_name} MCP server process")
+
+        # Initialize the server; only then is it visible to callers
+        try:
+            await self._initialize_server(server_name, transport)
+        except BaseException:
+            await transport.close()
+            process = self.processes.pop(server_name, None)
+            if process is not None:
+                await self._stop_process(server_name, process, graceful=False)
+            raise
+        self.connections[server_name] = transport
+        logger.info(f"✅ Initialized {server_name} MCP server")
+
+    async def _ensure_connected(self, server_name: str):
+        """
+        Connect a lazily deferred server on first use
+        """
+        if server_name in self.connections:
+            return
+        lock = self._connect_locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            if server_name not in self.connections:
+                await self._connect_server(server_name)
+
+    async def _pump_stderr(self, server_name: str, process: subprocess.Process):
+        """
+        Drain a provider's stderr into logging so a chatty provider can't fill the pipe and stall
+        """
+        server_logger = logging.getLogger(f"{__name__}.{server_name}")
+        extra = {"mcp_server": server_name, "pid": process.pid}
+        while True:
             try:
-                process = await self._start_server_process(server_name, script_path)
-                self.processes[server_name] = process
-                logger.info(f"✅ Started {server_name} MCP server process")
+                line = await process.stderr.readline()
+            except ValueError:
+                # Line longer than the stream limit (already discarded); keep draining
+                server_logger.warning("Dropped over-long stderr line", extra=extra)
+                continue
+            if not line:
+                break
+            text = line.decode("utf-8", errors="replace").rstrip()
+            if not text:
+                continue
+            level = _STDERR_LEVELS.get(text.split(":", 1)[0], logging.INFO)
+            server_logger.log(level, text, extra=extra)
+
+    async def _stop_process(self, server_name: str, process: subprocess.Process, graceful: bool = True):
+        """
+        Terminate a provider process, killing it if it doesn't exit in time (or right away)
+        """
+        if process.returncode is not None:
+            return
+        if not graceful:
+            process.kill()
+            await process.wait()
+            return
+        logger.debug(f"Terminating process for {server_name}")
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=5.0)
+            logger.debug(f"Process {server_name} terminated cleanly")
+        except asyncio.TimeoutError:
+            logger.warning(f"Process {server_name} didn't terminate cleanly, killing...")
+            process.kill()
+            await process.wait()
+
+    async def _restart_server(self, server_name: str, failed: Any, reason: str):
+        """
+        Replace a dead or hung provider process, with exponential backoff between restarts
 
-                # Initialize the server
-                await self._initialize_server(server_name)
-                logger.info(f"✅ Initialized {server_name} MCP server")
+        `failed` is the connection the caller saw fail; if it has already been
+        replaced by a concurrent caller this is a no-op. Daemon socket pools
+        reconnect on their own and are never restarted from here.
+        """
+        lock = self._connect_locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            current = self.connections.get(server_name)
+            if current is not failed or isinstance(current, MCPSocketPool):
+                return
+
+            count, last = self._restarts.get(server_name, (0, 0.0))
+            if time.monotonic() - last > MCP_RESTART_STABLE_S:
+                count = 0
+            delay = min(MCP_RESTART_BACKOFF_MAX_S, MCP_RESTART_BACKOFF_S * (2 ** count)) if count else 0.0
+            logger.warning(f"Restarting {server_name} MCP server ({reason}); attempt {count + 1}, backoff {delay:.1f}s")
+
+            process = self.processes.pop(server_name, None)
+            self.connections.pop(server_name, None)
+            if current is not None:
+                await current.close()
+            if process is not None:
+                # No grace period: the process is already dead or unresponsive
+                await self._stop_process(server_name, process, graceful=False)
+
+            await asyncio.sleep(delay)
+            self._restarts[server_name] = (count + 1, time.monotonic())
+            await self._connect_server(server_name)
+
+    async def _check_server(self, server_name: str):
+        """
+        One health probe: process liveness, hung requests, and a ping when idle
+        """
+        process = self.processes.get(server_name)
+        connection = self.connections.get(server_name)
+        if process is None or not isinstance(connection, MCPConnection):
+            return
 
-            except Exception as e:
-                logger.error(f"❌ Failed to connect to {server_name} MCP server: {e}")
-                # Fail fast - cleanup and raise
-                await self.shutdown()
-                raise RuntimeError(f"Failed to connect to MCP server '{server_name}': {e}")
+        if process.returncode is not None:
+            await self._restart_server(server_name, connection, f"exited with code {process.returncode}")
+            return
 
-        # Discover tools from all servers
-        await self._discover_all_tools()
+        if connection.busy_since is not None:
+            # Pings queue behind the request in flight, so judge by its age instead
+            if time.monotonic() - connection.busy_since > MCP_HANG_TIMEOUT_S:
+                await self._restart_server(server_name, connection, f"request running over {MCP_HANG_TIMEOUT_S:.0f}s")
+            return
 
-        self._initialized = True
-        logger.info(f"✅ MCP client initialized with {len(self.processes)} servers and {len(self.available_tools)} tools")
+        ping = {"jsonrpc": "2.0", "id": self.next_id, "method": "ping"}
+        self.next_id += 1
+        try:
+            await connection.request(ping, timeout=MCP_PING_TIMEOUT_S)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            await self._restart_server(server_name, connection, f"ping failed: {str(e) or type(e).__name__}")
+
+    async def _health_loop(self):
+        """
+        Periodically probe every spawned provider and restart unhealthy ones
+        """
+        while True:
+            await asyncio.sleep(MCP_HEALTH_INTERVAL_S)
+            for server_name in list(self.processes):
+                try:
+                    await self._check_server(server_name)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Health check of {server_name} failed: {str(e) or type(e).__name__}")
+
+    @staticmethod
+    def _server_fingerprint(script_path: Path) -> str:
+        """Fingerprint of a provider's tool definitions (its script plus the protocol version)"""
+        digest = hashlib.sha256(MCP_PROTOCOL_VERSION.encode("utf-8"))
+        digest.update(script_path.read_bytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _load_tool_cache() -> Dict[str, Any]:
+        """Read cached tool schemas; a missing or unreadable cache is just empty"""
+        try:
+            with open(MCP_TOOL_CACHE, "rb") as f:
+                cache = codec.loads(f.read())
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, codec.DecodeError):
+            return {}
+
+    @staticmethod
+    def _save_tool_cache(cache: Dict[str, Any], previous: Dict[str, Any]):
+        """Write cached tool schemas atomically when they changed"""
+        if cache == previous:
+            return
+        try:
+            tmp_path = f"{MCP_TOOL_CACHE}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(codec.dumpb(cache))
+            os.replace(tmp_path, MCP_TOOL_CACHE)
+        except OSError as e:
+            logger.warning(f"Could not write MCP tool cache {MCP_TOOL_CACHE}: {e}")
+
+    def _daemon_socket_path(self, server_name: str) -> Optional[str]:
+        """Socket path of a running daemon for this server, if CDM_MCP_SOCKET_DIR has one"""
+        if not MCP_SOCKET_DIR:
+            return None
+        path = os.path.join(MCP_SOCKET_DIR, f"{server_name}.sock")
+        if os.path.exists(path):
+            return path
+        logger.warning(f"  → No daemon socket at {path}, spawning {server_name} over stdio")
+        return None
     
     async def _start_server_process(self, server_name: str, script_path: Path) -> subprocess.Process:
         """
@@ -100,26 +593,45 @@ class MCPClientManager:
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            env=os.environ.copy()
+            env=os.environ.copy(),
+            limit=MCP_LINE_LIMIT
         )
 
         logger.info(f"  → Process started with PID: {process.pid}")
         return process
 
-    async def _initialize_server(self, server_name: str):
+    async def _initialize_server(self, server_name: str, transport: Union[MCPConnection, MCPSocketPool]):
         """
-        Send initialize request to server and verify response
+        Initialize a server's stdio connection, or open the first pooled socket connection
         """
         logger.info(f"  → Initializing MCP server: {server_name}")
 
+        if isinstance(transport, MCPSocketPool):
+            await transport.warm()
+        else:
+            await self._initialize_connection(transport)
+
+    async def _initialize_connection(self, connection: MCPConnection):
+        """
+        Send initialize request on a connection, verify the response and apply negotiated framing
+        """
+
         # Send initialize request
         init_request = {
             "jsonrpc": "2.0",
             "id": self.next_id,
             "method": "initialize",
             "params": {
-                "protocolVersion": "2024-11-05",
-                "capabilities": {},
+                "protocolVersion": MCP_PROTOCOL_VERSION,
+                "capabilities": {
+                    # Ask for tool results as JSON in the envelope (no nested JSON string)
+                    # and offer length-prefixed framing for the rest of the session
+                    "experimental": {
+                        "structuredContent": True,
+                        "framing": [MCP_FRAMING] if MCP_FRAMING != FRAMING_NDJSON else [],
+                        "compression": [COMPRESSION_ZLIB] if MCP_COMPRESSION else [],
+                    }
+                },
                 "clientInfo": {
                     "name": "cdm-trade-insight",
                     "version": "1.0.0"
@@ -128,96 +640,108 @@ class MCPClientManager:
         }
         self.next_id += 1
 
-        response = await self._send_request(server_name, init_request)
+        # A provider that never answers initialize must not stall startup or a restart
+        response = await asyncio.wait_for(connection.handshake(init_request), MCP_CALL_TIMEOUT_S)
 
         if "error" in response:
             raise RuntimeError(f"Server initialization failed: {response['error']}")
 
-        logger.info(f"  → Server initialized: {response['result']['serverInfo']['name']}")
+        # Servers that don't know the extension answer without it and stay in line mode
+        experimental = response["result"].get("capabilities", {}).get("experimental") or {}
+        framing = experimental.get("framing") or FRAMING_NDJSON
+        connection.set_framing(framing, experimental.get("compression"))
+
+        logger.info(f"  → Server initialized: {response['result']['serverInfo']['name']} (framing: {framing})")
 
-    async def _send_request(self, server_name: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    async def _send_request(
+        self,
+        server_name: str,
+        request: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
         """
         Send a JSON-RPC request to a server and get response
         """
-        process = self.processes.get(server_name)
-        if not process:
-            raise RuntimeError(f"No process for server {server_name}")
-
-        # Send request
-        request_json = json.dumps(request) + "\n"
-        process.stdin.write(request_json.encode())
-        await process.stdin.drain()
+        transport = self.connections.get(server_name)
+        if not transport:
+            raise RuntimeError(f"No connection for server {server_name}")
 
-        # Read response
-        response_line = await process.stdout.readline()
-        response = json.loads(response_line.decode().strip())
-
-        return response
+        return await transport.request(request, timeout)
     
-    async def _discover_all_tools(self):
+    async def _list_server_tools(self, server_name: str) -> List[Dict[str, Any]]:
         """
-        Discover tools from all connected MCP servers and convert to Azure OpenAI format
+        Discover tools from a connected MCP server (MCP tool definitions)
         """
-        logger.info("Discovering tools from all MCP servers...")
-
-        for server_name in self.processes.keys():
-            try:
-                # Send tools/list request
-                list_request = {
-                    "jsonrpc": "2.0",
-                    "id": self.next_id,
-                    "method": "tools/list",
-                    "params": {}
-                }
-                self.next_id += 1
-
-                response = await self._send_request(server_name, list_request)
+        list_request = {
+            "jsonrpc": "2.0",
+            "id": self.next_id,
+            "method": "tools/list",
+            "params": {}
+        }
+        self.next_id += 1
 
-                if "error" in response:
-                    raise RuntimeError(f"Tool discovery failed: {response['error']}")
+        try:
+            response = await self._send_request(server_name, list_request)
+            if "error" in response:
+                raise RuntimeError(f"Tool discovery failed: {response['error']}")
+        except Exception as e:
+            logger.error(f"Failed to discover tools from {server_name}: {e}")
+            raise
 
-                server_tools = []
+        logger.info(f"Discovered {len(response['result']['tools'])} tools from {server_name}")
+        return response["result"]["tools"]
 
-                # Convert each MCP tool to Azure OpenAI function calling format
-                for tool in response["result"]["tools"]:
-                    azure_tool = {
-                        "type": "function",
-                        "function": {
-                            "name": tool["name"],
-                            "description": tool["description"],
-                            "parameters": tool["inputSchema"]
-                        }
-                    }
+    def _register_tools(self, server_name: str, tools: List[Dict[str, Any]]):
+        """
+        Convert a server's MCP tools to Azure OpenAI format and route them to the server
+        """
+        server_tools = []
+
+        # Convert each MCP tool to Azure OpenAI function calling format
+        for tool in tools:
+            azure_tool = {
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool["description"],
+                    "parameters": tool["inputSchema"]
+                }
+            }
 
-                    server_tools.append(azure_tool)
-                    self.available_tools.append(azure_tool)
-                    self.tool_to_server[tool["name"]] = server_name
+            server_tools.append(azure_tool)
+            self.available_tools.append(azure_tool)
+            self.tool_to_server[tool["name"]] = server_name
+            policy = CachePolicy.from_tool(tool)
+            if policy is not None:
+                self.cache_policies[tool["name"]] = policy
 
-                    logger.debug(f"  - {server_name}: {tool['name']}")
+            logger.debug(f"  - {server_name}: {tool['name']}")
 
-                self.server_tools[server_name] = server_tools
-                logger.info(f"Discovered {len(server_tools)} tools from {server_name}")
+        self.server_tools[server_name] = server_tools
 
-            except Exception as e:
-                logger.error(f"Failed to discover tools from {server_name}: {e}")
-                raise
-        
-        logger.info(f"Total tools discovered: {len(self.available_tools)}")
-    
-    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float] = None) -> Any:
         """
         Call a tool by name with given arguments
         Routes the call to the appropriate MCP server
 
+        The call is bounded by `timeout` (default CDM_MCP_CALL_TIMEOUT_S) and by the
+        current request deadline; the provider gets the same bound as
+        `_meta.timeoutMs` and a cancellation notice if the caller gives up first.
+
+        Results of tools that declare a cache policy are served from the
+        tool-result cache while fresh and must be treated as read-only.
+
         Args:
             tool_name: Name of the tool to call
             arguments: Tool arguments as dict
+            timeout: Seconds to wait for the result
 
         Returns:
             Tool result (parsed from MCP response)
 
         Raises:
             ValueError: If tool not found
+            TimeoutError: If the call or the request deadline timed out
             RuntimeError: If tool call fails
         """
         if not self._initialized:
@@ -230,36 +754,89 @@ class MCPClientManager:
             available_tools = ", ".join(self.tool_to_server.keys())
             raise ValueError(f"Tool '{tool_name}' not found. Available tools: {available_tools}")
 
+        policy = self.cache_policies.get(tool_name) if MCP_RESULT_CACHE else None
+        if policy is None:
+            return await self._call_tool(server_name, tool_name, arguments, timeout)
+        # Served from the result cache; concurrent identical calls share one provider call
+        return await self.result_cache.get_or_load(
+            policy.key(tool_name, arguments),
+            policy.ttl_s,
+            lambda: self._call_tool(server_name, tool_name, arguments, timeout)
+        )
+
+    async def _call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float]) -> Any:
+        """
+        Send one tools/call to a server and decode its result (see call_tool), timing it
+        """
+        with mcp_call_seconds.time(server=server_name, tool=tool_name, outcome="error") as labels, \
+                tracing.span(f"mcp {tool_name}", {"mcp.server": server_name, "mcp.tool": tool_name}, kind=tracing.CLIENT):
+            try:
+                result = await self._send_tool_call(server_name, tool_name, arguments, timeout)
+            except TimeoutError:
+                labels["outcome"] = "timeout"
+                raise
+            labels["outcome"] = "ok"
+            return result
+
+    async def _send_tool_call(self, server_name: str, tool_name: str, arguments: Dict[str, Any], timeout: Optional[float]) -> Any:
+        """
+        Send one tools/call to a server and decode its result
+        """
         try:
+            # Deferred servers are spawned on their first tool call
+            await self._ensure_connected(server_name)
+
             # Send tools/call request
+            call_timeout = timeout_for(timeout or MCP_CALL_TIMEOUT_S)
             call_request = {
                 "jsonrpc": "2.0",
                 "id": self.next_id,
                 "method": "tools/call",
                 "params": {
                     "name": tool_name,
-                    "arguments": arguments
+                    "arguments": arguments,
+                    "_meta": {"timeoutMs": int(call_timeout * 1000)}
                 }
             }
             self.next_id += 1
+            traceparent = tracing.current_traceparent()
+            if traceparent:
+                # The provider continues the trace under this call's span
+                call_request["params"]["_meta"]["traceparent"] = traceparent
 
             logger.debug(f"Calling tool '{tool_name}' on server '{server_name}' with args: {arguments}")
-            response = await self._send_request(server_name, call_request)
+            transport = self.connections.get(server_name)
+            try:
+                response = await self._send_request(server_name, call_request, call_timeout)
+            except ConnectionError as e:
+                # The provider died under this request. Every tool is read-only, so
+                # fail over once to a fresh process (or another pooled connection)
+                logger.warning(f"Connection to {server_name} lost during '{tool_name}': {e}; retrying")
+                await self._restart_server(server_name, transport, str(e))
+                await self._ensure_connected(server_name)
+                call_timeout = timeout_for(timeout or MCP_CALL_TIMEOUT_S)
+                call_request["params"]["_meta"]["timeoutMs"] = int(call_timeout * 1000)
+                response = await self._send_request(server_name, call_request, call_timeout)
 
             if "error" in response:
                 raise RuntimeError(f"Tool call failed: {response['error']}")
 
             # Parse MCP response
-            # MCP returns result with content array
-            content = response["result"]["content"]
+            # Structured results are already decoded with the envelope
+            result = response["result"]
+            if "structuredContent" in result:
+                return result["structuredContent"]
+
+            # Otherwise MCP returns result with content array
+            content = result["content"]
             if content and len(content) > 0:
                 # Get the first content item (usually text)
                 content_item = content[0]
                 if content_item["type"] == "text":
                     text = content_item["text"]
                     try:
-                        return json.loads(text)
-                    except json.JSONDecodeError:
+                        return codec.loads(text)
+                    except codec.DecodeError:
                         # Return as-is if not JSON
                         return text
                 else:
@@ -269,6 +846,13 @@ class MCPClientManager:
             # Empty result
             return {}
 
+        except (asyncio.TimeoutError, TimeoutError) as e:
+            # Timeouts (and DeadlineExceeded) stay TimeoutErrors so callers can tell them apart
+            if isinstance(e, TimeoutError) and str(e):
+                logger.warning(f"Tool '{tool_name}' on server '{server_name}' timed out: {e}")
+                raise
+            logger.warning(f"Tool '{tool_name}' on server '{server_name}' timed out after {call_timeout:.1f}s")
+            raise TimeoutError(f"Tool '{tool_name}' timed out") from e
         except Exception as e:
             logger.error(f"Error calling tool '{tool_name}' on server '{server_name}': {e}")
             raise RuntimeError(f"Tool call failed: {e}")
@@ -279,32 +863,87 @@ class MCPClientManager:
         """
         logger.info("Shutting down MCP client manager...")
 
-        for server_name, process in self.processes.items():
-            try:
-                logger.debug(f"Terminating process for {server_name}")
-                # Terminate the process
-                process.terminate()
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
 
-                # Wait for it to finish
-                try:
-                    await asyncio.wait_for(process.wait(), timeout=5.0)
-                    logger.debug(f"Process {server_name} terminated cleanly")
-                except asyncio.TimeoutError:
-                    logger.warning(f"Process {server_name} didn't terminate cleanly, killing...")
-                    process.kill()
-                    await process.wait()
+        for server_name, transport in self.connections.items():
+            try:
+                await transport.close()
+            except Exception as e:
+                logger.error(f"Error closing connection to {server_name}: {e}")
 
+        for server_name, process in self.processes.items():
+            try:
+                await self._stop_process(server_name, process)
             except Exception as e:
                 logger.error(f"Error terminating {server_name}: {e}")
 
+        # Pumps finish on their own once the processes' stderr closes
+        if self._stderr_tasks:
+            await asyncio.gather(*self._stderr_tasks.values(), return_exceptions=True)
+            self._stderr_tasks.clear()
+
         self.processes.clear()
+        self.connections.clear()
         self.server_tools.clear()
         self.tool_to_server.clear()
         self.available_tools.clear()
+        self.cache_policies.clear()
+        self.result_cache.invalidate()
         self._initialized = False
 
         logger.info("MCP client manager shut down")
     
+    async def _collect(self, method: str) -> List[tuple]:
+        """
+        Send a request every provider answers itself (see common.mcp_server) to each
+        connected provider; returns (server_name, result) for those that answered
+        """
+        results = []
+        for server_name in list(self.connections):
+            request = {"jsonrpc": "2.0", "id": self.next_id, "method": method}
+            self.next_id += 1
+            try:
+                response = await self._send_request(server_name, request, MCP_PING_TIMEOUT_S)
+            except (asyncio.TimeoutError, ConnectionError, RuntimeError) as e:
+                logger.debug(f"No {method} answer from {server_name}: {e}")
+                continue
+            if "result" in response:
+                results.append((server_name, response["result"]))
+        return results
+
+    async def collect_metrics(self) -> List[tuple]:
+        """
+        Metrics snapshots of the connected providers, as (labels, snapshot) pairs for
+        common.metrics.render(); providers that don't answer are left out
+        """
+        return [
+            ({"process": server_name}, result["metrics"])
+            for server_name, result in await self._collect(METRICS_SNAPSHOT) if "metrics" in result
+        ]
+
+    async def collect_query_stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Statement statistics (common.query_log.report()) of each connected provider
+        """
+        return {
+            server_name: result["queries"]
+            for server_name, result in await self._collect(QUERY_STATS) if "queries" in result
+        }
+
+    async def collect_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Statistics of the caches each connected provider registered (common.mcp_server.register_cache_stats)
+        """
+        return {
+            server_name: result["caches"]
+            for server_name, result in await self._collect(CACHE_STATS) if "caches" in result
+        }
+
     def get_available_tools(self) -> List[Dict[str, Any]]:
         """
         Get all available tools in Azure OpenAI function calling format
@@ -313,6 +952,31 @@ class MCPClientManager:
             raise RuntimeError("MCP client not initialized. Call start() first.")
         return self.available_tools
     
+    def get_tools(self, names: Sequence[str]) -> List[Dict[str, Any]]:
+        """
+        Get the named tools in Azure OpenAI function calling format, in the given order
+        (tools that aren't available are left out)
+        """
+        if not self._initialized:
+            raise RuntimeError("MCP client not initialized. Call start() first.")
+        by_name = {tool["function"]["name"]: tool for tool in self.available_tools}
+        return [by_name[name] for name in names if name in by_name]
+    
+    def invalidate_result_cache(self) -> int:
+        """
+        Drop all cached tool results; returns how many entries were dropped
+        """
+        count = self.result_cache.invalidate()
+        logger.info(f"Tool result cache invalidated ({count} entries)")
+        return count
+
+    def _on_trade_data_changed(self, table: Optional[str]):
+        """
+        NOTIFY handler for ingested trade data; also called (with None) whenever the
+        listener (re)connects, since notifications sent while it was down are lost
+        """
+        self.invalidate_result_cache()
+
     def is_initialized(self) -> bool:
         """
         Check if the MCP client is initialized and ready
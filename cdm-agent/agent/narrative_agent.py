@@ -7,9 +7,15 @@ import os
 import json
 import time
 import logging
-from typing import Dict, Any, Callable, Optional
-from openai import AsyncAzureOpenAI
+from typing import Dict, Any, Callable, List, Optional, Sequence
+from agent.compaction import compact_result
+from agent.llm_backend import create_client, message_dict
+from agent.llm_scheduler import INTERACTIVE, LLMScheduler
 from agent.mcp_client import MCPClientManager
+from agent.narrative_templates import NARRATIVE_TEMPLATES, TemplateStore, event_context, load_event_data
+from agent.rule_narratives import RULE_NARRATIVES, rule_narrative
+from agent.tool_cache import memoized
+from common import metrics, tracing
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -18,19 +24,15 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# Lazy initialization of Azure OpenAI client
+# Lazy initialization of the LLM client (Azure OpenAI unless CDM_LLM_BACKEND says otherwise)
 _client = None
 
 
 def get_openai_client():
-    """Get or create Azure OpenAI client (lazy initialization)"""
+    """Get or create the chat completions client for the configured LLM backend (lazy initialization)"""
     global _client
     if _client is None:
-        _client = AsyncAzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
+        _client = create_client()
     return _client
 
 
@@ -40,7 +42,101 @@ DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
 MAX_TOOL_CALLS = 3
 MAX_EVENT_TOKENS = 150
 MAX_TRADE_TOKENS = 400
-TOOL_RESULT_MAX_CHARS = 2000
+# Token budget per tool result after compaction (about the old 2000-character cap)
+TOOL_RESULT_MAX_TOKENS = int(os.getenv("CDM_TOOL_RESULT_MAX_TOKENS", "600"))
+# Budget for tool results the model has already responded to, on later turns
+USED_TOOL_RESULT_MAX_TOKENS = int(os.getenv("CDM_USED_TOOL_RESULT_MAX_TOKENS", "200"))
+
+# Tools offered per narrative type, in a fixed order so the prompt prefix
+# (tools + system prompt) is identical across requests and turns and can be cached
+EVENT_NARRATIVE_TOOLS = ("get_lineage", "diff_states", "get_business_event")
+TRADE_NARRATIVE_TOOLS = ("get_trade_lineage", "get_lineage", "diff_states")
+
+# System prompts: static, so together with the tool list they form a cacheable prompt prefix
+EVENT_SYSTEM_PROMPT = f"""You are a financial trade analyst generating concise event narratives.
+
+Your task: Explain what happened in this specific trade event in 2-3 professional sentences.
+
+Guidelines:
+- Be clear and specific about what changed
+- Use financial terminology appropriately
+- Focus on the business impact
+- Keep it concise (2-3 sentences maximum)
+- Use past tense for completed events
+
+You have access to MCP tools to gather context. You should:
+1. Call get_lineage to understand before/after relationships
+2. Call diff_states if there's a previous state to compare
+
+IMPORTANT: After gathering the necessary context (typically 1-2 tool calls), you MUST generate the narrative text. Do not keep requesting more tools - use the data you have to write the narrative.
+
+Maximum {MAX_TOOL_CALLS} tool calls allowed. Once you have sufficient context, generate the narrative immediately."""
+
+TRADE_SYSTEM_PROMPT = f"""You are a financial trade analyst generating comprehensive trade narratives.
+
+Your task: Create a comprehensive, neutral summary of this trade's complete lifecycle from execution to current state.
+
+Guidelines:
+- Provide a cohesive story from start to current state
+- Highlight key events and transitions
+- Explain the business context and implications
+- Use professional financial terminology
+- Structure: Opening (execution) → Key changes → Current status
+- Length: 4-6 sentences for comprehensive coverage
+
+You have access to MCP tools. Use get_trade_lineage to get the full timeline.
+
+Maximum {MAX_TOOL_CALLS} tool calls allowed."""
+
+# Per LLM request timeout (seconds); also capped by the request deadline
+LLM_TIMEOUT_S = float(os.getenv("CDM_LLM_TIMEOUT_S", "60"))
+
+# LLM admission control shared by all narrative generations (see agent.llm_scheduler):
+# requests in flight, deployment quota in tokens per minute (0 = don't budget) and
+# retries on rate-limit / transient errors
+LLM_MAX_CONCURRENCY = int(os.getenv("CDM_LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("CDM_LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_RETRIES = int(os.getenv("CDM_LLM_MAX_RETRIES", "4"))
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+    max_retries=LLM_MAX_RETRIES
+)
+
+# Event narrative templates by event signature (see agent.narrative_templates)
+narrative_templates = TemplateStore()
+
+
+llm_request_seconds = metrics.histogram(
+    "cdm_llm_request_duration_seconds",
+    "Chat completion latency including scheduler queueing and retries",
+    ("deployment", "outcome")
+)
+llm_tokens = metrics.counter(
+    "cdm_llm_tokens_total", "Tokens reported by chat completions", ("deployment", "kind")
+)
+
+
+async def complete_chat(priority: int = INTERACTIVE, **kwargs):
+    """Chat completion through the shared LLM scheduler (kwargs as for chat.completions.create)"""
+    deployment = kwargs.get("model", DEPLOYMENT_NAME)
+    with llm_request_seconds.time(deployment=deployment, outcome="error") as labels, \
+            tracing.span("llm chat.completions", {"llm.deployment": deployment, "llm.tools": len(kwargs.get("tools") or [])}) as span:
+        response = await llm_scheduler.complete(get_openai_client(), priority=priority, timeout_s=LLM_TIMEOUT_S, **kwargs)
+        labels["outcome"] = "ok"
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached = (details.cached_tokens or 0) if details else 0
+            llm_tokens.inc(usage.prompt_tokens, deployment=deployment, kind="prompt")
+            llm_tokens.inc(cached, deployment=deployment, kind="cached_prompt")
+            llm_tokens.inc(usage.completion_tokens, deployment=deployment, kind="completion")
+            if span is not None:
+                span.set(**{"llm.prompt_tokens": usage.prompt_tokens, "llm.cached_tokens": cached,
+                            "llm.completion_tokens": usage.completion_tokens})
+    return response
+
 
 # Global MCP client instance (initialized by FastAPI lifespan)
 mcp_client: Optional[MCPClientManager] = None
@@ -56,10 +152,13 @@ def set_mcp_client(client: MCPClientManager):
     logger.info("MCP client set for narrative agent")
 
 
-def get_mcp_tools() -> list:
+def get_mcp_tools(names: Optional[Sequence[str]] = None) -> list:
     """
     Get dynamically discovered MCP tools in Azure OpenAI format
     
+    Args:
+        names: Only these tools, in this order (default: all tools)
+    
     Returns:
         List of tools in Azure OpenAI function calling format
         
@@ -69,19 +168,14 @@ def get_mcp_tools() -> list:
     if mcp_client is None:
         raise RuntimeError("MCP client not initialized. Call set_mcp_client() first.")
     
-    return mcp_client.get_available_tools()
-
-def truncate_result(result: Any, max_chars: int = TOOL_RESULT_MAX_CHARS) -> Any:
-    """Truncate large tool results to prevent token overflow"""
-    result_str = json.dumps(result)
-    if len(result_str) > max_chars:
-        truncated = result_str[:max_chars] + "... [truncated]"
-        return {"_truncated": True, "preview": truncated}
-    return result
+    if names is None:
+        return mcp_client.get_available_tools()
+    return mcp_client.get_tools(names)
 
 async def call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
     """
     Call MCP tool via MCP client using JSON-RPC protocol
+    Memoized for the duration of the current API request (see RequestMemoMiddleware)
     
     Args:
         tool_name: Name of the tool to call
@@ -97,13 +191,39 @@ async def call_mcp_tool(tool_name: str, arguments: Dict[str, Any]) -> Dict[str,
     if mcp_client is None:
         raise RuntimeError("MCP client not initialized. Cannot call tools.")
     
-    return await mcp_client.call_tool(tool_name, arguments)
+    # Identical calls within one API request (route and LLM agent alike) run once
+    return await memoized(tool_name, arguments, lambda: mcp_client.call_tool(tool_name, arguments))
+
+
+def compact_used_tool_results(tool_results: List[Dict[str, Any]]):
+    """
+    Shrink tool messages the model has already responded to (once each)
+
+    Args:
+        tool_results: {"message", "tool", "result"} for each tool message in the
+            conversation; "result" is dropped once the message is compacted
+    """
+    for entry in tool_results:
+        if "result" in entry:
+            _, entry["message"]["content"] = compact_result(entry["tool"], entry.pop("result"), USED_TOOL_RESULT_MAX_TOKENS)
+
+
+def add_usage(totals: Dict[str, int], usage: Any):
+    """Accumulate one response's token usage into `totals` (input/cached_input/output/total)"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    totals["input"] = totals.get("input", 0) + usage.prompt_tokens
+    totals["cached_input"] = totals.get("cached_input", 0) + ((details.cached_tokens or 0) if details else 0)
+    totals["output"] = totals.get("output", 0) + usage.completion_tokens
+    totals["total"] = totals.get("total", 0) + usage.total_tokens
 
 async def generate_event_narrative(
     trade_id: str,
     event_id: str,
     trade_state_id: str,
-    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    priority: int = INTERACTIVE
 ) -> Dict[str, Any]:
     """
     Generate narrative for a specific event using Azure OpenAI with MCP tools
@@ -113,6 +233,7 @@ async def generate_event_narrative(
         event_id: Event identifier
         trade_state_id: Trade state identifier
         progress_callback: Optional callback for SSE progress updates
+        priority: LLM scheduling priority (INTERACTIVE or BACKGROUND)
     
     Returns:
         Dictionary with narrative and metadata
@@ -130,30 +251,57 @@ async def generate_event_narrative(
     
     try:
         emit_progress("tool_discovery", message=f"Starting event narrative generation for {event_id}")
+        
+        # Simple lifecycle events are described by rules; structurally identical
+        # events reuse the template of an earlier narrative
+        template_context = None
+        if RULE_NARRATIVES or NARRATIVE_TEMPLATES:
+            narrative_text, source = None, None
+            try:
+                event_data = await load_event_data(call_mcp_tool, trade_state_id)
+                if RULE_NARRATIVES:
+                    narrative_text = rule_narrative(*event_data)
+                    source = {"model": "rules", "from_rules": True} if narrative_text else None
+                if narrative_text is None and NARRATIVE_TEMPLATES:
+                    template_context = event_context(*event_data)
+                    reused = narrative_templates.lookup(*template_context)
+                    if reused is not None:
+                        narrative_text, template = reused
+                        source = {
+                            "model": "template",
+                            "from_template": True,
+                            "template": {"signature_key": template["signature_key"], "confidence": template["confidence"]}
+                        }
+            except Exception as e:
+                logger.warning(f"Narrative fast path failed for {trade_state_id}, using the LLM: {e}")
+                narrative_text = None
+            if narrative_text is not None:
+                total_time = (time.time() - start_time) * 1000
+                metadata = {
+                    **source,
+                    "tokens_used": {},
+                    "generation_time_ms": total_time,
+                    "tool_calls": [],
+                    "from_storage": False
+                }
+                emit_progress("complete", narrative=narrative_text, metadata=metadata, message=f"Event narrative complete (from {source['model']}).")
+                return {
+                    "narrative": narrative_text,
+                    "metadata": metadata
+                }
+        
+        def learn_template(narrative: str):
+            if template_context is None:
+                return
+            try:
+                narrative_templates.learn(*template_context, narrative)
+            except Exception as e:
+                logger.warning(f"Could not record narrative template for {trade_state_id}: {e}")
+        
         emit_progress("tool_discovery", message="Setting up the narrative agent...")
-        emit_progress("tool_discovery", message="Available tools: get_lineage (event context), diff_states (compare changes), get_trade_lineage (full timeline)")
+        emit_progress("tool_discovery", message=f"Available tools: {', '.join(EVENT_NARRATIVE_TOOLS)}")
         emit_progress("tool_discovery", message="Ready to analyze this event.")
         
-        # System prompt for event narratives
-        system_prompt = f"""You are a financial trade analyst generating concise event narratives.
-
-Your task: Explain what happened in this specific trade event in 2-3 professional sentences.
-
-Guidelines:
-- Be clear and specific about what changed
-- Use financial terminology appropriately
-- Focus on the business impact
-- Keep it concise (2-3 sentences maximum)
-- Use past tense for completed events
-
-You have access to MCP tools to gather context. You should:
-1. Call get_lineage to understand before/after relationships
-2. Call diff_states if there's a previous state to compare
-
-IMPORTANT: After gathering the necessary context (typically 1-2 tool calls), you MUST generate the narrative text. Do not keep requesting more tools - use the data you have to write the narrative.
-
-Maximum {MAX_TOOL_CALLS} tool calls allowed. Once you have sufficient context, generate the narrative immediately."""
-
         user_prompt = f"""Generate a narrative for this trade event:
 
 Trade ID: {trade_id}
@@ -163,23 +311,25 @@ Trade State ID: {trade_state_id}
 Use the available tools to gather context, then write a clear 2-3 sentence explanation of what happened."""
 
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": EVENT_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
         
-        # Get dynamically discovered MCP tools
-        mcp_tools = get_mcp_tools()
+        # Tools relevant to event narratives (dynamically discovered over MCP)
+        mcp_tools = get_mcp_tools(EVENT_NARRATIVE_TOOLS)
         
         # LLM interaction with function calling
         tool_call_count = 0
+        tool_results = []
+        tokens_used = {}
         
         while tool_call_count < MAX_TOOL_CALLS:
             emit_progress("llm_generating", message=f"Consulting Azure OpenAI ({DEPLOYMENT_NAME})...", model=DEPLOYMENT_NAME)
             emit_progress("llm_generating", message=f"Analyzing event data (budget: {MAX_EVENT_TOKENS} tokens)...")
             
-            client = get_openai_client()
             logger.debug(f"Azure OpenAI request - messages count: {len(messages)}, tools count: {len(mcp_tools)}")
-            response = await client.chat.completions.create(
+            response = await complete_chat(
+                priority=priority,
                 model=DEPLOYMENT_NAME,
                 messages=messages,
                 tools=mcp_tools,
@@ -188,13 +338,17 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
                 temperature=0.7
             )
             logger.debug(f"Azure OpenAI response - choices: {len(response.choices)}, tool_calls: {len(response.choices[0].message.tool_calls) if response.choices[0].message.tool_calls else 0}")
+            add_usage(tokens_used, response.usage)
             
             message = response.choices[0].message
             
             # Check if LLM wants to call tools
             if message.tool_calls:
+                # The model has seen the earlier tool results; later turns get them compacted
+                compact_used_tool_results(tool_results)
+                
                 # Process tool calls
-                messages.append(message)
+                messages.append(message_dict(message))
                 
                 for tool_call in message.tool_calls:
                     tool_name = tool_call.function.name
@@ -214,25 +368,26 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
                         tool_result = await call_mcp_tool(tool_name, tool_args)
                         tool_duration = (time.time() - tool_start) * 1000
 
-                        logger.debug(f"Tool {tool_name} returned: {tool_result}")
-                        
-                        # Truncate large results
-                        truncated_result = truncate_result(tool_result)
+                        # Compact the result to fit the token budget (always valid JSON)
+                        compacted_result, compacted_text = compact_result(tool_name, tool_result, TOOL_RESULT_MAX_TOKENS)
+                        logger.debug(f"Tool {tool_name} returned {len(compacted_text)} chars after compaction")
                         
                         emit_progress(
                             "tool_response",
                             tool=tool_name,
-                            result=truncated_result,
+                            result=compacted_result,
                             duration_ms=tool_duration,
                             message=f"Got data from {tool_name} (took {tool_duration:.0f}ms). Reviewing the information..."
                         )
                         
                         # Add tool result to conversation
-                        messages.append({
+                        tool_message = {
                             "role": "tool",
                             "tool_call_id": tool_call.id,
-                            "content": json.dumps(truncated_result)
-                        })
+                            "content": compacted_text
+                        }
+                        messages.append(tool_message)
+                        tool_results.append({"message": tool_message, "tool": tool_name, "result": tool_result})
                         
                         # Track for metadata
                         tool_calls_made.append({
@@ -263,17 +418,14 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
                     
                     metadata = {
                         "model": DEPLOYMENT_NAME,
-                        "tokens_used": {
-                            "input": response.usage.prompt_tokens,
-                            "output": response.usage.completion_tokens,
-                            "total": response.usage.total_tokens
-                        },
+                        "tokens_used": tokens_used,
                         "generation_time_ms": total_time,
                         "tool_calls": tool_calls_made,
                         "from_storage": False
                     }
                     
-                    emit_progress("llm_generating", message=f"Narrative generated. Used {response.usage.total_tokens} tokens in {total_time:.0f}ms")
+                    learn_template(narrative_text)
+                    emit_progress("llm_generating", message=f"Narrative generated. Used {tokens_used.get('total', 0)} tokens in {total_time:.0f}ms")
                     emit_progress("complete", narrative=narrative_text, metadata=metadata, message="Event narrative complete.")
                     
                     return {
@@ -283,13 +435,14 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
         
         # If we exit loop without narrative, force completion by making final call without tools
         emit_progress("llm_generating", message="Forcing narrative generation with collected data...")
-        client = get_openai_client()
-        final_response = await client.chat.completions.create(
+        final_response = await complete_chat(
+            priority=priority,
             model=DEPLOYMENT_NAME,
             messages=messages,
             max_tokens=MAX_EVENT_TOKENS,
             temperature=0.7
         )
+        add_usage(tokens_used, final_response.usage)
         
         narrative_text = final_response.choices[0].message.content
         if not narrative_text:
@@ -299,18 +452,15 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
         
         metadata = {
             "model": DEPLOYMENT_NAME,
-            "tokens_used": {
-                "input": final_response.usage.prompt_tokens,
-                "output": final_response.usage.completion_tokens,
-                "total": final_response.usage.total_tokens
-            },
+            "tokens_used": tokens_used,
             "generation_time_ms": total_time,
             "tool_calls": tool_calls_made,
             "from_storage": False,
             "forced_completion": True
         }
         
-        emit_progress("llm_generating", message=f"Narrative generated. Used {final_response.usage.total_tokens} tokens in {total_time:.0f}ms")
+        learn_template(narrative_text)
+        emit_progress("llm_generating", message=f"Narrative generated. Used {tokens_used.get('total', 0)} tokens in {total_time:.0f}ms")
         emit_progress("complete", narrative=narrative_text, metadata=metadata, message="Event narrative complete.")
         
         return {
@@ -324,7 +474,8 @@ Use the available tools to gather context, then write a clear 2-3 sentence expla
 
 async def generate_trade_narrative(
     trade_id: str,
-    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    priority: int = INTERACTIVE
 ) -> Dict[str, Any]:
     """
     Generate comprehensive trade-level narrative
@@ -332,6 +483,7 @@ async def generate_trade_narrative(
     Args:
         trade_id: Trade identifier
         progress_callback: Optional callback for SSE progress updates
+        priority: LLM scheduling priority (INTERACTIVE or BACKGROUND)
     
     Returns:
         Dictionary with narrative and metadata
@@ -350,25 +502,9 @@ async def generate_trade_narrative(
     try:
         emit_progress("tool_discovery", message=f"Starting comprehensive trade narrative generation for {trade_id}")
         emit_progress("tool_discovery", message="Preparing to analyze the complete trade lifecycle...")
-        emit_progress("tool_discovery", message="Available tools: get_lineage (event context), diff_states (compare changes), get_trade_lineage (full timeline)")
+        emit_progress("tool_discovery", message=f"Available tools: {', '.join(TRADE_NARRATIVE_TOOLS)}")
         emit_progress("tool_discovery", message="Ready to generate trade narrative.")
         
-        system_prompt = f"""You are a financial trade analyst generating comprehensive trade narratives.
-
-Your task: Create a comprehensive, neutral summary of this trade's complete lifecycle from execution to current state.
-
-Guidelines:
-- Provide a cohesive story from start to current state
-- Highlight key events and transitions
-- Explain the business context and implications
-- Use professional financial terminology
-- Structure: Opening (execution) → Key changes → Current status
-- Length: 4-6 sentences for comprehensive coverage
-
-You have access to MCP tools. Use get_trade_lineage to get the full timeline.
-
-Maximum {MAX_TOOL_CALLS} tool calls allowed."""
-
         user_prompt = f"""Generate a comprehensive narrative for this trade:
 
 Trade ID: {trade_id}
@@ -376,22 +512,24 @@ Trade ID: {trade_id}
 Use get_trade_lineage to understand the full lifecycle, then write a professional narrative."""
 
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": TRADE_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
         
-        # Get dynamically discovered MCP tools
-        mcp_tools = get_mcp_tools()
+        # Tools relevant to trade narratives (dynamically discovered over MCP)
+        mcp_tools = get_mcp_tools(TRADE_NARRATIVE_TOOLS)
         
         # LLM interaction (similar to event narrative but with higher token limit)
         tool_call_count = 0
+        tool_results = []
+        tokens_used = {}
         
         while tool_call_count < MAX_TOOL_CALLS:
             emit_progress("llm_generating", message=f"🤖 Consulting Azure OpenAI ({DEPLOYMENT_NAME})...", model=DEPLOYMENT_NAME)
             emit_progress("llm_generating", message=f"💭 AI is analyzing the complete trade history (budget: {MAX_TRADE_TOKENS} tokens)...")
             
-            client = get_openai_client()
-            response = await client.chat.completions.create(
+            response = await complete_chat(
+                priority=priority,
                 model=DEPLOYMENT_NAME,
                 messages=messages,
                 tools=mcp_tools,
@@ -400,10 +538,13 @@ Use get_trade_lineage to understand the full lifecycle, then write a professiona
                 temperature=0.7
             )
             
+            add_usage(tokens_used, response.usage)
             message = response.choices[0].message
             
             if message.tool_calls:
-                messages.append(message)
+                # The model has seen the earlier tool results; later turns get them compacted
+                compact_used_tool_results(tool_results)
+                messages.append(message_dict(message))
                 
                 for tool_call in message.tool_calls:
                     tool_name = tool_call.function.name
@@ -417,15 +558,17 @@ Use get_trade_lineage to understand the full lifecycle, then write a professiona
                         tool_result = await call_mcp_tool(tool_name, tool_args)
                         tool_duration = (time.time() - tool_start) * 1000
                         
-                        truncated_result = truncate_result(tool_result)
+                        compacted_result, compacted_text = compact_result(tool_name, tool_result, TOOL_RESULT_MAX_TOKENS)
                         
-                        emit_progress("tool_response", tool=tool_name, result=truncated_result, duration_ms=tool_duration, message=f"Got data from {tool_name} (took {tool_duration:.0f}ms). Processing the information...")
+                        emit_progress("tool_response", tool=tool_name, result=compacted_result, duration_ms=tool_duration, message=f"Got data from {tool_name} (took {tool_duration:.0f}ms). Processing the information...")
                         
-                        messages.append({
+                        tool_message = {
                             "role": "tool",
                             "tool_call_id": tool_call.id,
-                            "content": json.dumps(truncated_result)
-                        })
+                            "content": compacted_text
+                        }
+                        messages.append(tool_message)
+                        tool_results.append({"message": tool_message, "tool": tool_name, "result": tool_result})
                         
                         tool_calls_made.append({
                             "tool": tool_name,
@@ -452,17 +595,13 @@ Use get_trade_lineage to understand the full lifecycle, then write a professiona
                     
                     metadata = {
                         "model": DEPLOYMENT_NAME,
-                        "tokens_used": {
-                            "input": response.usage.prompt_tokens,
-                            "output": response.usage.completion_tokens,
-                            "total": response.usage.total_tokens
-                        },
+                        "tokens_used": tokens_used,
                         "generation_time_ms": total_time,
                         "tool_calls": tool_calls_made,
                         "from_storage": False
                     }
                     
-                    emit_progress("llm_generating", message=f"Comprehensive narrative generated. Used {response.usage.total_tokens} tokens in {total_time:.0f}ms")
+                    emit_progress("llm_generating", message=f"Comprehensive narrative generated. Used {tokens_used.get('total', 0)} tokens in {total_time:.0f}ms")
                     emit_progress("complete", narrative=narrative_text, metadata=metadata, message="Trade narrative complete.")
                     
                     return {
@@ -472,13 +611,14 @@ Use get_trade_lineage to understand the full lifecycle, then write a professiona
         
         # If we exit loop without narrative, force completion by making final call without tools
         emit_progress("llm_generating", message="Forcing narrative generation with collected data...")
-        client = get_openai_client()
-        final_response = await client.chat.completions.create(
+        final_response = await complete_chat(
+            priority=priority,
             model=DEPLOYMENT_NAME,
             messages=messages,
             max_tokens=MAX_TRADE_TOKENS,
             temperature=0.7
         )
+        add_usage(tokens_used, final_response.usage)
         
         narrative_text = final_response.choices[0].message.content
         if not narrative_text:
@@ -488,18 +628,14 @@ Use get_trade_lineage to understand the full lifecycle, then write a professiona
         
         metadata = {
             "model": DEPLOYMENT_NAME,
-            "tokens_used": {
-                "input": final_response.usage.prompt_tokens,
-                "output": final_response.usage.completion_tokens,
-                "total": final_response.usage.total_tokens
-            },
+            "tokens_used": tokens_used,
             "generation_time_ms": total_time,
             "tool_calls": tool_calls_made,
             "from_storage": False,
             "forced_completion": True
         }
         
-        emit_progress("llm_generating", message=f"Comprehensive narrative generated. Used {final_response.usage.total_tokens} tokens in {total_time:.0f}ms")
+        emit_progress("llm_generating", message=f"Comprehensive narrative generated. Used {tokens_used.get('total', 0)} tokens in {total_time:.0f}ms")
         emit_progress("complete", narrative=narrative_text, metadata=metadata, message="Trade narrative complete.")
         
         return {
@@ -0,0 +1,389 @@
+"""
+Narrative templates for structurally identical events
+
+Many events differ only in their values: a standard Confirmation, a Reset where only
+the rate moves. Each event gets a signature:
+
+    [event_type, intent, changed fields, product type]
+
+where the changed fields come from diff_states against the previous state (field
+changes with the direction of numeric ones, appended histories and normalized
+JSON Patch paths), so that e.g. a notional increase and decrease, which need
+different verbs, never share a template. After the LLM writes
+an event narrative, the concrete values it mentions (ids, dates, rates, notionals,
+parties) are replaced by `{fact|format}` placeholders and the result is stored for
+the signature. A later event with the same signature reuses the template, filled
+in with its own values, instead of calling the LLM.
+
+A template is only reused once the signature has been seen CDM_NARRATIVE_TEMPLATE_MIN_SAMPLES
+times and its confidence (the share of data values in the source narrative that
+were parameterized; numbers, dates, ids and capitalized names count as data, so a
+hardcoded third party lowers it) reaches CDM_NARRATIVE_TEMPLATE_MIN_CONFIDENCE; otherwise the
+event goes to the LLM.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agent.cache_manager import get_narrative_template, record_template_hit, save_narrative_template
+from agent.compaction import REFERENCE_KEYS, prune
+from common import codec
+from common.diff import fixed_rate, notional
+from common.transform import extract_currency, extract_dates, extract_parties, extract_product_type, map_intent_to_event_type
+
+logger = logging.getLogger(__name__)
+
+NARRATIVE_TEMPLATES = os.getenv("CDM_NARRATIVE_TEMPLATES", "true").lower() == "true"
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("CDM_NARRATIVE_TEMPLATE_MIN_CONFIDENCE", "0.9"))
+TEMPLATE_MIN_SAMPLES = int(os.getenv("CDM_NARRATIVE_TEMPLATE_MIN_SAMPLES", "2"))
+TEMPLATE_MAX_ENTRIES = 1024
+
+# JSON Patch paths are compared up to this depth, with list indices wildcarded
+PATCH_PATH_DEPTH = 4
+
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+_PLACEHOLDER = re.compile(r"\{(\w+)\|(\w+)\}")
+# Numbers, dates and identifiers: anything with a digit in it
+_DATA_TOKEN = re.compile(r"[A-Za-z]*\d[\w.,%/-]*")
+# Capitalized words; data (names of parties, products) unless they start a sentence
+_NAME_TOKEN = re.compile(r"(?<![\w-])[A-Z][\w&'-]*")
+_SENTENCE_END = (".", "!", "?", ":")
+# Shorter renderings (e.g. "1") would match too much of the text
+MIN_MATCH_CHARS = 3
+
+
+def _as_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def _as_date(value: Any) -> Optional[date]:
+    if not isinstance(value, str):
+        return None
+    match = _ISO_DATE.match(value)
+    if not match:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+
+
+def _integral(value: Optional[float]) -> bool:
+    return value is not None and value == int(value)
+
+
+# Renderings of a fact value as the LLM might write it; None where a format doesn't apply
+FORMATS: Dict[str, Callable[[Any], Optional[str]]] = {
+    "raw": lambda v: None if isinstance(v, (dict, list)) or v is None else (
+        f"{v:g}" if isinstance(v, float) else str(v)
+    ),
+    "comma": lambda v: f"{_as_number(v):,.0f}" if _integral(_as_number(v)) else None,
+    "comma2": lambda v: f"{_as_number(v):,.2f}" if _as_number(v) is not None else None,
+    "millions": lambda v: f"{_as_number(v) / 1e6:g} million" if (_as_number(v) or 0) >= 1e6 else None,
+    "pct": lambda v: f"{_as_number(v) * 100:g}%" if _as_number(v) is not None and abs(_as_number(v)) < 1 else None,
+    "pct2": lambda v: f"{_as_number(v) * 100:.2f}%" if _as_number(v) is not None and abs(_as_number(v)) < 1 else None,
+    "iso": lambda v: _as_date(v).isoformat() if _as_date(v) else None,
+    "mdy": lambda v: f"{_as_date(v):%B} {_as_date(v).day}, {_as_date(v).year}" if _as_date(v) else None,
+    "dmy": lambda v: f"{_as_date(v).day} {_as_date(v):%B %Y}" if _as_date(v) else None,
+}
+
+
+def _direction(old: Any, new: Any) -> str:
+    """up/down for a numeric change, set/unset when a side is missing, else changed"""
+    old_number, new_number = _as_number(old), _as_number(new)
+    if old_number is not None and new_number is not None:
+        return "up" if new_number > old_number else "down"
+    if old is None:
+        return "set"
+    if new is None:
+        return "unset"
+    return "changed"
+
+
+def changed_fields(diff: Optional[Dict[str, Any]]) -> List[str]:
+    """What an event changed, independent of the values: field changes, appends and patch paths"""
+    if diff is None:
+        return ["<initial state>"]
+    fields = set()
+    for field, change in (diff.get("changes") or {}).items():
+        if isinstance(change, dict) and change.get("changed"):
+            fields.add(f"{field}:{_direction(change.get('from'), change.get('to'))}")
+    for name, items in (diff.get("appends") or {}).items():
+        if items:
+            fields.add(f"+{name}")
+    for op in diff.get("patch") or []:
+        segments = [segment for segment in op.get("path", "").split("/")[1:]]
+        if any(segment in REFERENCE_KEYS for segment in segments):
+            continue
+        segments = ["*" if segment.isdigit() or segment == "-" else segment for segment in segments[:PATCH_PATH_DEPTH]]
+        fields.add(f"{op.get('op')} /{'/'.join(segments)}")
+    return sorted(fields)
+
+
+def event_signature(lineage: Dict[str, Any], diff: Optional[Dict[str, Any]], product_type: str) -> List[Any]:
+    """[event_type, intent, changed fields, product type] of an event"""
+    intent = lineage.get("intent") or "UNKNOWN"
+    return [
+        map_intent_to_event_type(intent, lineage.get("position_state")),
+        intent,
+        changed_fields(diff),
+        product_type or "Unknown",
+    ]
+
+
+def signature_key(signature: List[Any]) -> str:
+    """Stable hash of a signature"""
+    return hashlib.sha256(codec.dumps(signature).encode()).hexdigest()
+
+
+def event_facts(lineage: Dict[str, Any], diff: Optional[Dict[str, Any]], payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Concrete values of an event a narrative may mention, most specific first"""
+    intent = lineage.get("intent")
+    facts: Dict[str, Any] = {
+        "trade_id": lineage.get("trade_id"),
+        "event_id": lineage.get("event_id"),
+        "effective_date": lineage.get("effectiveDate"),
+        "position_state": lineage.get("position_state"),
+        # Part of the signature, so safe to parameterize; saves them counting as hardcoded names
+        "event_type": map_intent_to_event_type(intent or "UNKNOWN", lineage.get("position_state")),
+    }
+    if diff is not None:
+        for field, change in (diff.get("changes") or {}).items():
+            if isinstance(change, dict) and change.get("changed"):
+                facts[f"{field}_from"] = change.get("from")
+                facts[f"{field}_to"] = change.get("to")
+        appends = diff.get("appends") or {}
+        resets = appends.get("resetHistory") or []
+        if resets:
+            latest = prune(resets[-1])
+            if isinstance(latest, dict):
+                facts["reset_value"] = latest.get("resetValue")
+                facts["reset_date"] = latest.get("resetDate")
+        facts["resets_appended"] = len(resets)
+        facts["transfers_appended"] = len(appends.get("transferHistory") or [])
+    if payload is not None:
+        parties = extract_parties(payload)
+        dates = extract_dates(payload)
+        facts.update({
+            "product_type": extract_product_type(payload),
+            "notional": notional(payload),
+            "fixed_rate": fixed_rate(payload),
+            "currency": extract_currency(payload),
+            "bank": parties.get("bank"),
+            "counterparty": parties.get("counterparty"),
+            "start_date": dates.get("startDate"),
+            "maturity_date": dates.get("maturityDate"),
+        })
+    return {name: value for name, value in facts.items() if value not in (None, "", "Unknown")}
+
+
+async def load_event_data(
+    call_tool: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+    trade_state_id: str
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Fetch an event's lineage, diff against the previous state (None if initial) and payload"""
+    lineage = await call_tool("get_lineage", {"trade_state_id": trade_state_id})
+
+    async def previous_diff():
+        if not lineage.get("before"):
+            return None
+        return await call_tool("diff_states", {"from_state_id": lineage["before"], "to_state_id": trade_state_id})
+
+    diff, payload = await asyncio.gather(
+        previous_diff(),
+        call_tool("get_tradestate_payload", {"trade_state_id": trade_state_id})
+    )
+    return lineage, diff, payload
+
+
+def event_context(
+    lineage: Dict[str, Any],
+    diff: Optional[Dict[str, Any]],
+    payload: Optional[Dict[str, Any]]
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """An event's (signature, facts)"""
+    product_type = extract_product_type(payload) if payload else "Unknown"
+    return event_signature(lineage, diff, product_type), event_facts(lineage, diff, payload)
+
+
+def make_template(narrative: str, facts: Dict[str, Any]) -> Tuple[str, float]:
+    """Replace the fact values a narrative mentions by placeholders
+
+    Returns:
+        (template, confidence): confidence is the share of data tokens (anything
+        with a digit, and capitalized words not starting a sentence) in the
+        narrative that were parameterized
+    """
+    if "{" in narrative or "}" in narrative:
+        return narrative, 0.0
+
+    renderings: Dict[str, Tuple[str, str]] = {}
+    for name, value in facts.items():
+        for fmt, render in FORMATS.items():
+            text = render(value)
+            if text and len(text) >= MIN_MATCH_CHARS:
+                # The most specific fact claims a rendering first
+                renderings.setdefault(text, (name, fmt))
+    if not renderings:
+        return narrative, 0.0 if _data_tokens(narrative) else 1.0
+
+    alternatives = "|".join(re.escape(text) for text in sorted(renderings, key=len, reverse=True))
+    pattern = re.compile(rf"(?<![0-9A-Za-z])(?:{alternatives})(?![0-9A-Za-z])")
+
+    parts: List[str] = []
+    replaced: List[Tuple[int, int]] = []
+    position = 0
+    for match in pattern.finditer(narrative):
+        name, fmt = renderings[match.group(0)]
+        parts.append(narrative[position:match.start()])
+        parts.append(f"{{{name}|{fmt}}}")
+        replaced.append(match.span())
+        position = match.end()
+    parts.append(narrative[position:])
+
+    tokens = _data_tokens(narrative)
+    covered = sum(
+        1 for start, end in tokens
+        if any(r_start <= start and end <= r_end + 1 for r_start, r_end in replaced)
+    )
+    confidence = covered / len(tokens) if tokens else 1.0
+    return "".join(parts), confidence
+
+
+def _data_tokens(narrative: str) -> List[Tuple[int, int]]:
+    """Spans of the values in a narrative a template must not hardcode"""
+    spans = [token.span() for token in _DATA_TOKEN.finditer(narrative)]
+    for token in _NAME_TOKEN.finditer(narrative):
+        before = narrative[:token.start()].rstrip()
+        if not before or before.endswith(_SENTENCE_END):
+            continue
+        if not any(start <= token.start() < end for start, end in spans):
+            spans.append(token.span())
+    return sorted(spans)
+
+
+def render_template(template: str, facts: Dict[str, Any]) -> Optional[str]:
+    """Fill a template in with an event's facts (None if one is missing)"""
+    missing = False
+
+    def fill(match: "re.Match[str]") -> str:
+        nonlocal missing
+        render = FORMATS.get(match.group(2))
+        value = facts.get(match.group(1))
+        text = render(value) if render is not None and value is not None else None
+        if text is None:
+            missing = True
+            return ""
+        return text
+
+    narrative = _PLACEHOLDER.sub(fill, template)
+    return None if missing else narrative
+
+
+class TemplateStore:
+    """
+    Narrative templates by signature: an LRU in front of the narrative_templates table
+
+    Works from memory alone if the table isn't there (migration not applied).
+    """
+
+    def __init__(self, min_confidence: float = TEMPLATE_MIN_CONFIDENCE, min_samples: int = TEMPLATE_MIN_SAMPLES,
+                 max_entries: int = TEMPLATE_MAX_ENTRIES):
+        self.min_confidence = min_confidence
+        self.min_samples = min_samples
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._db = True
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_call(self, fn: Callable[..., Any], *args) -> Any:
+        if not self._db:
+            return None
+        try:
+            return fn(*args)
+        except Exception as e:
+            logger.warning(f"Narrative template storage unavailable, using memory only: {e}")
+            self._db = False
+            return None
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry["samples"] >= self.min_samples:
+            self._entries.move_to_end(key)
+            return entry
+        # Not ready locally; another process may have learned more
+        stored = self._db_call(get_narrative_template, key)
+        if stored:
+            entry = dict(stored)
+            self._remember(key, entry)
+        return entry
+
+    def lookup(self, signature: List[Any], facts: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Narrative for an event from its signature's template, if one is trusted
+
+        Returns:
+            (narrative, template info) or None to fall back to the LLM
+        """
+        key = signature_key(signature)
+        entry = self._get(key)
+        if entry is None or entry["samples"] < self.min_samples or entry["confidence"] < self.min_confidence:
+            self.misses += 1
+            return None
+        narrative = render_template(entry["template_text"], facts)
+        if narrative is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["hits"] = entry.get("hits", 0) + 1
+        self._db_call(record_template_hit, key)
+        return narrative, {
+            "signature": signature,
+            "signature_key": key,
+            "confidence": entry["confidence"],
+            "samples": entry["samples"],
+        }
+
+    def learn(self, signature: List[Any], facts: Dict[str, Any], narrative: str) -> None:
+        """Record an LLM narrative as a template for its signature"""
+        template, confidence = make_template(narrative, facts)
+        key = signature_key(signature)
+        self.learned += 1
+        stored = self._db_call(save_narrative_template, key, signature, template, confidence)
+        if stored:
+            self._remember(key, dict(stored))
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            self._remember(key, {"template_text": template, "confidence": confidence, "samples": 1, "hits": 0})
+            return
+        entry["samples"] += 1
+        if confidence >= entry["confidence"]:
+            entry["template_text"], entry["confidence"] = template, confidence
+        self._entries.move_to_end(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Reuse counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "learned": self.learned,
+            "persistent": self._db,
+        }
@@ -0,0 +1,134 @@
+"""
+Deterministic narratives for lifecycle events that carry no economic change
+
+Executions (the initial state), and Confirmations, Settlements and Terminations
+whose diff against the previous state touches nothing but the position state,
+are described from the lineage, diff and payload without calling the LLM.
+Everything else (amendments, resets, transfers, or any of the above with a
+changed notional, rate or history) returns None and goes to the LLM agent.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from agent.compaction import REFERENCE_KEYS
+from agent.narrative_templates import FORMATS
+from common.diff import fixed_rate, notional
+from common.transform import extract_currency, extract_dates, extract_parties, extract_product_type, map_intent_to_event_type
+
+RULE_NARRATIVES = os.getenv("CDM_RULE_NARRATIVES", "true").lower() == "true"
+
+# Event types described by rules when nothing economic changed
+RULE_EVENT_TYPES = ("Execution", "Confirmation", "Settlement", "Termination")
+
+# Top-level payload sections a patch may touch without the change being economic
+NON_ECONOMIC_ROOTS = ("state", "meta")
+
+# Fields of diff_states "changes" that are lifecycle status rather than economics
+STATUS_FIELDS = ("positionState", "closedState")
+
+
+def is_trivial(diff: Optional[Dict[str, Any]]) -> bool:
+    """Whether a diff changes nothing but lifecycle status (None, an initial state, counts as trivial)"""
+    if diff is None:
+        return True
+    for field, change in (diff.get("changes") or {}).items():
+        if field not in STATUS_FIELDS and isinstance(change, dict) and change.get("changed"):
+            return False
+    if any(items for items in (diff.get("appends") or {}).values()):
+        return False
+    for op in diff.get("patch") or []:
+        segments = op.get("path", "").split("/")[1:]
+        if segments and segments[0] in NON_ECONOMIC_ROOTS:
+            continue
+        if any(segment in REFERENCE_KEYS for segment in segments):
+            continue
+        return False
+    return True
+
+
+def _label(value: Optional[str]) -> Optional[str]:
+    """EXECUTED -> Executed, InterestRateSwap -> Interest Rate Swap"""
+    if not value or value == "Unknown":
+        return None
+    if value.isupper():
+        return value.replace("_", " ").capitalize()
+    return re.sub(r"(?<=[a-z])(?=[A-Z])", " ", value)
+
+
+def _date(value: Optional[str]) -> Optional[str]:
+    return FORMATS["mdy"](value) if value else None
+
+
+def _terms(payload: Dict[str, Any]) -> Optional[str]:
+    """One sentence on the trade's economics, or None if nothing is known"""
+    amount = notional(payload)
+    rate = fixed_rate(payload)
+    currency = extract_currency(payload)
+    dates = extract_dates(payload)
+
+    terms: List[str] = []
+    if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+        formatted = FORMATS["comma"](amount) or FORMATS["comma2"](amount)
+        terms.append(f"a {currency} {formatted} notional" if currency and currency != "Unknown" else f"a {formatted} notional")
+    if isinstance(rate, (int, float)) and not isinstance(rate, bool):
+        terms.append(f"a fixed rate of {FORMATS['pct2'](rate) or rate}")
+    start, maturity = _date(dates.get("startDate")), _date(dates.get("maturityDate"))
+    period = f"running from {start} to {maturity}" if start and maturity else None
+
+    if terms:
+        return f"The trade carries {' and '.join(terms)}{', ' + period if period else ''}."
+    if period:
+        return f"The trade is {period}."
+    return None
+
+
+def rule_narrative(lineage: Dict[str, Any], diff: Optional[Dict[str, Any]], payload: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Narrative for a simple lifecycle event, or None if it needs the LLM
+
+    Args:
+        lineage: get_lineage result for the event's trade state
+        diff: diff_states result against the previous state (None for the initial state)
+        payload: get_tradestate_payload result
+    """
+    if not payload:
+        return None
+    event_type = "Execution" if diff is None else map_intent_to_event_type(lineage.get("intent"), lineage.get("position_state"))
+    if event_type not in RULE_EVENT_TYPES or not is_trivial(diff):
+        return None
+
+    trade = f"Trade {lineage.get('trade_id')}"
+    when = _date(lineage.get("effectiveDate"))
+    on = f" on {when}" if when else ""
+    product = _label(extract_product_type(payload))
+    parties = extract_parties(payload)
+    bank, counterparty = parties.get("bank"), parties.get("counterparty")
+    between = f" between {bank} and {counterparty}" if "Unknown" not in (bank, counterparty) else ""
+
+    position = (diff or {}).get("changes", {}).get("positionState") or {}
+    moved = ""
+    if position.get("changed") and _label(position.get("from")) and _label(position.get("to")):
+        moved = f", moving its position from {_label(position['from'])} to {_label(position['to'])}"
+
+    if event_type == "Execution":
+        opening = f"{trade} was executed{on} as {'an' if (product or 'x')[0] in 'AEIOU' else 'a'} {product or 'trade'}{between}."
+        closing = "This is the trade's initial state, so there are no prior terms to compare against."
+    elif event_type == "Confirmation":
+        opening = f"{trade} was confirmed{on}{moved}."
+        closing = "The confirmation formalizes the terms agreed at execution; no economic terms changed."
+    elif event_type == "Settlement":
+        opening = f"{trade} was settled{on}{moved}."
+        closing = "Settlement did not change any economic terms."
+    else:
+        closed = (diff or {}).get("changes", {}).get("closedState") or {}
+        closed_to = closed.get("to") if closed.get("changed") else None
+        if isinstance(closed_to, dict):
+            closed_to = closed_to.get("state")
+        reason = _label(closed_to) if isinstance(closed_to, str) else None
+        opening = f"{trade} was terminated{on}{f' (closed state: {reason})' if reason else ''}{moved}."
+        closing = "No economic terms were amended as part of the termination."
+
+    terms = _terms(payload)
+    if event_type == "Termination" and terms:
+        terms = terms.replace("The trade carries", "At termination the trade carried", 1)
+    return " ".join(sentence for sentence in (opening, terms, closing) if sentence)
@@ -0,0 +1,180 @@
+"""
+Client-side cache of MCP tool results
+
+Providers declare a cache policy per tool in its tools/list definition:
+
+    "_meta": {"cache": {"ttlSeconds": 60, "keyArgs": ["trade_id"]}}
+
+Tools without a policy are never cached. Entries are keyed by the tool name and the
+`keyArgs` argument values (all arguments if omitted), expire after `ttlSeconds`, and
+are dropped wholesale by `invalidate()` when new trade data is ingested.
+
+Independently of any policy, `request_memo()` scopes a cache to one API request so
+identical calls made while serving it (by the route and by the LLM agent) run once.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional, Sequence, Tuple
+
+from common import codec
+
+
+def call_key(tool_name: str, arguments: Dict[str, Any], names: Optional[Sequence[str]] = None) -> Hashable:
+    """Key identifying a tool call by the given argument names (default: all of them)"""
+    if names is None:
+        names = sorted(arguments)
+    return (tool_name, tuple((name, codec.dumps(arguments.get(name))) for name in names))
+
+
+class CachePolicy:
+    """TTL and key arguments of one cacheable tool"""
+
+    def __init__(self, ttl_s: float, key_args: Optional[Tuple[str, ...]] = None):
+        self.ttl_s = ttl_s
+        self.key_args = key_args
+
+    @classmethod
+    def from_tool(cls, tool: Dict[str, Any]) -> Optional["CachePolicy"]:
+        """Read the policy from an MCP tool definition (None if the tool isn't cacheable)"""
+        spec = ((tool.get("_meta") or {}).get("cache")) or {}
+        ttl_s = spec.get("ttlSeconds")
+        if not isinstance(ttl_s, (int, float)) or ttl_s <= 0:
+            return None
+        key_args = spec.get("keyArgs")
+        return cls(float(ttl_s), tuple(key_args) if key_args is not None else None)
+
+    def key(self, tool_name: str, arguments: Dict[str, Any]) -> Hashable:
+        """Cache key for a call"""
+        return call_key(tool_name, arguments, self.key_args)
+
+
+class ToolResultCache:
+    """
+    Bounded LRU of tool results with per-entry expiry and single-flight loading
+
+    Concurrent misses for the same key share one provider call. Results are shared
+    between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()  # key -> (result, expires_at)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Bumped by invalidate(); loads started before it don't store their result
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Hashable, ttl_s: float, load: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached result for `key`, or run `load` once for all concurrent callers
+
+        Failed loads are not cached; every waiter sees the exception.
+        """
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                self.shared += 1
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The caller running the load gave up; load it ourselves
+                    continue
+                raise
+
+        self.misses += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters (if any) re-raise it; don't warn about it going unretrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if generation == self._generation:
+                self._store(key, result, ttl_s)
+            return result
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _store(self, key: Hashable, result: Any, ttl_s: float) -> None:
+        self._entries[key] = (result, time.monotonic() + ttl_s)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> int:
+        """Drop every entry (and the results of loads still in flight); returns the entry count"""
+        count = len(self._entries)
+        self._entries.clear()
+        self._inflight.clear()
+        self._generation += 1
+        self.invalidations += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rates and size"""
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "hit_rate": (self.hits + self.shared) / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Memo of the API request being served (None outside of one); bounded only as a safeguard
+REQUEST_MEMO_MAX_ENTRIES = 100_000
+_request_memo: ContextVar[Optional[ToolResultCache]] = ContextVar("cdm_request_memo", default=None)
+
+
+@contextmanager
+def request_memo() -> Iterator[ToolResultCache]:
+    """Memoize tool calls made inside the block; a nested block reuses the outer memo"""
+    memo = _request_memo.get()
+    if memo is not None:
+        yield memo
+        return
+    memo = ToolResultCache(max_entries=REQUEST_MEMO_MAX_ENTRIES)
+    token = _request_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _request_memo.reset(token)
+
+
+async def memoized(tool_name: str, arguments: Dict[str, Any], call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `call` through the current request memo (directly outside of a request)
+
+    Results live as long as the request, so there is no staleness to bound.
+    """
+    memo = _request_memo.get()
+    if memo is None:
+        return await call()
+    return await memo.get_or_load(call_key(tool_name, arguments), math.inf, call)
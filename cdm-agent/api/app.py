@@ -1,13 +1,20 @@
 """
 FastAPI application for CDM Trade Insight API
 """
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.routes import trades, narratives
+from fastapi.responses import Response
+from api.routes import trades, narratives, portfolio
+from api.middleware import MetricsMiddleware, RequestMemoMiddleware, TracingMiddleware
+from api.responses import CodecJSONResponse
+from agent import narrative_agent
 from agent.mcp_client import MCPClientManager
 from agent.narrative_agent import set_mcp_client
+from common import metrics, tracing
+from common.db import listen
 
 # Configure logging
 logging.basicConfig(
@@ -30,6 +37,7 @@ async def lifespan(app: FastAPI):
     logger.info("=" * 60)
     
     mcp_client = MCPClientManager()
+    summary_listener = None
     
     try:
         # Connect to all MCP servers and discover tools
@@ -38,10 +46,14 @@ async def lifespan(app: FastAPI):
         # Set the MCP client for narrative agent
         set_mcp_client(mcp_client)
         
+        # Refresh the portfolio summary when trade data is ingested
+        if trades.SUMMARY_CHANNEL:
+            summary_listener = asyncio.create_task(listen(trades.SUMMARY_CHANNEL, trades.on_trade_data_changed))
+        
         # Log discovered tools
         tools = mcp_client.get_available_tools()
         logger.info(f"✅ MCP client initialized successfully")
-        logger.info(f"📦 Connected to {len(mcp_client.processes)} MCP servers")
+        logger.info(f"📦 Connected to {len(mcp_client.connections)} MCP servers")
         logger.info(f"🔧 Discovered {len(tools)} tools:")
         for tool in tools:
             tool_name = tool["function"]["name"]
@@ -58,6 +70,8 @@ async def lifespan(app: FastAPI):
         raise
     
     finally:
+        if summary_listener is not None:
+            summary_listener.cancel()
         # Shutdown: Cleanup MCP connections
         logger.info("Shutting down MCP client connections...")
         await mcp_client.shutdown()
@@ -68,9 +82,20 @@ app = FastAPI(
     title="CDM Trade Insight API",
     description="REST API for querying CDM trade states and business events with MCP-powered narrative generation",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=CodecJSONResponse
 )
 
+# Coalesce identical MCP tool calls made while serving one request
+app.add_middleware(RequestMemoMiddleware)
+
+# Route latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Per-request traces, continued by the MCP providers (written when CDM_TRACE_FILE is set)
+tracing.set_service_name("api")
+app.add_middleware(TracingMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -86,7 +111,16 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "ok"}
 
+# Prometheus scrape endpoint: this process's metrics plus each provider's
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Metrics in the Prometheus text format"""
+    mcp_client = narrative_agent.mcp_client
+    remote = await mcp_client.collect_metrics() if mcp_client is not None else []
+    return Response(metrics.render(remote), media_type=metrics.CONTENT_TYPE)
+
 # Include routers
 app.include_router(trades.router, prefix="/api", tags=["trades"])
 app.include_router(narratives.router, prefix="/api", tags=["narratives"])
+app.include_router(portfolio.router, prefix="/api", tags=["portfolio"])
 
@@ -0,0 +1,120 @@
+"""
+ASGI middleware for the CDM Trade Insight API
+"""
+import re
+import time
+from typing import Optional
+
+from agent.tool_cache import request_memo
+from common import metrics, tracing
+
+http_request_seconds = metrics.histogram(
+    "cdm_http_request_duration_seconds",
+    "HTTP request latency until the response body is complete (whole stream for SSE)",
+    ("method", "route", "status")
+)
+
+
+
+def route_template(scope) -> Optional[str]:
+    """Matched route template with its router prefix (e.g. /api/trades/{trade_id}), once routed
+
+    FastAPI records the matched route in the scope, but for included routers its
+    path lacks the prefix; that is recovered from the request path.
+    """
+    route = getattr(scope.get("route"), "path", None)
+    if route is None:
+        return None
+    concrete = route
+    for name, value in (scope.get("path_params") or {}).items():
+        concrete = re.sub(r"\{" + re.escape(name) + r"(:[^}]*)?\}", lambda _: str(value), concrete)
+    path = scope.get("path", "")
+    return path[:len(path) - len(concrete)] + route if path.endswith(concrete) else route
+
+
+class RequestMemoMiddleware:
+    """
+    Scope a tool-call memo to each HTTP request
+
+    Implemented as plain ASGI (not BaseHTTPMiddleware) so the memo's context
+    variable stays visible while streaming responses are generated.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with request_memo():
+            await self.app(scope, receive, send)
+
+
+class MetricsMiddleware:
+    """
+    Time each HTTP request by route template (e.g. /api/trades/{trade_id})
+
+    Plain ASGI so streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_template(scope) or "<unmatched>"
+            http_request_seconds.observe(
+                time.perf_counter() - started, method=scope["method"], route=route, status=status
+            )
+
+
+class TracingMiddleware:
+    """
+    Start a trace per HTTP request (continuing an incoming `traceparent` header)
+
+    The span is named after the route template once routing has happened, and the
+    trace id is returned in an X-Trace-Id header to look the trace up afterwards.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing.TRACE_FILE:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        with tracing.start_trace(f"{scope['method']} {scope['path']}", traceparent,
+                                 attributes={"http.method": scope["method"], "http.target": scope["path"]}) as span:
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    span.set(**{"http.status_code": message["status"]})
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-trace-id", span.trace_id.encode())]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                route = route_template(scope)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set(**{"http.route": route})
@@ -0,0 +1,16 @@
+"""
+Response classes for the CDM Trade Insight API
+"""
+from typing import Any
+from fastapi.responses import JSONResponse
+from common import codec
+
+
+class CodecJSONResponse(JSONResponse):
+    """
+    JSON response rendered with the shared codec (orjson when available)
+    Return it directly from a route to also skip FastAPI's jsonable_encoder pass
+    """
+
+    def render(self, content: Any) -> bytes:
+        return codec.dumpb(content)
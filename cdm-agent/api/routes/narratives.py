@@ -2,11 +2,14 @@
 Narrative generation API routes with SSE streaming support
 """
 import logging
-import json
 import asyncio
-from fastapi import APIRouter, HTTPException, Query
+import os
+from contextlib import suppress
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
-from typing import Optional
+from typing import Optional, AsyncIterator
+from common import codec, metrics
+from common.deadline import deadline
 from agent.narrative_agent import generate_event_narrative, generate_trade_narrative, call_mcp_tool
 from agent.cache_manager import (
     get_trade_narrative,
@@ -22,12 +25,73 @@ from agent.cache_manager import (
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Upper bound on one narrative stream (all LLM rounds and tool calls)
+NARRATIVE_DEADLINE_S = float(os.getenv("CDM_NARRATIVE_DEADLINE_S", "120"))
+
+sse_stream_seconds = metrics.histogram(
+    "cdm_sse_stream_duration_seconds", "Narrative SSE stream duration by how it ended", ("kind", "outcome")
+)
+narrative_storage = metrics.counter(
+    "cdm_narrative_storage_lookups_total", "Stored narrative lookups by the generate endpoints", ("kind", "result")
+)
+narratives_generated = metrics.counter(
+    "cdm_narratives_generated_total", "Narratives generated, by what produced them", ("kind", "source")
+)
+
+def narrative_source(metadata: dict) -> str:
+    """What produced a generated narrative: llm, rules or template"""
+    if metadata.get("from_rules"):
+        return "rules"
+    if metadata.get("from_template"):
+        return "template"
+    return "llm"
+
 def sse_message(event: str, data: dict) -> str:
     """Format SSE message"""
-    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"event: {event}\ndata: {codec.dumps(data)}\n\n"
+
+async def _wait_for_disconnect(request: Request):
+    """Return once the HTTP client has gone away"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def stream_until_disconnect(request: Request, events: AsyncIterator[str], kind: str) -> AsyncIterator[str]:
+    """
+    Relay an SSE generator under the narrative deadline, cancelling it as soon as
+    the client disconnects so abandoned LLM and tool calls stop (tool calls send
+    a cancellation to the provider on the way out)
+    """
+    with deadline(NARRATIVE_DEADLINE_S), sse_stream_seconds.time(kind=kind, outcome="incomplete") as labels:
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(request))
+        try:
+            while True:
+                step = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait({step, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    labels["outcome"] = "disconnected"
+                    logger.info(f"Client disconnected from {request.url.path}; cancelling generation")
+                    step.cancel()
+                    with suppress(asyncio.CancelledError, StopAsyncIteration):
+                        await step
+                    return
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    return
+                if chunk.startswith("event: complete"):
+                    labels["outcome"] = "complete"
+                elif chunk.startswith("event: error"):
+                    labels["outcome"] = "error"
+                yield chunk
+        finally:
+            disconnected.cancel()
+            with suppress(Exception):
+                await events.aclose()
 
 @router.get("/trades/{trade_id}/narrative/generate")
-async def generate_trade_narrative_stream(trade_id: str):
+async def generate_trade_narrative_stream(trade_id: str, request: Request):
     """
     Generate trade-level narrative with SSE progress streaming
     
@@ -47,6 +111,7 @@ async def generate_trade_narrative_stream(trade_id: str):
             })
             
             cached = get_trade_narrative(trade_id)
+            narrative_storage.inc(kind="trade", result="hit" if cached else "miss")
             if cached:
                 logger.info(f"Returning cached trade narrative for {trade_id}")
                 yield sse_message("progress", {
@@ -95,6 +160,8 @@ async def generate_trade_narrative_stream(trade_id: str):
                 progress_callback=sync_callback
             )
             
+            narratives_generated.inc(kind="trade", source=narrative_source(result['metadata']))
+            
             # Stream all progress events
             for event in progress_events:
                 yield sse_message("progress", event)
@@ -149,7 +216,7 @@ async def generate_trade_narrative_stream(trade_id: str):
             yield sse_message("error", {"error": str(e)})
     
     return StreamingResponse(
-        event_generator(),
+        stream_until_disconnect(request, event_generator(), "trade"),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -160,6 +227,7 @@ async def generate_trade_narrative_stream(trade_id: str):
 
 @router.get("/trades/{trade_id}/events/{event_id}/narrative/generate")
 async def generate_event_narrative_stream(
+    request: Request,
     trade_id: str,
     event_id: str,
     trade_state_id: str = Query(..., description="Trade state ID for this event")
@@ -181,6 +249,7 @@ async def generate_event_narrative_stream(
             })
             
             cached = get_event_narrative(trade_id, event_id)
+            narrative_storage.inc(kind="event", result="hit" if cached else "miss")
             if cached:
                 logger.info(f"Returning cached event narrative for {trade_id}/{event_id}")
                 yield sse_message("progress", {
@@ -230,6 +299,8 @@ async def generate_event_narrative_stream(
                 progress_callback=sync_callback
             )
             
+            narratives_generated.inc(kind="event", source=narrative_source(result['metadata']))
+            
             # Stream progress events
             for event in progress_events:
                 yield sse_message("progress", event)
@@ -286,7 +357,7 @@ async def generate_event_narrative_stream(
             yield sse_message("error", {"error": str(e)})
     
     return StreamingResponse(
-        event_generator(),
+        stream_until_disconnect(request, event_generator(), "event"),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
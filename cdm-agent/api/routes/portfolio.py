@@ -0,0 +1,57 @@
+"""
+Portfolio aggregation API routes (book-level totals over trade summaries)
+"""
+import logging
+from datetime import date
+from fastapi import APIRouter, HTTPException, Query
+from typing import Dict, Any, Tuple
+from api.routes.trades import get_summary_snapshot
+from common.portfolio import aggregate_columns, notional_by_currency, AGGREGATE_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# Aggregation results for the current summary snapshot revision only;
+# cleared as soon as the snapshot changes
+_aggregate_cache: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+_aggregate_revision: Dict[str, Any] = {"value": None}
+
+
+@router.get("/portfolio/aggregate")
+async def aggregate_portfolio(
+    by: str = Query("counterparty", description=f"Comma-separated group-by dimensions: {', '.join(AGGREGATE_DIMENSIONS)}")
+):
+    """Trade counts and notional per currency, grouped by one or more dimensions"""
+    dimensions = tuple(dimension.strip() for dimension in by.split(",") if dimension.strip())
+    unknown = [dimension for dimension in dimensions if dimension not in AGGREGATE_DIMENSIONS]
+    if not dimensions or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported dimension(s): {', '.join(unknown) or by}. Expected: {', '.join(AGGREGATE_DIMENSIONS)}"
+        )
+
+    try:
+        revision, columns = await get_summary_snapshot()
+        if _aggregate_revision["value"] != revision:
+            _aggregate_cache.clear()
+            _aggregate_revision["value"] = revision
+
+        as_of = date.today()
+        cache_key = (dimensions, as_of)
+        cached = _aggregate_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+        groups = aggregate_columns(columns, dimensions, as_of=as_of)
+        result = {
+            "by": list(dimensions),
+            "asOf": as_of.isoformat(),
+            "tradeCount": len(columns["id"]),
+            "notionalByCurrency": notional_by_currency(columns),
+            "groups": groups,
+        }
+        _aggregate_cache[cache_key] = result
+        return {**result, "cached": False}
+    except Exception as e:
+        logger.error(f"Error aggregating portfolio: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error aggregating portfolio: {str(e)}")
@@ -1,109 +1,237 @@
 """
 Trade-related API routes
 """
+import asyncio
+import contextvars
 import logging
+import os
+import time
+from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+from agent import narrative_agent
 from agent.narrative_agent import call_mcp_tool
-from common.db import conn, q, one
+from agent.llm_backend import client_stats
+from api.responses import CodecJSONResponse
+from common.db import conn, q, one, LazyConnection
+from common.query_log import query_log
 from common.transform import (
     transform_to_trade,
     extract_product_type,
     extract_currency,
-    extract_parties,
-    extract_dates,
-    apply_default_trade_metadata,
 )
+from common.portfolio import (
+    summary_columns_from_payloads,
+    columns_to_json,
+    columns_to_records,
+    merge_columns,
+    sort_by_id,
+    take_rows,
+)
+from common.trade_search import TradeSearchIndex
 from common.diff import notional as extract_notional
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-cnx = conn()
+cnx = LazyConnection(conn)
+
+
+async def _load_latest_states(since: Optional[str] = None):
+    """Fetch the latest position state and TradeState payload of every trade
+    
+    Pages through the cdm_db provider's get_latest_trade_states, two queries per
+    SUMMARY_PAGE_SIZE trades rather than two tool calls per trade.
+    
+    Args:
+        since: Only trades with a TradeState output created at or after this ISO timestamp
+    
+    Returns:
+        (trade_ids, payloads, position_states, as_of); as_of is the latest output
+        timestamp seen before the first page, the `since` of the next refresh
+    """
+    loaded_ids, payloads, position_states = [], [], []
+    after, as_of, pending = "", None, 0
+    first = True
+    while after is not None:
+        arguments = {"after": after, "limit": SUMMARY_PAGE_SIZE}
+        if since:
+            arguments["since"] = since
+        page = await call_mcp_tool("get_latest_trade_states", arguments)
+        if first:
+            as_of, first = page.get("as_of"), False
+        for trade in page["trades"]:
+            loaded_ids.append(trade["trade_id"])
+            payloads.append(trade["payload"])
+            position_states.append(trade.get("position_state") or "")
+        pending += len(page.get("pending") or ())
+        after = page.get("next_after")
+    if pending:
+        # Their payloads land with a later NOTIFY, which refreshes them
+        logger.info(f"{pending} trades have no TradeState payload for their latest state yet")
+    return loaded_ids, payloads, position_states, as_of
+
+
+# Portfolio summary columns shared by the list, aggregate and search views. Built once,
+# then refreshed with only the trades whose TradeState output is newer than the last
+# refresh. A NOTIFY on SUMMARY_CHANNEL (migrations/004_trade_data_notify.sql) marks the
+# snapshot stale and refreshes it in the background; when the listener (re)connects,
+# notifications may have been lost, so the next refresh reloads every trade (this is
+# also when deleted trades drop out). Without a listener, every read refreshes.
+_summary_snapshot: Dict[str, Any] = {
+    "revision": 0, "columns": None, "as_of": None, "stale": True, "full": True, "listening": False
+}
+_summary_refresh: Dict[str, Optional[asyncio.Task]] = {"task": None}
+SUMMARY_CHANNEL = os.getenv("CDM_SUMMARY_CHANNEL", "cdm_trade_data_changed")
+SUMMARY_PAGE_SIZE = int(os.getenv("CDM_SUMMARY_PAGE_SIZE", "1000"))
+# Outputs this much older than the last refresh are read again, so rows committed late
+# by transactions that started before it are not missed
+SUMMARY_OVERLAP_S = float(os.getenv("CDM_SUMMARY_OVERLAP_S", "60"))
+
+
+def on_trade_data_changed(table: Optional[str]) -> None:
+    """NOTIFY handler for ingested trade data; called with None when the listener (re)connects"""
+    _summary_snapshot.update(stale=True, listening=True)
+    if table is None:
+        _summary_snapshot["full"] = True
+    if _summary_snapshot["columns"] is not None:
+        _start_summary_refresh()
+
+
+async def get_summary_snapshot(wait: bool = True) -> Tuple[int, Dict[str, Any]]:
+    """Get (revision, summary columns) for the whole portfolio
+    
+    The revision changes whenever the columns do. A stale snapshot is refreshed
+    first, or with `wait=False` returned as is and refreshed in the background
+    (only a missing snapshot is always waited for). If a refresh fails, the
+    previous snapshot is served.
+    """
+    if _summary_snapshot["columns"] is None or (wait and _summary_snapshot["stale"]):
+        try:
+            # Shielded: a request giving up doesn't cancel the refresh others wait for
+            await asyncio.shield(_start_summary_refresh())
+        except Exception:
+            if _summary_snapshot["columns"] is None:
+                raise
+            logger.warning("Portfolio summary refresh failed; serving the previous snapshot")
+    elif _summary_snapshot["stale"]:
+        _start_summary_refresh()
+    return _summary_snapshot["revision"], _summary_snapshot["columns"]
+
+
+def _start_summary_refresh() -> asyncio.Task:
+    """The running summary refresh, starting one if there is none"""
+    task = _summary_refresh["task"]
+    if task is None or task.done():
+        # Own context: not bound by the deadline or request memo of whichever request started it
+        task = asyncio.create_task(
+            _run_summary_refresh(), name="portfolio summary refresh", context=contextvars.Context()
+        )
+        task.add_done_callback(_log_task_failure)
+        _summary_refresh["task"] = task
+    return task
+
+
+def _log_task_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"{task.get_name().capitalize()} failed", exc_info=task.exception())
+
+
+async def _run_summary_refresh() -> None:
+    """Refresh until no NOTIFY arrived during the last refresh"""
+    while True:
+        # Notifications arriving from here on set it again
+        _summary_snapshot["stale"] = not _summary_snapshot["listening"]
+        try:
+            await _refresh_summary()
+        except Exception:
+            _summary_snapshot["stale"] = True
+            raise
+        if not (_summary_snapshot["stale"] and _summary_snapshot["listening"]):
+            return
+
+
+async def _refresh_summary() -> None:
+    """Load the trades changed since the last refresh (all of them on a full one) into the snapshot"""
+    columns, as_of = _summary_snapshot["columns"], _summary_snapshot["as_of"]
+    full = columns is None or _summary_snapshot["full"] or as_of is None
+    _summary_snapshot["full"] = False
+    since = None if full else (datetime.fromisoformat(as_of) - timedelta(seconds=SUMMARY_OVERLAP_S)).isoformat()
+    
+    started = time.perf_counter()
+    try:
+        loaded_ids, payloads, position_states, latest = await _load_latest_states(since)
+    except Exception:
+        _summary_snapshot["full"] = _summary_snapshot["full"] or full
+        raise
+    
+    def build():
+        # Payload extraction and the merge are CPU work over the whole book; off the event loop
+        updates = sort_by_id(summary_columns_from_payloads(loaded_ids, payloads, position_states))
+        return updates if full else merge_columns(columns, updates)
+    
+    merged = await asyncio.get_running_loop().run_in_executor(None, build)
+    if merged is not None:
+        _summary_snapshot.update(columns=merged, revision=_summary_snapshot["revision"] + 1)
+    _summary_snapshot["as_of"] = latest or as_of
+    logger.info(
+        f"{'Built' if full else 'Refreshed'} portfolio summary from {len(loaded_ids)} trades "
+        f"in {(time.perf_counter() - started) * 1000:.0f}ms ({len(_summary_snapshot['columns']['id'])} in the book)"
+    )
+
+
+# Search index over a summary snapshot, with the columns its rows point into. Rebuilt in
+# the background when the snapshot changes; searches use the previous one meanwhile
+_search_index: Dict[str, Any] = {"revision": None, "columns": None, "index": None}
+_search_build: Dict[str, Optional[asyncio.Task]] = {"task": None}
+
+
+async def get_search_index() -> Tuple[Dict[str, Any], TradeSearchIndex]:
+    """Get (summary columns, search index over them) without a database round trip
+    
+    Neither a stale snapshot nor an outdated index is waited for; only the first
+    search waits for the snapshot and the index to be built.
+    """
+    revision, columns = await get_summary_snapshot(wait=False)
+    if _search_index["revision"] != revision:
+        build = _start_search_build(revision, columns)
+        if _search_index["index"] is None:
+            await asyncio.shield(build)
+    return _search_index["columns"], _search_index["index"]
+
+
+def _start_search_build(revision: int, columns: Dict[str, Any]) -> asyncio.Task:
+    """The running search index build, starting one for `columns` if there is none"""
+    task = _search_build["task"]
+    if task is None or task.done():
+        task = asyncio.create_task(
+            _build_search_index(revision, columns), name="trade search index build", context=contextvars.Context()
+        )
+        task.add_done_callback(_log_task_failure)
+        _search_build["task"] = task
+    return task
+
+
+async def _build_search_index(revision: int, columns: Dict[str, Any]) -> None:
+    # Building the trigram index takes seconds for a large book; keep it off the event loop
+    index = await asyncio.get_running_loop().run_in_executor(None, TradeSearchIndex, columns)
+    logger.info(f"Built trade search index for {len(index)} trades in {index.build_s * 1000:.0f}ms")
+    _search_index.update(revision=revision, columns=columns, index=index)
 
 
 @router.get("/trades")
-async def list_trades():
+async def list_trades(
+    layout: str = Query("records", pattern="^(records|columnar)$", description="Response layout: row records or summary columns")
+):
     """List all trades with summary information"""
     try:
-        # Get all unique trade IDs
-        trade_ids = q(cnx, "SELECT DISTINCT trade_id FROM trade_state ORDER BY trade_id")
-        
-        logger.info(f"Found {len(trade_ids)} unique trade IDs in database")
+        _, columns = await get_summary_snapshot()
         
-        if not trade_ids:
-            logger.warning("No trade IDs found in database")
-            return []
+        if not columns["id"]:
+            logger.warning("No trades found in database")
         
-        summaries = []
-        errors = []
-        for row in trade_ids:
-            trade_id = row["trade_id"]
-            try:
-                # Get timeline to get latest state
-                timeline = await call_mcp_tool("get_trade_lineage", {"trade_id": trade_id})
-                
-                if not timeline.get("timeline"):
-                    logger.warning(f"Trade {trade_id} has no timeline entries")
-                    continue
-                
-                # Get latest trade state payload
-                latest_state_id = timeline["timeline"][-1]["trade_state_id"]
-                latest_payload = await call_mcp_tool("get_tradestate_payload", {"trade_state_id": latest_state_id})
-                
-                # Extract summary fields
-                product_type = extract_product_type(latest_payload)
-                notional_val = extract_notional(latest_payload) or 0.0
-                currency = extract_currency(latest_payload)
-                parties = extract_parties(latest_payload)
-                dates = extract_dates(latest_payload)
-
-                # Determine status from latest position_state
-                latest_entry = timeline["timeline"][-1]
-                position_state = latest_entry.get("position_state", "")
-                status_map = {
-                    "EXECUTED": "Pending",
-                    "CONFIRMED": "Active",
-                    "CLEARED": "Active",
-                    "TERMINATED": "Terminated",
-                    "AMENDED": "Active"
-                }
-                status = status_map.get(position_state, "Active")
-
-                enriched = apply_default_trade_metadata(
-                    trade_id,
-                    {
-                        "productType": product_type,
-                        "currentNotional": notional_val,
-                        "currency": currency,
-                        "counterparty": parties.get("counterparty"),
-                        "bank": parties.get("bank"),
-                        "startDate": dates.get("startDate"),
-                        "maturityDate": dates.get("maturityDate"),
-                    },
-                )
-
-                summaries.append({
-                    "id": trade_id,
-                    "productType": enriched["productType"],
-                    "status": status,
-                    "currentNotional": enriched["currentNotional"],
-                    "currency": enriched["currency"],
-                    "counterparty": enriched.get("counterparty", "Unknown"),
-                    "bank": enriched.get("bank", "Unknown")
-                })
-            except Exception as e:
-                # Log errors but continue processing other trades
-                error_msg = f"Error processing trade {trade_id}: {str(e)}"
-                logger.error(error_msg, exc_info=True)
-                errors.append(error_msg)
-                continue
-        
-        logger.info(f"Successfully processed {len(summaries)} trades, {len(errors)} errors")
-        
-        if errors:
-            logger.warning(f"Errors encountered: {errors}")
-        
-        return summaries
+        if layout == "columnar":
+            return CodecJSONResponse({"count": len(columns["id"]), "columns": columns_to_json(columns)})
+        return CodecJSONResponse(columns_to_records(columns))
     except Exception as e:
         logger.error(f"Error listing trades: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error listing trades: {str(e)}")
@@ -111,76 +239,14 @@ async def list_trades():
 
 @router.get("/trades/search")
 async def search_trades(
-    query: str = Query(..., alias="q", description="Search query for trade ID")
+    query: str = Query(..., alias="q", description="Search text: trade ID, counterparty, bank or product type"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of results")
 ):
-    """Search trades by trade ID (case-insensitive)"""
+    """Search trades by trade ID, counterparty, bank or product type (case-insensitive, ranked)"""
     try:
-        # Search in database
-        results = q(
-            cnx,
-            "SELECT DISTINCT trade_id FROM trade_state WHERE LOWER(trade_id) LIKE LOWER(%s) ORDER BY trade_id LIMIT 20",
-            (f"%{query}%",)
-        )
-        
-        if not results:
-            return []
-        
-        summaries = []
-        for row in results:
-            trade_id = row["trade_id"]
-            try:
-                # Get basic info for summary
-                timeline = await call_mcp_tool("get_trade_lineage", {"trade_id": trade_id})
-                
-                if not timeline.get("timeline"):
-                    continue
-                
-                latest_state_id = timeline["timeline"][-1]["trade_state_id"]
-                latest_payload = await call_mcp_tool("get_tradestate_payload", {"trade_state_id": latest_state_id})
-                
-                product_type = extract_product_type(latest_payload)
-                notional_val = extract_notional(latest_payload) or 0.0
-                currency = extract_currency(latest_payload)
-                parties = extract_parties(latest_payload)
-                dates = extract_dates(latest_payload)
-
-                latest_entry = timeline["timeline"][-1]
-                position_state = latest_entry.get("position_state", "")
-                status_map = {
-                    "EXECUTED": "Pending",
-                    "CONFIRMED": "Active",
-                    "CLEARED": "Active",
-                    "TERMINATED": "Terminated",
-                    "AMENDED": "Active"
-                }
-                status = status_map.get(position_state, "Active")
-
-                enriched = apply_default_trade_metadata(
-                    trade_id,
-                    {
-                        "productType": product_type,
-                        "currentNotional": notional_val,
-                        "currency": currency,
-                        "counterparty": parties.get("counterparty"),
-                        "bank": parties.get("bank"),
-                        "startDate": dates.get("startDate"),
-                        "maturityDate": dates.get("maturityDate"),
-                    },
-                )
-
-                summaries.append({
-                    "id": trade_id,
-                    "productType": enriched["productType"],
-                    "status": status,
-                    "currentNotional": enriched["currentNotional"],
-                    "currency": enriched["currency"],
-                    "counterparty": enriched.get("counterparty", "Unknown"),
-                    "bank": enriched.get("bank", "Unknown")
-                })
-            except Exception:
-                continue
-        
-        return summaries
+        columns, index = await get_search_index()
+        rows = index.search(query, limit)
+        return CodecJSONResponse(columns_to_records(take_rows(columns, rows)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching trades: {str(e)}")
 
@@ -217,7 +283,7 @@ async def get_trade(trade_id: str):
             trade_state_payloads
         )
         
-        return trade
+        return CodecJSONResponse(trade)
     except HTTPException:
         raise
     except Exception as e:
@@ -257,7 +323,7 @@ async def get_trade_state(trade_id: str, trade_state_id: str):
     """Get specific trade state payload (for CDM Output tab)"""
     try:
         payload = await call_mcp_tool("get_tradestate_payload", {"trade_state_id": trade_state_id})
-        return {"payload": payload}
+        return CodecJSONResponse({"payload": payload})
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -295,6 +361,50 @@ async def debug_trades():
         }
 
 
+@router.get("/debug/cache")
+async def debug_cache():
+    """Debug endpoint exposing provider cache (payload cache, diff memo) and API tool-result cache statistics"""
+    try:
+        stats: Dict[str, Any] = {}
+        if narrative_agent.mcp_client is not None:
+            stats["providers"] = await narrative_agent.mcp_client.collect_cache_stats()
+            stats["tool_result_cache"] = narrative_agent.mcp_client.result_cache.stats()
+        if _search_index["index"] is not None:
+            stats["trade_search"] = _search_index["index"].stats()
+        return stats
+    except Exception as e:
+        logger.error(f"Debug cache endpoint error: {str(e)}", exc_info=True)
+        return {"error": str(e)}
+
+
+@router.get("/debug/llm")
+async def debug_llm():
+    """Debug endpoint exposing LLM backend statistics (simulated model time for the replay backend), scheduler state and narrative template reuse"""
+    return {
+        **client_stats(narrative_agent.get_openai_client()),
+        "scheduler": narrative_agent.llm_scheduler.stats(),
+        "templates": narrative_agent.narrative_templates.stats()
+    }
+
+
+@router.get("/debug/queries")
+async def debug_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = Query("total_ms", pattern="^(total_ms|mean_ms|p95_ms|max_ms|calls)$")
+):
+    """Debug endpoint exposing per-statement query statistics and captured slow-query plans of the API and each provider"""
+    providers = {}
+    if narrative_agent.mcp_client is not None:
+        providers = await narrative_agent.mcp_client.collect_query_stats()
+    return {
+        "api": query_log.report(limit, order_by),
+        "providers": {
+            server_name: sorted(queries, key=lambda row: row.get(order_by, 0), reverse=True)[:limit]
+            for server_name, queries in providers.items()
+        }
+    }
+
+
 @router.get("/debug/trade/{trade_id}")
 async def debug_trade_detail(trade_id: str):
     """Debug endpoint to inspect a single trade's processing"""
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Load test the narrative SSE endpoints
+
+Start the API with the replay LLM backend so the model's latency is simulated
+and known, e.g.
+
+    CDM_LLM_BACKEND=replay CDM_LLM_REPLAY_PROFILE=fast uvicorn api.app:app
+
+then run
+
+    python bench_narratives.py --concurrency 16 --requests 200
+
+Stored narratives are deleted before each request (unless --keep-stored) so every
+request runs the full pipeline. Pipeline overhead is end-to-end time minus the
+model time the replay backend reports through /api/debug/llm.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100.0 * len(ordered)) - 1))]
+
+
+async def load_targets(client: httpx.AsyncClient, kind: str, max_trades: int) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """(trade_id, event_id, trade_state_id) tuples to generate narratives for"""
+    response = await client.get("/api/trades")
+    response.raise_for_status()
+    trade_ids = [trade["id"] for trade in response.json()][:max_trades]
+
+    targets = []
+    for trade_id in trade_ids:
+        if kind in ("trade", "mixed"):
+            targets.append((trade_id, None, None))
+        if kind in ("event", "mixed"):
+            response = await client.get(f"/api/trades/{trade_id}/timeline")
+            response.raise_for_status()
+            for event in response.json().get("events", []):
+                trade_state_id = (event.get("metadata") or {}).get("trade_state_id")
+                if event.get("id") and trade_state_id:
+                    targets.append((trade_id, event["id"], trade_state_id))
+    return targets
+
+
+async def generate(client: httpx.AsyncClient, target: Tuple[str, Optional[str], Optional[str]],
+                   keep_stored: bool) -> Dict[str, Any]:
+    """Run one narrative generation; returns timings and outcome"""
+    trade_id, event_id, trade_state_id = target
+    if not keep_stored:
+        await client.delete(f"/api/trades/{trade_id}/narrative")
+
+    if event_id is None:
+        url, params = f"/api/trades/{trade_id}/narrative/generate", None
+    else:
+        url, params = f"/api/trades/{trade_id}/events/{event_id}/narrative/generate", {"trade_state_id": trade_state_id}
+
+    started = time.perf_counter()
+    first_byte = None
+    outcome = "incomplete"
+    async with client.stream("GET", url, params=params) as response:
+        if response.status_code != 200:
+            return {"ok": False, "error": f"HTTP {response.status_code}", "elapsed": time.perf_counter() - started}
+        async for line in response.aiter_lines():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event in ("complete", "error"):
+                    outcome = event
+    elapsed = time.perf_counter() - started
+    return {
+        "ok": outcome == "complete",
+        "error": None if outcome == "complete" else outcome,
+        "ttfb": first_byte or elapsed,
+        "elapsed": elapsed
+    }
+
+
+async def llm_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    response = await client.get("/api/debug/llm")
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(args) -> int:
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        targets = await load_targets(client, args.kind, args.trades)
+        if not targets:
+            print("❌ No trades/events to generate narratives for")
+            return 1
+        random.Random(args.seed).shuffle(targets)
+
+        before = await llm_stats(client)
+        if before.get("backend") != "replay":
+            print(f"⚠️  API is using the '{before.get('backend')}' LLM backend; model time can't be separated")
+
+        queue: "asyncio.Queue[Tuple[str, Optional[str], Optional[str]]]" = asyncio.Queue()
+        for i in range(args.requests):
+            queue.put_nowait(targets[i % len(targets)])
+        results: List[Dict[str, Any]] = []
+
+        async def worker():
+            while True:
+                try:
+                    target = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    results.append(await generate(client, target, args.keep_stored))
+                except httpx.HTTPError as e:
+                    results.append({"ok": False, "error": type(e).__name__, "elapsed": 0.0})
+
+        print(f"🚀 {args.requests} {args.kind} narrative requests, concurrency {args.concurrency}, "
+              f"{len(targets)} distinct targets")
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+        after = await llm_stats(client)
+
+    ok = [r for r in results if r["ok"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    print("\n📊 Results")
+    print("=" * 50)
+    print(f"Completed: {len(ok)}/{len(results)} in {wall:.2f}s ({len(ok) / wall:.2f} narratives/s)")
+    if errors:
+        print(f"Errors: {errors}")
+    if ok:
+        elapsed = [r["elapsed"] for r in ok]
+        ttfb = [r["ttfb"] for r in ok]
+        print(f"Latency   p50 {percentile(elapsed, 50):.3f}s  p95 {percentile(elapsed, 95):.3f}s  "
+              f"p99 {percentile(elapsed, 99):.3f}s  max {max(elapsed):.3f}s")
+        print(f"TTFB      p50 {percentile(ttfb, 50):.3f}s  p95 {percentile(ttfb, 95):.3f}s")
+
+        if "model_seconds" in after:
+            llm_calls = after["calls"] - before["calls"]
+            model_s = after["model_seconds"] - before["model_seconds"]
+            total_s = sum(r["elapsed"] for r in results)
+            print(f"LLM calls {llm_calls} ({llm_calls / len(results):.1f}/request), "
+                  f"{after['completion_tokens'] - before['completion_tokens']} completion tokens")
+            print(f"Model time {model_s:.2f}s of {total_s:.2f}s request time; "
+                  f"pipeline overhead {(total_s - model_s) / len(results) * 1000:.1f}ms/request "
+                  f"(mean {statistics.mean(elapsed) * 1000:.1f}ms end to end)")
+    return 0 if not errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Narrative pipeline load test")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--kind", choices=("trade", "event", "mixed"), default="mixed", help="Narratives to generate")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent SSE streams")
+    parser.add_argument("--requests", type=int, default=100, help="Total narrative requests")
+    parser.add_argument("--trades", type=int, default=50, help="Max trades to draw targets from")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request HTTP timeout (s)")
+    parser.add_argument("--seed", type=int, default=0, help="Shuffle seed for target order")
+    parser.add_argument("--keep-stored", action="store_true",
+                        help="Don't delete stored narratives first (measures the storage hit path)")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Compare the plans of the hot provider and API queries with and without the
+indexes of migrations/006_hot_query_indexes.sql
+
+    python bench_queries.py                     # timings and plan shapes
+    python bench_queries.py --plans             # full plan trees
+    python bench_queries.py --disable-seqscan   # force index use on a small demo dataset
+
+Each query runs under EXPLAIN (ANALYZE, BUFFERS) with parameters drawn from the
+database, first in a transaction that drops the migration's indexes, then in one
+that creates them; both transactions are rolled back, so the database is left as
+it was. Dropping an index locks its table until the rollback: run this against a
+development database.
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.db import conn
+
+MIGRATION = os.path.join(os.path.dirname(__file__), "migrations", "006_hot_query_indexes.sql")
+
+# (name, statement, parameters from the sample)
+HOT_QUERIES: List[Tuple[str, str, Callable[[Dict[str, Any]], Optional[tuple]]]] = [
+    ("trade_state_hash",
+     """SELECT payload_sha256 FROM cdm_outputs
+        WHERE object_type='TradeState' AND trade_state_id=%s
+        ORDER BY created_at DESC LIMIT 1""",
+     lambda s: (s["trade_state_id"],)),
+    ("trade_state_payload",
+     """SELECT payload_sha256, payload_json::text AS payload_text FROM cdm_outputs
+        WHERE object_type='TradeState' AND trade_state_id=%s
+        ORDER BY created_at DESC LIMIT 1""",
+     lambda s: (s["trade_state_id"],)),
+    ("business_event",
+     """SELECT payload_json FROM cdm_outputs
+        WHERE object_type='BusinessEvent' AND event_id=%s
+        ORDER BY created_at DESC LIMIT 1""",
+     lambda s: (s["event_id"],)),
+    ("payload_hashes",
+     """SELECT DISTINCT ON (trade_state_id) trade_state_id, payload_sha256
+        FROM cdm_outputs
+        WHERE object_type='TradeState' AND trade_state_id = ANY(%s)
+        ORDER BY trade_state_id, created_at DESC""",
+     lambda s: (s["lineage"],)),
+    ("trade_states",
+     """SELECT trade_state_id, trade_id, version, position_state,
+               closed_state, event_id, before_state_id, as_of
+        FROM trade_state WHERE trade_id=%s ORDER BY version ASC""",
+     lambda s: (s["trade_id"],)),
+    ("latest_output",
+     "SELECT MAX(created_at) FROM cdm_outputs WHERE object_type='TradeState'",
+     lambda s: None),
+]
+
+
+def migration_indexes(migration_sql: str) -> List[str]:
+    """Names of the indexes a migration creates"""
+    return re.findall(r"CREATE INDEX IF NOT EXISTS (\w+)", migration_sql)
+
+
+def load_sample(cursor) -> Dict[str, Any]:
+    """Parameters for the hot queries: a random trade state with a payload, its event and its trade's lineage"""
+    cursor.execute("""SELECT ts.trade_id, ts.trade_state_id, ts.event_id FROM trade_state ts
+                      WHERE EXISTS (SELECT 1 FROM cdm_outputs o
+                                    WHERE o.object_type='TradeState' AND o.trade_state_id=ts.trade_state_id)
+                      ORDER BY random() LIMIT 1""")
+    row = cursor.fetchone()
+    if not row:
+        raise RuntimeError("No trade state with a TradeState payload to benchmark with")
+    cursor.execute("SELECT trade_state_id FROM trade_state WHERE trade_id=%s", (row["trade_id"],))
+    return {**row, "lineage": [r["trade_state_id"] for r in cursor.fetchall()]}
+
+
+def _nodes(plan: Dict[str, Any], depth: int = 0):
+    yield depth, plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child, depth + 1)
+
+
+def shape(plan: Dict[str, Any]) -> str:
+    """Compact plan summary: node types, with the index or relation each scan uses"""
+    parts = []
+    for _, node in _nodes(plan):
+        target = node.get("Index Name") or node.get("Relation Name")
+        parts.append(node["Node Type"] + (f"({target})" if target else ""))
+    return " > ".join(parts)
+
+
+def tree(plan: Dict[str, Any]) -> List[str]:
+    """Plan tree lines with actual time, rows and buffers per node"""
+    lines = []
+    for depth, node in _nodes(plan):
+        target = node.get("Index Name") or node.get("Relation Name")
+        lines.append(
+            f"    {'  ' * depth}-> {node['Node Type']}" + (f" on {target}" if target else "")
+            + f"  (time={node.get('Actual Total Time', 0):.3f}ms rows={node.get('Actual Rows', 0)}"
+            + f" loops={node.get('Actual Loops', 1)} hit={node.get('Shared Hit Blocks', 0)}"
+            + f" read={node.get('Shared Read Blocks', 0)})"
+        )
+        condition = node.get("Index Cond") or node.get("Recheck Cond") or node.get("Filter")
+        if condition:
+            lines.append(f"    {'  ' * depth}     {condition}")
+    return lines
+
+
+def explain(cursor, statement: str, params: Optional[tuple], repeat: int) -> Dict[str, Any]:
+    """Median execution time over `repeat` EXPLAIN ANALYZE runs, with the last run's plan"""
+    times, result = [], None
+    for _ in range(repeat):
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, params)
+        row = cursor.fetchone()
+        result = (next(iter(row.values())) if isinstance(row, dict) else row[0])[0]
+        times.append(result["Execution Time"])
+    return {
+        "ms": statistics.median(times),
+        "plan": result["Plan"],
+        "buffers": result["Plan"].get("Shared Hit Blocks", 0) + result["Plan"].get("Shared Read Blocks", 0),
+    }
+
+
+def run_phase(cnx, sample: Dict[str, Any], setup: List[str], args) -> Dict[str, Dict[str, Any]]:
+    """Explain every hot query after `setup` statements, in a transaction that is rolled back"""
+    results = {}
+    try:
+        with cnx.cursor() as cursor:
+            for statement in setup:
+                cursor.execute(statement)
+            if args.disable_seqscan:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, statement, params in HOT_QUERIES:
+                results[name] = explain(cursor, statement, params(sample), args.repeat)
+    finally:
+        cnx.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot query plans before and after the 006 indexes")
+    parser.add_argument("--repeat", type=int, default=5, help="EXPLAIN ANALYZE runs per query (median reported)")
+    parser.add_argument("--plans", action="store_true", help="Print full plan trees")
+    parser.add_argument("--disable-seqscan", action="store_true",
+                        help="SET enable_seqscan = off, to see index plans on tables too small to prefer them")
+    args = parser.parse_args()
+
+    with open(MIGRATION) as f:
+        migration_sql = f.read()
+    indexes = migration_indexes(migration_sql)
+
+    cnx = conn()
+    cnx.autocommit = False
+    try:
+        with cnx.cursor() as cursor:
+            sample = load_sample(cursor)
+        cnx.rollback()
+        print(f"Sample: trade {sample['trade_id']}, state {sample['trade_state_id']}, "
+              f"event {sample['event_id']}, {len(sample['lineage'])} states")
+
+        before = run_phase(cnx, sample, [f"DROP INDEX IF EXISTS {name}" for name in indexes], args)
+        after = run_phase(cnx, sample, [migration_sql], args)
+    except Exception as e:
+        print(f"❌ Benchmark failed: {e}")
+        sys.exit(1)
+    finally:
+        cnx.close()
+
+    print(f"\n{'query':<20} {'before':>10} {'after':>10} {'speedup':>8} {'buffers':>13}")
+    for name, _, _ in HOT_QUERIES:
+        b, a = before[name], after[name]
+        speedup = b["ms"] / a["ms"] if a["ms"] else float("inf")
+        print(f"{name:<20} {b['ms']:>8.3f}ms {a['ms']:>8.3f}ms {speedup:>7.1f}x {b['buffers']:>6}->{a['buffers']:<6}")
+    for name, _, _ in HOT_QUERIES:
+        print(f"\n{name}")
+        print(f"  before: {shape(before[name]['plan'])}")
+        if args.plans:
+            print("\n".join(tree(before[name]["plan"])))
+        print(f"  after:  {shape(after[name]['plan'])}")
+        if args.plans:
+            print("\n".join(tree(after[name]["plan"])))
+
+
+if __name__ == "__main__":
+    main()
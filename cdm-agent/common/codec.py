@@ -0,0 +1,54 @@
+"""
+JSON codec shared by the MCP providers, the MCP client and the API
+Uses orjson when installed and falls back to the stdlib json module
+"""
+import json
+import os
+from decimal import Decimal
+from typing import Any, Union
+
+try:
+    import orjson
+    ORJSON_ENABLED = os.getenv("CDM_JSON_CODEC", "orjson").lower() != "stdlib"
+except ImportError:
+    # orjson is optional; everything works (more slowly) on the stdlib codec
+    orjson = None  # type: ignore[assignment]
+    ORJSON_ENABLED = False
+
+CODEC_NAME = "orjson" if ORJSON_ENABLED else "json"
+
+
+def _default(obj: Any) -> Any:
+    """Encode types JSON has no native form for (datetime/date/time, Decimal)"""
+    if hasattr(obj, 'isoformat'):  # datetime/date objects
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumpb(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes"""
+    if ORJSON_ENABLED:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """Serialize to a compact JSON string"""
+    if ORJSON_ENABLED:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Deserialize JSON from str or bytes"""
+    if ORJSON_ENABLED:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+# Raised by loads() on malformed input (orjson.JSONDecodeError subclasses it too)
+DecodeError = ValueError
@@ -1,14 +1,55 @@
 """
 Database connection utilities for CDM MCP Provider
 """
+import asyncio
+import logging
 import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from common import metrics, tracing
+from common.query_log import normalize, query_log
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+query_seconds = metrics.histogram(
+    "cdm_db_query_duration_seconds", "Database statement latency (execute and fetch)", ("statement",)
+)
+
+@contextmanager
+def _instrumented(cnx, statement, params):
+    """Time a statement (latency histogram, trace span, query log); EXPLAIN it if it was slow"""
+    text = statement if isinstance(statement, str) else str(statement)
+    label = metrics.statement_label(text)
+    started = time.perf_counter()
+    try:
+        with query_seconds.time(statement=label), tracing.span("db.query", {"db.statement": label}, kind=tracing.CLIENT):
+            yield
+    except Exception:
+        query_log.record(normalize(text), time.perf_counter() - started, failed=True)
+        raise
+    elapsed = time.perf_counter() - started
+    if query_log.record(normalize(text), elapsed) and isinstance(statement, str):
+        _capture_plan(cnx, statement, params, elapsed)
+
+def _capture_plan(cnx, statement: str, params, seconds: float):
+    """Run a slow read-only statement again under EXPLAIN (ANALYZE, BUFFERS) and keep the plan"""
+    try:
+        with cnx.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, params)
+            row = cursor.fetchone()
+        plan = next(iter(row.values())) if isinstance(row, dict) else row[0]
+        query_log.add_plan(normalize(statement), seconds, params, plan)
+    except Exception as e:
+        logger.warning(f"Could not capture the plan of a slow query: {e}")
+
 def conn():
     """Create PostgreSQL connection using environment variables"""
     connection = psycopg2.connect(
@@ -22,21 +63,49 @@ def conn():
     connection.autocommit = True
     return connection
 
+class LazyConnection:
+    """
+    Connection that is only opened on first use (and reopened if it was closed)
+    Lets a process start and answer protocol messages before the database is reachable
+    """
+
+    def __init__(self, factory=None):
+        self._factory = factory or conn
+        self._connection = None
+
+    def get(self):
+        """Return the underlying connection, connecting if needed"""
+        if self._connection is None or self._connection.closed:
+            self._connection = self._factory()
+        return self._connection
+
+    def cancel(self):
+        """Cancel the statement running on this connection; safe to call from any thread"""
+        connection = self._connection
+        if connection is not None and not connection.closed:
+            connection.cancel()
+
+    def cursor(self, *args, **kwargs):
+        return self.get().cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
 def q(cnx, sql, params=None):
     """Execute query returning list of dicts"""
-    with cnx.cursor() as cursor:
+    with _instrumented(cnx, sql, params), cnx.cursor() as cursor:
         cursor.execute(sql, params)
         return cursor.fetchall()
 
 def execute(cnx, sql, params=None):
     """Execute statement that does not return rows"""
-    with cnx.cursor() as cursor:
+    with _instrumented(cnx, sql, params), cnx.cursor() as cursor:
         cursor.execute(sql, params)
         return cursor.rowcount
 
 def one(cnx, sql, params=None):
     """Execute query returning single dict or None"""
-    with cnx.cursor() as cursor:
+    with _instrumented(cnx, sql, params), cnx.cursor() as cursor:
         cursor.execute(sql, params)
         result = cursor.fetchone()
         return result
@@ -46,3 +115,38 @@ def execute_migration(cnx, sql):
     with cnx.cursor() as cursor:
         cursor.execute(sql)
     return True
+
+async def listen(channel: str, callback: Callable[[Optional[str]], None], retry_s: float = 30.0):
+    """Call `callback(payload)` for every NOTIFY on `channel` until cancelled
+
+    Runs on its own connection, reconnecting after failures. `callback(None)` is
+    called on every (re)connect, since notifications sent while disconnected are lost.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        connection = None
+        try:
+            connection = await loop.run_in_executor(None, conn)
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+            callback(None)
+
+            ready = asyncio.Event()
+            loop.add_reader(connection.fileno(), ready.set)
+            try:
+                while True:
+                    await ready.wait()
+                    ready.clear()
+                    connection.poll()
+                    while connection.notifies:
+                        callback(connection.notifies.pop(0).payload)
+            finally:
+                loop.remove_reader(connection.fileno())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"LISTEN {channel} failed: {e}; retrying in {retry_s:.0f}s")
+        finally:
+            if connection is not None and not connection.closed:
+                connection.close()
+        await asyncio.sleep(retry_s)
@@ -0,0 +1,60 @@
+"""
+Request deadlines carried through async call chains in a context variable
+
+An HTTP handler opens a `deadline(seconds)` block; everything awaited inside it
+(LLM calls, MCP tool calls, provider queries) derives its own timeout from the
+time left via `timeout_for()`.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Absolute time.monotonic() deadline of the current request, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("cdm_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when work would start after the current deadline has passed"""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """Bound everything awaited inside the block by `seconds`
+
+    A nested deadline can only tighten an outer one, never extend it.
+    """
+    current = _deadline.get()
+    if seconds is None:
+        yield current
+        return
+    bound = time.monotonic() + seconds
+    if current is not None and current < bound:
+        bound = current
+    token = _deadline.set(bound)
+    try:
+        yield bound
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline (None if there is none)"""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def timeout_for(default: Optional[float]) -> Optional[float]:
+    """Timeout for the next operation: `default` capped by the time left
+
+    Raises:
+        DeadlineExceeded: If the current deadline has already passed
+    """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left if default is None else min(default, left)
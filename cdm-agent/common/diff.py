@@ -1,8 +1,12 @@
 """
 Trade state diff utilities for CDM MCP Provider
 """
+import copy
+from difflib import SequenceMatcher
 from typing import Any, List, Dict, Optional
 
+PAYOUT_TYPES = ('interestRatePayout', 'equityPayout', 'creditDefaultSwapPayout')
+
 def notional(trade_state: Dict[str, Any]) -> Optional[float]:
     """Extract notional amount from trade state payload"""
     try:
@@ -11,10 +15,15 @@ def notional(trade_state: Dict[str, Any]) -> Optional[float]:
         tradable_product = trade.get('tradableProduct', {})
         product = tradable_product.get('product', {})
         economic_terms = product.get('economicTerms', {})
-        payout = economic_terms.get('payout', {})
-        
+        return payout_notional(economic_terms.get('payout', {}))
+    except (KeyError, TypeError, IndexError):
+        return None
+
+def payout_notional(payout: Dict[str, Any]) -> Optional[float]:
+    """Extract notional amount from an already-resolved economicTerms.payout node"""
+    try:
         # Look for notional in various payout types
-        for payout_type in ['interestRatePayout', 'equityPayout', 'creditDefaultSwapPayout']:
+        for payout_type in PAYOUT_TYPES:
             if payout_type in payout:
                 payouts = payout[payout_type]
                 if isinstance(payouts, list) and payouts:
@@ -61,10 +70,195 @@ def appended(old_list: List[Any], new_list: List[Any]) -> List[Any]:
     if not new_list:
         return []
     
-    # Simple approach: return items in new_list not in old_list
-    # For more complex CDM objects, this might need custom comparison logic
-    return [item for item in new_list if item not in old_list]
+    # Compare subtree digests instead of deep-comparing every pair of items;
+    # an item is only dropped if it also equals an old item with its digest
+    memo: Dict[int, int] = {}
+    seen: Dict[int, List[Any]] = {}
+    for item in old_list:
+        seen.setdefault(subtree_digest(item, memo), []).append(item)
+    return [item for item in new_list if item not in seen.get(subtree_digest(item, memo), ())]
+
+
+# Keys identifying CDM list items across versions, checked in order
+# (meta.globalKey is checked first)
+IDENTITY_KEYS = ("globalKey", "externalKey", "identifier", "resetDate", "settlementDate")
+
+def subtree_digest(node: Any, memo: Optional[Dict[int, int]] = None) -> int:
+    """Structural digest of a JSON subtree
+    
+    Equal subtrees get equal digests, so differing digests prove a change.
+    Equal digests don't prove equality (this is a 64-bit hash), so callers
+    confirm with `==` before skipping a subtree. Digests of dicts/lists are memoized by object id in
+    `memo`; only share a memo while the hashed objects are alive and unchanged.
+    """
+    if isinstance(node, dict):
+        if memo is not None:
+            cached = memo.get(id(node))
+            if cached is not None:
+                return cached
+        digest = hash(("d", frozenset((key, subtree_digest(value, memo)) for key, value in node.items())))
+    elif isinstance(node, list):
+        if memo is not None:
+            cached = memo.get(id(node))
+            if cached is not None:
+                return cached
+        digest = hash(("l", tuple(subtree_digest(item, memo) for item in node)))
+    else:
+        # repr keeps True/1 and "1"/1 apart and is exact for floats
+        return hash(repr(node))
+    if memo is not None:
+        memo[id(node)] = digest
+    return digest
+
+def _pointer(path: str, token: Any) -> str:
+    """Append a token to an RFC 6901 JSON pointer"""
+    return f"{path}/{str(token).replace('~', '~0').replace('/', '~1')}"
+
+def _identity(item: Any, memo: Dict[int, int]) -> Any:
+    """Identity of a list item: its CDM key if it has one, else its digest"""
+    if isinstance(item, dict):
+        meta = item.get("meta")
+        if isinstance(meta, dict) and meta.get("globalKey") is not None:
+            return ("k", "globalKey", subtree_digest(meta["globalKey"], memo))
+        for key in IDENTITY_KEYS:
+            value = item.get(key)
+            if value is not None:
+                return ("k", key, subtree_digest(value, memo))
+    return ("h", subtree_digest(item, memo))
+
+def structural_diff(old: Any, new: Any, memo: Optional[Dict[int, int]] = None) -> List[Dict[str, Any]]:
+    """Diff two CDM JSON documents into an RFC 6902 JSON Patch
+    
+    Subtrees with equal digests are compared with `==` (in C) and skipped if
+    equal; list items are matched by identity key (see IDENTITY_KEYS) or by
+    digest. The returned operations
+    apply in order, so patches for consecutive versions can be concatenated.
+    
+    Args:
+        old: Source document
+        new: Target document
+        memo: Optional digest memo to share across several diffs of live objects
+    
+    Returns:
+        List of {"op": "add"|"remove"|"replace", "path": ..., "value": ...}
+    """
+    ops: List[Dict[str, Any]] = []
+    _diff_node(old, new, "", ops, {} if memo is None else memo)
+    return ops
 
+def _diff_node(old: Any, new: Any, path: str, ops: List[Dict[str, Any]], memo: Dict[int, int]) -> None:
+    if subtree_digest(old, memo) == subtree_digest(new, memo) and old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": _pointer(path, key)})
+        for key, value in new.items():
+            if key in old:
+                _diff_node(old[key], value, _pointer(path, key), ops, memo)
+            else:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops, memo)
+    else:
+        ops.append({"op": "replace", "path": path, "value": new})
 
+def _diff_list(old: List[Any], new: List[Any], path: str, ops: List[Dict[str, Any]], memo: Dict[int, int]) -> None:
+    # Trim the common prefix/suffix by digest; appends to histories end up here
+    prefix = 0
+    limit = min(len(old), len(new))
+    while (prefix < limit and subtree_digest(old[prefix], memo) == subtree_digest(new[prefix], memo)
+           and old[prefix] == new[prefix]):
+        prefix += 1
+    suffix = 0
+    while (suffix < limit - prefix
+           and subtree_digest(old[-1 - suffix], memo) == subtree_digest(new[-1 - suffix], memo)
+           and old[-1 - suffix] == new[-1 - suffix]):
+        suffix += 1
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+    if not old_mid and not new_mid:
+        return
+    
+    # Align the remaining items by identity, then walk the opcodes from the end
+    # so indices of not-yet-emitted (earlier) positions stay valid
+    matcher = SequenceMatcher(
+        None,
+        [_identity(item, memo) for item in old_mid],
+        [_identity(item, memo) for item in new_mid],
+        autojunk=False
+    )
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            # Same identity, possibly changed content
+            for offset in range(i2 - i1 - 1, -1, -1):
+                _diff_node(old_mid[i1 + offset], new_mid[j1 + offset],
+                           _pointer(path, prefix + i1 + offset), ops, memo)
+            continue
+        paired = min(i2 - i1, j2 - j1)
+        for index in range(i2 - 1, i1 + paired - 1, -1):
+            ops.append({"op": "remove", "path": _pointer(path, prefix + index)})
+        for offset in range(paired, j2 - j1):
+            ops.append({"op": "add", "path": _pointer(path, prefix + i1 + offset), "value": new_mid[j1 + offset]})
+        for offset in range(paired - 1, -1, -1):
+            _diff_node(old_mid[i1 + offset], new_mid[j1 + offset],
+                       _pointer(path, prefix + i1 + offset), ops, memo)
 
+def apply_patch(document: Any, patch: List[Dict[str, Any]]) -> Any:
+    """Apply an RFC 6902 add/remove/replace patch to a copy of a document"""
+    result = copy.deepcopy(document)
+    for op in patch:
+        tokens = [token.replace("~1", "/").replace("~0", "~") for token in op["path"].split("/")[1:]]
+        if not tokens:
+            if op["op"] == "remove":
+                result = None
+            else:
+                result = copy.deepcopy(op["value"])
+            continue
+        parent = result
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op["op"] == "add":
+                parent.insert(index, copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(op["value"])
+        else:
+            if op["op"] == "remove":
+                del parent[last]
+            else:
+                parent[last] = copy.deepcopy(op["value"])
+    return result
 
+def compose_state_diffs(diffs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compose consecutive diff_states results (A->B, B->C, ...) into one A->Z diff
+    
+    Field changes keep the first "from" and the last "to", history appends
+    and JSON Patch operations are concatenated in order.
+    """
+    if not diffs:
+        raise ValueError("At least one diff is required")
+    first, last = diffs[0], diffs[-1]
+    
+    changes = {
+        field: changed(first["changes"][field]["from"], last["changes"][field]["to"])
+        for field in first.get("changes", {})
+    }
+    appends: Dict[str, List[Any]] = {}
+    for diff in diffs:
+        for field, items in diff.get("appends", {}).items():
+            appends.setdefault(field, []).extend(items)
+    
+    return {
+        "header": {
+            "from_state_id": first["header"]["from_state_id"],
+            "to_state_id": last["header"]["to_state_id"]
+        },
+        "changes": changes,
+        "appends": appends,
+        "patch": [op for diff in diffs for op in diff.get("patch", [])]
+    }
@@ -0,0 +1,135 @@
+"""
+Message framing for the MCP stdio transport
+
+Two framings are supported:
+- "ndjson": one JSON message per line (MCP default, used until negotiated otherwise)
+- "length-prefixed": 4-byte big-endian body length, 1 flag byte, then the body;
+  flag bit 0 marks a zlib-compressed body
+
+The client offers the binary framing in `initialize` params
+(capabilities.experimental.framing / .compression) and the server answers with its
+choice in the initialize result; both sides switch after that response.
+"""
+import asyncio
+import struct
+import sys
+import zlib
+from typing import Optional, BinaryIO, Union
+
+FRAMING_NDJSON = "ndjson"
+FRAMING_LENGTH_PREFIXED = "length-prefixed"
+COMPRESSION_ZLIB = "zlib"
+
+FLAG_ZLIB = 0x01
+HEADER = struct.Struct(">IB")
+
+# Only compress bodies large enough for zlib to pay for itself
+COMPRESS_MIN_BYTES = 64 * 1024
+# Upper bound on a single frame, guards against reading garbage as a length
+MAX_FRAME_BYTES = 1024 * 1024 * 1024
+
+
+def encode_frame(body: bytes, compress: bool = False) -> bytes:
+    """Encode one length-prefixed frame"""
+    flags = 0
+    if compress and len(body) >= COMPRESS_MIN_BYTES:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(len(body), flags) + body
+
+
+def _decode_body(body: Union[bytes, memoryview], flags: int) -> Union[bytes, memoryview]:
+    if flags & FLAG_ZLIB:
+        return zlib.decompress(body)
+    return body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """Read one length-prefixed frame from an asyncio stream
+
+    readexactly is not subject to the StreamReader line limit, so frames of
+    any size up to MAX_FRAME_BYTES are accepted.
+
+    Raises:
+        asyncio.IncompleteReadError: If the stream ends mid-frame
+    """
+    length, flags = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds MAX_FRAME_BYTES")
+    return bytes(_decode_body(await reader.readexactly(length), flags))
+
+
+def negotiate_framing(offered: Optional[dict]) -> tuple:
+    """Pick (framing, compression) from a client's initialize capabilities.experimental"""
+    offered = offered or {}
+    framing = FRAMING_LENGTH_PREFIXED if FRAMING_LENGTH_PREFIXED in (offered.get("framing") or []) else FRAMING_NDJSON
+    compression = None
+    if framing == FRAMING_LENGTH_PREFIXED and COMPRESSION_ZLIB in (offered.get("compression") or []):
+        compression = COMPRESSION_ZLIB
+    return framing, compression
+
+
+class StdioTransport:
+    """
+    Blocking server-side transport over stdin/stdout
+    Meant to be driven from an executor thread by the provider's asyncio loop
+    """
+
+    def __init__(self, stdin: Optional[BinaryIO] = None, stdout: Optional[BinaryIO] = None):
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+        self.framing = FRAMING_NDJSON
+        self.compression: Optional[str] = None
+        # Reused receive buffer for framed reads; grows to the largest frame seen
+        self._buffer = bytearray(64 * 1024)
+
+    def set_framing(self, framing: str, compression: Optional[str] = None) -> None:
+        """Switch framing (after the initialize response has been written)"""
+        self.framing = framing
+        self.compression = compression
+
+    def _read_into(self, view: memoryview) -> bool:
+        """Fill `view` completely from stdin in chunks; False on EOF"""
+        filled = 0
+        while filled < len(view):
+            count = self.stdin.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def read_message(self) -> Optional[Union[bytes, memoryview]]:
+        """Read the next message body; None at end of input
+
+        Framed bodies are returned as a view into the reused buffer and are
+        only valid until the next call.
+        """
+        if self.framing == FRAMING_NDJSON:
+            while True:
+                line = self.stdin.readline()
+                if not line:
+                    return None
+                line = line.strip()
+                if line:
+                    return line
+
+        header = bytearray(HEADER.size)
+        if not self._read_into(memoryview(header)):
+            return None
+        length, flags = HEADER.unpack(header)
+        if length > MAX_FRAME_BYTES:
+            raise ValueError(f"Frame of {length} bytes exceeds MAX_FRAME_BYTES")
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+        view = memoryview(self._buffer)[:length]
+        if not self._read_into(view):
+            return None
+        return _decode_body(view, flags)
+
+    def write_message(self, body: bytes) -> None:
+        """Write one message body in the current framing"""
+        if self.framing == FRAMING_NDJSON:
+            self.stdout.write(body + b"\n")
+        else:
+            self.stdout.write(encode_frame(body, compress=self.compression == COMPRESSION_ZLIB))
+        self.stdout.flush()
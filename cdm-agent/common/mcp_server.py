@@ -0,0 +1,367 @@
+"""
+Serving loops shared by the MCP providers
+
+A provider implements `handle_message(request, session)` and hands it to `serve()`,
+which runs it either over stdio (child process of the API) or as a long-lived
+daemon on a Unix domain socket that several API workers connect to.
+
+Every provider answers `ping`, `metrics/snapshot` (see common.metrics),
+`debug/queries` (see common.query_log) and `debug/cache` (caches it registered
+with register_cache_stats()), and
+continues the caller's trace when a request carries `params._meta.traceparent`
+(see common.tracing).
+
+Clients may bound a request with `params._meta.timeoutMs` and abandon it with a
+`notifications/cancelled` message. Either one invokes the provider's `on_cancel`
+hook (e.g. cancelling the running database statement) if the request is executing,
+or drops it if it hasn't started yet.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import threading
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from common import codec, metrics, tracing
+from common.query_log import query_log
+from common.framing import (
+    FRAMING_NDJSON, FRAMING_LENGTH_PREFIXED, COMPRESSION_ZLIB,
+    StdioTransport, encode_frame, read_frame, negotiate_framing
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Per-connection protocol state negotiated at initialize"""
+
+    def __init__(self):
+        self.structured_results = False
+        self.framing = FRAMING_NDJSON
+        self.compression: Optional[str] = None
+        # Framing to switch to once the initialize response has been written
+        self.pending_framing: Optional[tuple] = None
+
+    def negotiate(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the client's initialize capabilities; returns our experimental capabilities"""
+        # Clients that accept structuredContent get tool results as plain
+        # JSON inside the envelope instead of a second, nested JSON string
+        experimental = (params.get("capabilities") or {}).get("experimental") or {}
+        self.structured_results = bool(experimental.get("structuredContent"))
+        framing, compression = negotiate_framing(experimental)
+        if framing != FRAMING_NDJSON:
+            self.pending_framing = (framing, compression)
+        return {"framing": framing, "compression": compression}
+
+    def tool_result(self, result: Any) -> Dict[str, Any]:
+        """Build a tools/call result in the format negotiated at initialize"""
+        if self.structured_results:
+            return {"content": [], "structuredContent": result}
+        return {"content": [{"type": "text", "text": codec.dumps(result)}]}
+
+
+Handler = Callable[[Dict[str, Any], Session], Awaitable[Optional[Dict[str, Any]]]]
+
+CANCELLED_NOTIFICATION = "notifications/cancelled"
+# Non-standard requests answered by every provider: its common.metrics snapshot,
+# its common.query_log statement statistics and its registered cache statistics
+METRICS_SNAPSHOT = "metrics/snapshot"
+QUERY_STATS = "debug/queries"
+CACHE_STATS = "debug/cache"
+
+# Cache name -> function returning its statistics, reported by CACHE_STATS
+_cache_stats: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_cache_stats(name: str, stats: Callable[[], Dict[str, Any]]) -> None:
+    """Report a provider cache's statistics under `name` in `debug/cache` answers"""
+    _cache_stats[name] = stats
+
+
+class CancelRegistry:
+    """
+    Thread-safe record of queued and executing requests so they can be cancelled
+    from the stdin reader thread or a deadline timer while the event loop is busy
+    """
+
+    def __init__(self, on_cancel: Optional[Callable[[], None]] = None):
+        self.on_cancel = on_cancel
+        self._lock = threading.Lock()
+        self._queued: Set[Hashable] = set()
+        self._cancelled: Set[Hashable] = set()
+        self._running: Optional[Hashable] = None
+        self._running_cancelled = False
+
+    def received(self, key: Hashable) -> None:
+        """Note a request that was read but has not started"""
+        with self._lock:
+            self._queued.add(key)
+
+    def start(self, key: Hashable) -> bool:
+        """Mark a request as executing; False if it was cancelled while queued"""
+        with self._lock:
+            self._queued.discard(key)
+            if key in self._cancelled:
+                self._cancelled.discard(key)
+                return False
+            self._running = key
+            self._running_cancelled = False
+            return True
+
+    def finish(self, key: Hashable) -> bool:
+        """Mark a request as done; returns whether it was cancelled while executing"""
+        with self._lock:
+            cancelled = self._running == key and self._running_cancelled
+            self._running = None
+            self._running_cancelled = False
+            return cancelled
+
+    def cancel(self, key: Hashable) -> None:
+        """Cancel a request: interrupt it if executing, drop it if queued, ignore it otherwise
+
+        The hook runs under the lock: released first, the request could finish and
+        the next one start before the hook fires, interrupting the wrong statement.
+        start() and finish() wait for it instead; the hook must not call back in here.
+        """
+        with self._lock:
+            if self._running == key:
+                self._running_cancelled = True
+                if self.on_cancel is not None:
+                    self.on_cancel()
+            elif key in self._queued:
+                self._cancelled.add(key)
+
+
+def _cancelled_request_id(request: Dict[str, Any]) -> Any:
+    """requestId of a notifications/cancelled message (None for anything else)"""
+    if request.get("method") != CANCELLED_NOTIFICATION:
+        return None
+    return (request.get("params") or {}).get("requestId")
+
+
+async def _dispatch(
+    handle: Handler,
+    request: Dict[str, Any],
+    session: Session,
+    registry: CancelRegistry,
+    key: Hashable
+) -> Optional[Dict[str, Any]]:
+    """Run the handler for one request under its deadline, turning failures into JSON-RPC errors"""
+    request_id = request.get("id")
+    if request_id is not None and not registry.start(key):
+        # Cancelled before it started; per MCP no response is sent
+        return None
+    if request.get("method") == "ping":
+        # MCP liveness probe; answered here so every provider supports it
+        registry.finish(key)
+        return {"jsonrpc": "2.0", "id": request_id, "result": {}}
+    if request.get("method") == METRICS_SNAPSHOT:
+        # Lets the API include this process's metrics (e.g. query latency) in /metrics
+        registry.finish(key)
+        return {"jsonrpc": "2.0", "id": request_id, "result": {"metrics": metrics.snapshot()}}
+    if request.get("method") == QUERY_STATS:
+        registry.finish(key)
+        return {"jsonrpc": "2.0", "id": request_id, "result": {"queries": query_log.report()}}
+    if request.get("method") == CACHE_STATS:
+        registry.finish(key)
+        caches = {name: stats() for name, stats in _cache_stats.items()}
+        return {"jsonrpc": "2.0", "id": request_id, "result": {"caches": caches}}
+
+    # Deadline enforced from a timer thread, since a blocking query holds the event loop
+    timer = None
+    params = request.get("params") or {}
+    meta = params.get("_meta") or {}
+    timeout_ms = meta.get("timeoutMs")
+    if request_id is not None and isinstance(timeout_ms, (int, float)):
+        timer = threading.Timer(max(timeout_ms, 0) / 1000.0, registry.cancel, (key,))
+        timer.daemon = True
+        timer.start()
+
+    # Continue the caller's trace, if it sent one, around the handler (and its queries)
+    traceparent = meta.get("traceparent")
+    trace = tracing.start_trace(
+        f"{request.get('method')} {params.get('name') or ''}".strip(), traceparent,
+        attributes={"rpc.method": request.get("method"), "mcp.tool": params.get("name")}
+    ) if traceparent else nullcontext()
+    try:
+        with trace:
+            response = await handle(request, session)
+    except Exception as e:
+        response = {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+        }
+    finally:
+        if timer is not None:
+            timer.cancel()
+        cancelled = registry.finish(key) if request_id is not None else False
+    return None if cancelled else response
+
+
+async def serve_stdio(handle: Handler, on_cancel: Optional[Callable[[], None]] = None) -> None:
+    """Serve a single client over stdin/stdout until stdin is closed"""
+    loop = asyncio.get_running_loop()
+    transport = StdioTransport()
+    session = Session()
+    registry = CancelRegistry(on_cancel)
+    inbox: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    framing_applied = threading.Event()
+
+    def read_loop():
+        # Own thread, so cancellations arrive while a request blocks the event loop
+        while True:
+            message = transport.read_message()
+            if message is None:
+                break
+            try:
+                request = codec.loads(message)
+            except codec.DecodeError:
+                continue
+            if not isinstance(request, dict):
+                continue
+            cancelled_id = _cancelled_request_id(request)
+            if cancelled_id is not None:
+                registry.cancel(cancelled_id)
+                continue
+            if request.get("id") is not None:
+                registry.received(request["id"])
+            loop.call_soon_threadsafe(inbox.put_nowait, request)
+            if request.get("method") == "initialize":
+                # The initialize response may switch framing; don't read ahead of it
+                framing_applied.wait()
+                framing_applied.clear()
+        loop.call_soon_threadsafe(inbox.put_nowait, None)
+
+    threading.Thread(target=read_loop, name="mcp-stdin", daemon=True).start()
+
+    while True:
+        request = await inbox.get()
+        if request is None:
+            break
+
+        response = await _dispatch(handle, request, session, registry, request.get("id"))
+        if response is not None:
+            await loop.run_in_executor(None, transport.write_message, codec.dumpb(response))
+        if session.pending_framing:
+            transport.set_framing(*session.pending_framing)
+            session.framing, session.compression = session.pending_framing
+            session.pending_framing = None
+        if request.get("method") == "initialize":
+            framing_applied.set()
+
+
+async def _serve_connection(
+    handle: Handler,
+    registry: CancelRegistry,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter
+) -> None:
+    """Serve one socket client; every connection negotiates its own session
+
+    Requests are keyed by (connection, id) in the shared registry since ids are
+    only unique per client.
+    """
+    session = Session()
+    connection_key = id(writer)
+    try:
+        while True:
+            try:
+                if session.framing == FRAMING_LENGTH_PREFIXED:
+                    message = await read_frame(reader)
+                else:
+                    message = await reader.readline()
+                    if not message:
+                        break
+                    message = message.strip()
+                    if not message:
+                        continue
+            except asyncio.IncompleteReadError:
+                break
+
+            try:
+                request = codec.loads(message)
+            except codec.DecodeError:
+                continue
+            if not isinstance(request, dict):
+                continue
+            cancelled_id = _cancelled_request_id(request)
+            if cancelled_id is not None:
+                registry.cancel((connection_key, cancelled_id))
+                continue
+
+            response = await _dispatch(handle, request, session, registry, (connection_key, request.get("id")))
+            if response is not None:
+                body = codec.dumpb(response)
+                if session.framing == FRAMING_LENGTH_PREFIXED:
+                    writer.write(encode_frame(body, compress=session.compression == COMPRESSION_ZLIB))
+                else:
+                    writer.write(body + b"\n")
+                await writer.drain()
+            if session.pending_framing:
+                session.framing, session.compression = session.pending_framing
+                session.pending_framing = None
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    except asyncio.CancelledError:
+        # Daemon shutting down with the client still connected
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_unix(
+    handle: Handler,
+    path: str,
+    on_cancel: Optional[Callable[[], None]] = None,
+    line_limit: int = 64 * 1024 * 1024
+) -> None:
+    """Serve clients on a Unix domain socket until SIGTERM/SIGINT"""
+    if os.path.exists(path):
+        # Stale socket from a previous run; binding would fail otherwise
+        os.unlink(path)
+    registry = CancelRegistry(on_cancel)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: _serve_connection(handle, registry, reader, writer),
+        path=path,
+        limit=line_limit
+    )
+    os.chmod(path, 0o660)
+    logger.info(f"Listening on {path}")
+
+    # Stop cleanly on SIGTERM/SIGINT so the socket file is removed
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+async def serve(
+    handle: Handler,
+    on_cancel: Optional[Callable[[], None]] = None,
+    argv: Optional[list] = None
+) -> None:
+    """Serve over stdio, or on a Unix socket when started with --socket PATH
+
+    Args:
+        handle: Provider message handler
+        on_cancel: Called (from any thread) to interrupt the request being executed
+        argv: Command line arguments (defaults to sys.argv)
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", help="Run as a daemon listening on this Unix socket path")
+    args = parser.parse_args(argv)
+    if args.socket:
+        logging.basicConfig(level=logging.INFO)
+        await serve_unix(handle, args.socket, on_cancel=on_cancel)
+    else:
+        await serve_stdio(handle, on_cancel=on_cancel)
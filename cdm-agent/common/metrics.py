@@ -0,0 +1,195 @@
+"""
+Process-local metrics rendered in the Prometheus text exposition format
+
+Counters and histograms with labels live in a module-level registry and are
+rendered by `render()` (format 0.0.4) without depending on prometheus_client.
+Provider processes answer the `metrics/snapshot` MCP request (see
+common.mcp_server) with `snapshot()`; the API merges those into its own /metrics
+output with a `process` label, so database timings from the providers show up
+next to the API's.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from common.query_log import fingerprint, normalize
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets (seconds): sub-millisecond cache hits up to multi-second LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Longest statement label; longer statements are cut and end in their fingerprint
+STATEMENT_LABEL_CHARS = 120
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            series = [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in self._series.items()]
+        return {"name": self.name, "type": self.kind, "help": self.documentation, "series": series}
+
+
+class Histogram(_Metric):
+    """Bucketed observations (cumulative on render) with sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[Dict[str, Any]]:
+        """Observe the duration of the block; labels may be updated inside it (e.g. an outcome)"""
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            series = [
+                {"labels": dict(zip(self.labelnames, key)), "counts": list(counts), "sum": total, "count": count}
+                for key, (counts, total, count) in self._series.items()
+            ]
+        return {"name": self.name, "type": self.kind, "help": self.documentation, "buckets": list(self.buckets), "series": series}
+
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs) -> Any:
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric {name} already registered with a different type or labels")
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Get or create a counter in the process registry (by convention named *_total)"""
+    return _register(Counter, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram in the process registry"""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """JSON-serializable state of every metric in this process"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return [metric.snapshot() for metric in metrics]
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """Label for a SQL statement: its common.query_log normalized form
+
+    Literals are replaced like in the query log, so a statement has one series
+    whatever its arguments and matches its debug/queries entry. A label cut to
+    STATEMENT_LABEL_CHARS ends in the statement's query log fingerprint.
+    """
+    text = normalize(sql)
+    if len(text) <= STATEMENT_LABEL_CHARS:
+        return text
+    suffix = f"... [{fingerprint(text)}]"
+    return text[:STATEMENT_LABEL_CHARS - len(suffix)] + suffix
+
+
+_ESCAPES = re.compile(r'[\\"\n]')
+
+
+def _escape(value: str) -> str:
+    return _ESCAPES.sub(lambda m: {"\\": "\\\\", '"': '\\"', "\n": "\\n"}[m.group(0)], value)
+
+
+def _labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+    merged = {**(extra or {}), **labels}
+    if not merged:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in merged.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(remote: Sequence[Tuple[Dict[str, str], List[Dict[str, Any]]]] = ()) -> str:
+    """Prometheus text exposition of this process's metrics plus other processes' snapshots
+
+    Args:
+        remote: (extra labels, snapshot()) per other process, e.g. ({"process": "cdm_db"}, ...)
+    """
+    sources = [({}, snapshot())] + list(remote)
+    merged: Dict[str, Dict[str, Any]] = {}
+    for extra, metrics in sources:
+        for metric in metrics:
+            entry = merged.setdefault(metric["name"], {**metric, "series": []})
+            entry["series"].extend((extra, series) for series in metric["series"])
+
+    lines: List[str] = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for extra, series in metric["series"]:
+            if metric["type"] == "counter":
+                lines.append(f"{name}{_labels(series['labels'], extra)} {_number(series['value'])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"], series["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels({**series['labels'], 'le': _number(bound)}, extra)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels({**series['labels'], 'le': '+Inf'}, extra)} {series['count']}")
+            lines.append(f"{name}_sum{_labels(series['labels'], extra)} {_number(series['sum'])}")
+            lines.append(f"{name}_count{_labels(series['labels'], extra)} {series['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,101 @@
+"""
+Content-addressed cache of decoded CDM payloads keyed by payload_sha256
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+class PayloadCache:
+    """
+    Bounded, byte-budgeted LRU of decoded payloads keyed by content hash,
+    plus a small id -> hash lookup with a TTL
+
+    Payloads are shared between callers and must be treated as read-only.
+    The byte budget is measured on the JSON text the payload was decoded from.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, id_ttl_s: float = 30.0, max_ids: int = 100_000):
+        self.max_bytes = max_bytes
+        self.id_ttl_s = id_ttl_s
+        self.max_ids = max_ids
+        self._payloads: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()  # sha -> (payload, size)
+        self._ids: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # object id -> (sha, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.id_hits = 0
+        self.id_misses = 0
+        self.evictions = 0
+
+    def lookup_hash(self, object_id: str) -> Optional[str]:
+        """Get the cached content hash for an object id, or None if unknown/expired"""
+        with self._lock:
+            entry = self._ids.get(object_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.id_misses += 1
+                return None
+            self.id_hits += 1
+            return entry[0]
+
+    def stale_hash(self, object_id: str) -> Optional[str]:
+        """Get the last recorded content hash for an object id even if expired, as long as
+        its payload is still cached (worth revalidating instead of refetching), else None"""
+        with self._lock:
+            entry = self._ids.get(object_id)
+            return entry[0] if entry is not None and entry[0] in self._payloads else None
+
+    def remember_hash(self, object_id: str, sha: str) -> None:
+        """Record the current content hash of an object id"""
+        with self._lock:
+            self._ids[object_id] = (sha, time.monotonic() + self.id_ttl_s)
+            self._ids.move_to_end(object_id)
+            while len(self._ids) > self.max_ids:
+                self._ids.popitem(last=False)
+
+    def get(self, sha: str) -> Optional[Any]:
+        """Get a decoded payload by content hash"""
+        with self._lock:
+            entry = self._payloads.get(sha)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._payloads.move_to_end(sha)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, sha: str, payload: Any, size: int) -> None:
+        """Store a decoded payload; payloads larger than the whole budget are not cached"""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._payloads.pop(sha, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._payloads[sha] = (payload, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._payloads.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rates and memory usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            id_lookups = self.id_hits + self.id_misses
+            return {
+                "entries": len(self._payloads),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "id_entries": len(self._ids),
+                "id_hits": self.id_hits,
+                "id_misses": self.id_misses,
+                "id_hit_rate": self.id_hits / id_lookups if id_lookups else 0.0,
+            }
@@ -0,0 +1,286 @@
+"""
+Columnar trade summary builder for portfolio-wide list and aggregate views
+"""
+from array import array
+from bisect import bisect_left
+from datetime import date
+from typing import Dict, Any, List, Optional, Sequence, Iterable
+
+from common.transform import (
+    DEFAULT_TRADE_METADATA,
+    POSITION_STATE_TO_STATUS,
+    TradeFields,
+    extract_trade_fields,
+    _is_missing,
+)
+
+# Column order of a summary table; "id" and "status" come from the lineage,
+# everything else from the latest TradeState payload
+SUMMARY_COLUMNS = (
+    "id",
+    "productType",
+    "status",
+    "currentNotional",
+    "currency",
+    "counterparty",
+    "bank",
+    "startDate",
+    "maturityDate",
+)
+
+# Fields returned by the /trades list view (kept stable for the frontend)
+LIST_VIEW_COLUMNS = (
+    "id",
+    "productType",
+    "status",
+    "currentNotional",
+    "currency",
+    "counterparty",
+    "bank",
+)
+
+SummaryColumns = Dict[str, Any]
+
+
+def summary_columns_from_rows(
+    trade_ids: Sequence[str],
+    rows: Sequence[TradeFields],
+    position_states: Sequence[Optional[str]]
+) -> SummaryColumns:
+    """Build summary columns from pre-extracted TradeFields rows
+
+    Args:
+        trade_ids: Trade identifiers, one per row
+        rows: TradeFields records (see common.transform.extract_trade_fields)
+        position_states: Latest position_state per trade
+
+    Returns:
+        Dict of column name -> column; currentNotional is an array('d'),
+        the other columns are lists
+    """
+    count = len(trade_ids)
+    if len(rows) != count or len(position_states) != count:
+        raise ValueError("trade_ids, rows and position_states must have the same length")
+
+    # Transpose rows into columns in one pass (zip runs at C speed)
+    if count:
+        (product_types, banks, counterparties, notionals,
+         currencies, start_dates, maturity_dates) = (list(col) for col in zip(*rows))
+    else:
+        product_types = banks = counterparties = notionals = currencies = start_dates = maturity_dates = []
+
+    columns: SummaryColumns = {
+        "id": list(trade_ids),
+        "productType": product_types,
+        "status": [POSITION_STATE_TO_STATUS.get(state or "", "Active") for state in position_states],
+        "currentNotional": array("d", [value or 0.0 for value in notionals]),
+        "currency": currencies,
+        "counterparty": counterparties,
+        "bank": banks,
+        "startDate": start_dates,
+        "maturityDate": maturity_dates,
+    }
+    apply_default_columns(columns)
+    return columns
+
+
+def summary_columns_from_payloads(
+    trade_ids: Sequence[str],
+    payloads: Iterable[Dict[str, Any]],
+    position_states: Sequence[Optional[str]]
+) -> SummaryColumns:
+    """Build summary columns straight from latest TradeState payloads"""
+    rows = [extract_trade_fields(payload) for payload in payloads]
+    return summary_columns_from_rows(trade_ids, rows, position_states)
+
+
+def apply_default_columns(columns: SummaryColumns) -> SummaryColumns:
+    """Fill missing values from DEFAULT_TRADE_METADATA in place
+
+    Only rows whose trade id has defaults are visited, so the cost scales
+    with the number of demo trades rather than with the portfolio size.
+    """
+    if not DEFAULT_TRADE_METADATA:
+        return columns
+
+    ids = columns["id"]
+    for index in (i for i, trade_id in enumerate(ids) if trade_id in DEFAULT_TRADE_METADATA):
+        for key, default_value in DEFAULT_TRADE_METADATA[ids[index]].items():
+            column = columns.get(key)
+            if column is not None and _is_missing(column[index]):
+                column[index] = default_value
+    return columns
+
+
+def columns_to_json(columns: SummaryColumns, fields: Sequence[str] = SUMMARY_COLUMNS) -> Dict[str, List[Any]]:
+    """Convert summary columns into JSON-serializable lists (columnar response layout)"""
+    return {
+        field: column.tolist() if isinstance(column, array) else column
+        for field, column in ((field, columns[field]) for field in fields)
+    }
+
+
+def take_rows(columns: SummaryColumns, rows: Sequence[int]) -> SummaryColumns:
+    """Summary columns holding only `rows`, in that order"""
+    return {
+        field: array(column.typecode, (column[row] for row in rows)) if isinstance(column, array)
+        else [column[row] for row in rows]
+        for field, column in columns.items()
+    }
+
+
+def concat_columns(first: SummaryColumns, second: SummaryColumns) -> SummaryColumns:
+    """Summary columns holding the rows of `first` followed by those of `second`"""
+    return {
+        field: (array(column.typecode, column) + array(column.typecode, second[field])) if isinstance(column, array)
+        else list(column) + list(second[field])
+        for field, column in first.items()
+    }
+
+
+def sort_by_id(columns: SummaryColumns) -> SummaryColumns:
+    """Summary columns ordered by trade id (the same columns if they already are)"""
+    ids = columns["id"]
+    if all(ids[row] <= ids[row + 1] for row in range(len(ids) - 1)):
+        return columns
+    return take_rows(columns, sorted(range(len(ids)), key=ids.__getitem__))
+
+
+def merge_columns(columns: SummaryColumns, updates: SummaryColumns) -> Optional[SummaryColumns]:
+    """Summary columns with `updates` applied, or None if they change nothing
+
+    Both must be ordered by trade id. A row of `updates` replaces the row with the
+    same id and other rows are added; `columns` itself is left untouched, since
+    readers may still hold it. Existing ids are found by binary search, so the cost
+    is a copy of the columns plus O(len(updates) log len(columns)).
+    """
+    ids = columns["id"]
+    fields = list(columns)
+    replaced, added = [], []
+    for update_row, trade_id in enumerate(updates["id"]):
+        row = bisect_left(ids, trade_id)
+        if row < len(ids) and ids[row] == trade_id:
+            if any(columns[field][row] != updates[field][update_row] for field in fields):
+                replaced.append((row, update_row))
+        else:
+            added.append(update_row)
+    if not replaced and not added:
+        return None
+
+    merged = {field: column[:] for field, column in columns.items()}
+    for row, update_row in replaced:
+        for field in fields:
+            merged[field][row] = updates[field][update_row]
+    if added:
+        merged = concat_columns(merged, take_rows(updates, added))
+        if ids and updates["id"][added[0]] < ids[-1]:
+            # New ids in between existing ones; appended ids (the usual case) keep the order
+            merged = take_rows(merged, sorted(range(len(merged["id"])), key=merged["id"].__getitem__))
+    return merged
+
+
+def columns_to_records(columns: SummaryColumns, fields: Sequence[str] = LIST_VIEW_COLUMNS) -> List[Dict[str, Any]]:
+    """Convert summary columns into row dicts (the /trades list layout)"""
+    selected = columns_to_json(columns, fields)
+    return [dict(zip(fields, values)) for values in zip(*(selected[field] for field in fields))]
+
+
+# Dimensions accepted by aggregate_columns; maturityBucket is derived from maturityDate
+AGGREGATE_DIMENSIONS = ("counterparty", "bank", "productType", "currency", "status", "maturityBucket")
+
+# (label, upper bound in years) for remaining time to maturity
+MATURITY_BUCKETS = (
+    ("<1Y", 1),
+    ("1-2Y", 2),
+    ("2-5Y", 5),
+    ("5-10Y", 10),
+    ("10Y+", None),
+)
+
+
+def maturity_bucket_column(maturity_dates: Sequence[Optional[str]], as_of: date) -> List[str]:
+    """Map maturity dates (YYYY-MM-DD) to remaining-tenor bucket labels"""
+    # Precompute bucket boundaries once as ISO strings; ISO dates compare lexically
+    boundaries = []
+    for label, years in MATURITY_BUCKETS:
+        if years is None:
+            boundaries.append((label, None))
+        else:
+            try:
+                boundary = as_of.replace(year=as_of.year + years)
+            except ValueError:  # 29 Feb
+                boundary = as_of.replace(year=as_of.year + years, day=28)
+            boundaries.append((label, boundary.isoformat()))
+    today = as_of.isoformat()
+
+    def bucket(value: Optional[str]) -> str:
+        if not value or _is_missing(value):
+            return "Unknown"
+        value = value[:10]
+        if value <= today:
+            return "Matured"
+        for label, boundary in boundaries:
+            if boundary is None or value <= boundary:
+                return label
+        return "Unknown"
+
+    # Maturity dates repeat heavily across a book, so bucket each distinct value once
+    labels = {value: bucket(value) for value in set(maturity_dates)}
+    return [labels[value] for value in maturity_dates]
+
+
+def notional_by_currency(columns: SummaryColumns) -> Dict[str, float]:
+    """Total current notional per currency; amounts in different currencies are never summed"""
+    totals: Dict[str, float] = {}
+    for notional_val, currency in zip(columns["currentNotional"], columns["currency"]):
+        totals[currency] = totals.get(currency, 0.0) + notional_val
+    return totals
+
+
+def aggregate_columns(
+    columns: SummaryColumns,
+    by: Sequence[str],
+    as_of: Optional[date] = None
+) -> List[Dict[str, Any]]:
+    """Group summary columns and total notionals per group and currency
+
+    Notionals are only summed within a currency, so groups carry a per-currency
+    split rather than a single total.
+
+    Args:
+        columns: Summary columns from summary_columns_from_rows()
+        by: One or more of AGGREGATE_DIMENSIONS
+        as_of: Reference date for maturity buckets (defaults to today)
+
+    Returns:
+        Groups sorted by trade count (descending), then key, each with the
+        group key, trade count and notional by currency
+    """
+    unknown = [dimension for dimension in by if dimension not in AGGREGATE_DIMENSIONS]
+    if not by or unknown:
+        raise ValueError(f"Unsupported aggregation dimension(s): {unknown or by}; expected {AGGREGATE_DIMENSIONS}")
+
+    key_columns = [
+        maturity_bucket_column(columns["maturityDate"], as_of or date.today())
+        if dimension == "maturityBucket" else columns[dimension]
+        for dimension in by
+    ]
+    keys = zip(*key_columns) if len(key_columns) > 1 else key_columns[0]
+
+    counts: Dict[Any, int] = {}
+    by_currency: Dict[Any, Dict[str, float]] = {}
+    for key, notional_val, currency in zip(keys, columns["currentNotional"], columns["currency"]):
+        counts[key] = counts.get(key, 0) + 1
+        split = by_currency.setdefault(key, {})
+        split[currency] = split.get(currency, 0.0) + notional_val
+
+    groups = []
+    for key, count in counts.items():
+        values = key if len(by) > 1 else (key,)
+        groups.append({
+            "key": dict(zip(by, values)),
+            "tradeCount": count,
+            "notionalByCurrency": by_currency[key],
+        })
+    groups.sort(key=lambda group: (-group["tradeCount"], [str(value) for value in group["key"].values()]))
+    return groups
@@ -0,0 +1,163 @@
+"""
+Per-statement query statistics and slow-query plans
+
+common.db reports every q/one/execute here. Statements are grouped by a normalized
+fingerprint (whitespace collapsed, literals replaced by ?), with call counts,
+total time and percentiles over the most recent calls. A statement slower than
+CDM_SLOW_QUERY_MS is logged, and for read-only statements an
+`EXPLAIN (ANALYZE, BUFFERS)` of the same query is captured, at most once per
+CDM_SLOW_QUERY_EXPLAIN_INTERVAL_S per fingerprint since it runs the query again.
+
+Providers answer the `debug/queries` MCP request (see common.mcp_server) with
+report(), which /api/debug/queries shows next to the API process's own.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("CDM_SLOW_QUERY_MS", "200"))
+EXPLAIN_SLOW_QUERIES = os.getenv("CDM_EXPLAIN_SLOW_QUERIES", "true").lower() == "true"
+EXPLAIN_INTERVAL_S = float(os.getenv("CDM_SLOW_QUERY_EXPLAIN_INTERVAL_S", "300"))
+# Latencies kept per statement for percentiles, and plans kept per statement
+RECENT_SAMPLES = 512
+PLANS_PER_STATEMENT = 3
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_DATA_MODIFYING = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Statement text with whitespace collapsed and literals and placeholders replaced by ?"""
+    text = " ".join(sql.split())
+    text = _STRING_LITERAL.sub("?", text)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = text.replace("%s", "?")
+    return _IN_LIST.sub("(?...)", text)
+
+
+def fingerprint(statement: str) -> str:
+    """Short stable id of a normalized statement"""
+    return hashlib.sha1(statement.encode()).hexdigest()[:12]
+
+
+def explainable(statement: str) -> bool:
+    """Whether running the statement again under EXPLAIN ANALYZE has no side effects"""
+    return bool(_READ_ONLY.match(statement)) and not _DATA_MODIFYING.search(statement)
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100.0 * len(ordered)) - 1))]
+
+
+class _StatementStats:
+    __slots__ = ("statement", "calls", "errors", "total_s", "max_s", "slow_calls", "recent", "plans", "explained_at")
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.calls = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.slow_calls = 0
+        self.recent: Deque[float] = deque(maxlen=RECENT_SAMPLES)
+        self.plans: Deque[Dict[str, Any]] = deque(maxlen=PLANS_PER_STATEMENT)
+        self.explained_at = 0.0
+
+
+class QueryLog:
+    """Statistics per statement fingerprint for one process"""
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, explain: bool = EXPLAIN_SLOW_QUERIES,
+                 explain_interval_s: float = EXPLAIN_INTERVAL_S):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.explain_interval_s = explain_interval_s
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _StatementStats] = {}
+
+    def record(self, statement: str, seconds: float, failed: bool = False) -> bool:
+        """Record one execution of a normalized statement
+
+        Returns:
+            Whether the caller should capture an EXPLAIN ANALYZE of it now
+        """
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats(statement)
+            stats.calls += 1
+            if failed:
+                stats.errors += 1
+                return False
+            stats.total_s += seconds
+            stats.max_s = max(stats.max_s, seconds)
+            stats.recent.append(seconds)
+            if seconds * 1000 < self.slow_ms:
+                return False
+            stats.slow_calls += 1
+            now = time.monotonic()
+            capture = (self.explain and explainable(statement)
+                       and (not stats.explained_at or now - stats.explained_at >= self.explain_interval_s))
+            if capture:
+                stats.explained_at = now
+        logger.warning(f"Slow query ({seconds * 1000:.0f}ms, fingerprint {key}): {statement[:300]}")
+        return capture
+
+    def add_plan(self, statement: str, seconds: float, params: Any, plan: Any) -> None:
+        """Keep an EXPLAIN (ANALYZE, BUFFERS) result for a slow execution"""
+        with self._lock:
+            stats = self._stats.get(fingerprint(statement))
+            if stats is not None:
+                stats.plans.append({
+                    "captured_at": time.time(),
+                    "duration_ms": seconds * 1000,
+                    "params": repr(params)[:500] if params is not None else None,
+                    "plan": plan,
+                })
+
+    def report(self, limit: Optional[int] = None, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """Statements with counts, latency percentiles (over recent calls) and captured plans"""
+        with self._lock:
+            snapshot = [(key, stats, sorted(stats.recent), list(stats.plans)) for key, stats in self._stats.items()]
+        rows = []
+        for key, stats, recent, plans in snapshot:
+            succeeded = stats.calls - stats.errors
+            rows.append({
+                "fingerprint": key,
+                "statement": stats.statement,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "total_ms": stats.total_s * 1000,
+                "mean_ms": stats.total_s * 1000 / succeeded if succeeded else 0.0,
+                "p50_ms": _percentile(recent, 50) * 1000,
+                "p95_ms": _percentile(recent, 95) * 1000,
+                "p99_ms": _percentile(recent, 99) * 1000,
+                "max_ms": stats.max_s * 1000,
+                "slow_calls": stats.slow_calls,
+                "plans": plans,
+            })
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+# Process-wide log fed by common.db
+query_log = QueryLog()
@@ -0,0 +1,203 @@
+"""
+Request tracing written as OTLP/JSON lines
+
+Spans follow the OpenTelemetry model (trace id, span id, parent, kind, attributes)
+and are propagated across process boundaries as W3C `traceparent` strings: the API
+starts a trace per HTTP request, MCP tool calls carry it in `params._meta.traceparent`,
+and providers continue it around their handler and database statements.
+
+Tracing is off unless CDM_TRACE_FILE is set. Each process then appends its spans
+to that file, one OTLP ExportTraceServiceRequest JSON object per line (the format
+of the OpenTelemetry Collector's file exporter). trace_waterfall.py renders one
+trace from it. Spans are only recorded inside a trace started by start_trace(),
+so background work outside a request doesn't produce orphan traces.
+"""
+import logging
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("CDM_TRACE_FILE", "")
+# Spans buffered before a write even if no local trace root has finished
+TRACE_FLUSH_SPANS = int(os.getenv("CDM_TRACE_FLUSH_SPANS", "256"))
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Default service name: the provider's directory (cdm_db, cdm_ref) or the script name
+_service_name = os.getenv("CDM_SERVICE_NAME") or (
+    Path(sys.argv[0]).resolve().parent.name if Path(sys.argv[0]).stem == "provider" else Path(sys.argv[0]).stem
+) or "cdm"
+
+
+class Span:
+    """One timed operation; attributes can be added until it ends"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes", "start_ns", "end_ns", "error", "local_root")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int,
+                 attributes: Optional[Dict[str, Any]], local_root: bool = False):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self.local_root = local_root
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("cdm_current_span", default=None)
+_buffer: List[Span] = []
+_buffer_lock = threading.Lock()
+
+
+def set_service_name(name: str) -> None:
+    """Name this process's spans are exported under (unless CDM_SERVICE_NAME is set)"""
+    global _service_name
+    if not os.getenv("CDM_SERVICE_NAME"):
+        _service_name = name
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace_id, parent span id) from a W3C traceparent, or None if absent or malformed"""
+    match = _TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the active span, to hand to another process"""
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+@contextmanager
+def _activate(span: Span) -> Iterator[Span]:
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current.reset(token)
+        _record(span)
+
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, kind: int = SERVER,
+                attributes: Optional[Dict[str, Any]] = None) -> Iterator[Optional[Span]]:
+    """Start this process's part of a trace: a new trace, or a continuation of `traceparent`
+
+    Yields None when tracing is off.
+    """
+    if not TRACE_FILE:
+        yield None
+        return
+    parent = parse_traceparent(traceparent)
+    trace_id = parent[0] if parent else secrets.token_hex(16)
+    with _activate(Span(trace_id, parent[1] if parent else None, name, kind, attributes, local_root=True)) as span:
+        yield span
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, kind: int = INTERNAL) -> Iterator[Optional[Span]]:
+    """Child span of the active one; a no-op (yields None) outside a trace"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(parent.trace_id, parent.span_id, name, kind, attributes)) as child:
+        yield child
+
+
+def _record(span: Span) -> None:
+    with _buffer_lock:
+        _buffer.append(span)
+        if not span.local_root and len(_buffer) < TRACE_FLUSH_SPANS:
+            return
+        spans = _buffer[:]
+        _buffer.clear()
+    _write(spans)
+
+
+def flush() -> None:
+    """Write buffered spans now"""
+    with _buffer_lock:
+        spans = _buffer[:]
+        _buffer.clear()
+    if spans:
+        _write(spans)
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def _otlp(spans: List[Span]) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest for a batch of spans"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", _service_name), _attribute("process.pid", os.getpid())]},
+        "scopeSpans": [{
+            "scope": {"name": "cdm-agent"},
+            "spans": [
+                {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": span.kind,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [_attribute(key, value) for key, value in span.attributes.items() if value is not None],
+                    "status": {"code": 2, "message": span.error} if span.error else {},
+                }
+                for span in spans
+            ]
+        }]
+    }]}
+
+
+def _write(spans: List[Span]) -> None:
+    # One write per batch on an O_APPEND file, so lines from several processes don't interleave
+    line = (codec.dumps(_otlp(spans)) + "\n").encode()
+    try:
+        fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning(f"Could not write spans to {TRACE_FILE}: {e}")
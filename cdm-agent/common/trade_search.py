@@ -0,0 +1,306 @@
+"""
+In-memory trade search over portfolio summary columns
+
+Matches a query against trade id, counterparty, bank and product type, and ranks
+hits by how they matched (see the tier constants), then by trade id:
+
+- id prefixes come from a binary search over the sorted, lowercased ids
+- infixes of ids come from a trigram index: the rarest trigram of the query
+  yields the candidates, which are then checked with a substring test
+- field values have few distinct values, so those are matched by scanning them
+- with no hit at all, ids and field values sharing most of the query's
+  trigrams (roughly pg_trgm's word_similarity()) are returned, which finds
+  them despite a typo or two
+
+Infix matching needs at least three characters (one trigram); shorter queries
+match prefixes only. The index is built once per summary snapshot, and results
+are kept for recent queries: a longer query typed after a cached one (search as
+you type) is answered by filtering the cached matches instead of the index.
+"""
+import heapq
+import os
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from common.portfolio import SummaryColumns
+
+# Searchable summary columns; "id" is indexed, the others are matched by distinct value
+SEARCH_FIELDS = ("id", "counterparty", "bank", "productType")
+
+# Match tiers, best first
+EXACT_ID = 0
+ID_PREFIX = 1
+FIELD_PREFIX = 2  # a field value or one of its words starts with the query
+ID_INFIX = 3
+FIELD_INFIX = 4
+FUZZY = 5
+
+# Ranked matches kept per query; a query with more matches can't be narrowed from
+SEARCH_MATCH_CAP = int(os.getenv("CDM_SEARCH_MATCH_CAP", "1000"))
+SEARCH_CACHE_ENTRIES = int(os.getenv("CDM_SEARCH_CACHE_ENTRIES", "256"))
+# Minimum share of the query's trigrams for fuzzy matches (pg_trgm's word_similarity_threshold)
+FUZZY_THRESHOLD = 0.6
+# Trigrams in more ids than this are too common to find fuzzy candidates with
+FUZZY_MAX_POSTING = 50000
+# Rank lists of matched field values are sorted together when this small, merged
+# when there are at most FIELD_MERGE_LISTS of them, and otherwise found by scanning
+# ranks (that many matched values are dense, so the scan stops early)
+FIELD_SORT_MAX = 4096
+FIELD_MERGE_LISTS = 2048
+
+
+def normalize_query(query: str) -> str:
+    """Lowercased query with whitespace collapsed"""
+    return " ".join(query.lower().split())
+
+
+def trigrams(text: str) -> set:
+    """Distinct three-character substrings of `text`"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(query_grams: set, grams: set) -> float:
+    """Share of the query's trigrams found in a value's trigrams"""
+    return len(query_grams & grams) / len(query_grams) if query_grams else 0.0
+
+
+def word_prefix(value: str, text: str) -> bool:
+    """Whether a normalized value, or one of its words, starts with `text`"""
+    return (" " + text) in (" " + value)
+
+
+class TradeSearchIndex:
+    """Search index over one summary snapshot; rows are positions in its columns"""
+
+    def __init__(self, columns: SummaryColumns, fields: Iterable[str] = SEARCH_FIELDS):
+        started = time.perf_counter()
+        ids = [str(trade_id).lower() for trade_id in columns["id"]]
+        # Everything below works on ranks (positions in id order), so posting
+        # lists are sorted by id and tiers come out in id order
+        self._order = array("i", sorted(range(len(ids)), key=ids.__getitem__))
+        self._ids = [ids[row] for row in self._order]
+
+        postings: Dict[str, List[int]] = {}
+        for rank, trade_id in enumerate(self._ids):
+            for gram in trigrams(trade_id):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = []
+                posting.append(rank)
+        self._trigrams = {gram: array("i", posting) for gram, posting in postings.items()}
+
+        # Per field: normalized distinct value -> ranks having it, and each rank's value
+        self._values: Dict[str, Dict[str, array]] = {}
+        self._rank_values: Dict[str, List[str]] = {}
+        for field in fields:
+            if field == "id":
+                continue
+            column = columns[field]
+            distinct: Dict[Any, str] = {}
+            by_value: Dict[str, array] = {}
+            per_rank = []
+            for rank, row in enumerate(self._order):
+                value = column[row]
+                key = distinct.get(value)
+                if key is None:
+                    # One normalized string per distinct value, shared by every rank
+                    key = distinct[value] = normalize_query(str(value)) if value else ""
+                per_rank.append(key)
+                if key:
+                    ranks = by_value.get(key)
+                    if ranks is None:
+                        ranks = by_value[key] = array("i")
+                    ranks.append(rank)
+            self._values[field] = by_value
+            self._rank_values[field] = per_rank
+
+        # Trigram -> (field, value) for fuzzy matching of field values
+        self._value_trigrams: Dict[str, List[Tuple[str, str]]] = {}
+        self._value_gram_sets: Dict[Tuple[str, str], set] = {}
+        for field, by_value in self._values.items():
+            for value in by_value:
+                grams = self._value_gram_sets[(field, value)] = trigrams(value)
+                for gram in grams:
+                    self._value_trigrams.setdefault(gram, []).append((field, value))
+
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, ...], bool]]" = OrderedDict()
+        self._hits = 0
+        self._narrowed = 0
+        self._misses = 0
+        self.build_s = time.perf_counter() - started
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(self, query: str, limit: int = 20) -> List[int]:
+        """Rows of the best `limit` matches of `query`, best first"""
+        text = normalize_query(query)
+        if not text:
+            return []
+        cached = self._cache.get(text)
+        if cached is not None:
+            self._hits += 1
+            self._cache.move_to_end(text)
+            ranks = cached[0]
+        else:
+            ranks, complete = self._narrow(text) or self._match(text)
+            self._cache[text] = (ranks, complete)
+            if len(self._cache) > SEARCH_CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+        return [self._order[rank] for rank in ranks[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "trades": len(self._ids),
+            "trigrams": len(self._trigrams),
+            "build_ms": self.build_s * 1000,
+            "cached_queries": len(self._cache),
+            "cache_hits": self._hits,
+            "narrowed": self._narrowed,
+            "index_lookups": self._misses,
+        }
+
+    def _narrow(self, text: str) -> Optional[Tuple[Tuple[int, ...], bool]]:
+        """Matches of `text` filtered from the complete matches of a cached shorter prefix of it
+
+        Every tier but FUZZY is a substring match, so whatever contains `text`
+        also contains each of its prefixes.
+        """
+        for end in range(len(text) - 1, 0, -1):
+            cached = self._cache.get(text[:end])
+            if cached is not None and cached[1]:
+                ranked = []
+                for rank in cached[0]:
+                    tier = self._tier(rank, text)
+                    if tier is not None:
+                        ranked.append((tier, rank))
+                if not ranked:
+                    # Nothing left to narrow to; the index may still find fuzzy matches
+                    return None
+                self._narrowed += 1
+                ranked.sort()
+                return tuple(rank for _, rank in ranked), True
+        return None
+
+    def _tier(self, rank: int, text: str) -> Optional[int]:
+        """How the trade at `rank` matches `text`, or None"""
+        trade_id = self._ids[rank]
+        if trade_id == text:
+            return EXACT_ID
+        if trade_id.startswith(text):
+            return ID_PREFIX
+        field_infix = False
+        for per_rank in self._rank_values.values():
+            value = per_rank[rank]
+            if text in value:
+                if word_prefix(value, text):
+                    return FIELD_PREFIX
+                field_infix = True
+        if text in trade_id:
+            return ID_INFIX
+        return FIELD_INFIX if field_infix else None
+
+    def _match(self, text: str) -> Tuple[Tuple[int, ...], bool]:
+        """Ranked matches from the index, capped at SEARCH_MATCH_CAP; (ranks, complete)"""
+        self._misses += 1
+        seen = set()
+        ranked: List[int] = []
+
+        def take(ranks: Iterable[int]) -> bool:
+            """Append unseen ranks; False once the cap is exceeded"""
+            for rank in ranks:
+                if rank not in seen:
+                    seen.add(rank)
+                    ranked.append(rank)
+                    if len(ranked) > SEARCH_MATCH_CAP:
+                        return False
+            return True
+
+        field_prefix: Dict[str, List[str]] = {}
+        field_infix: Dict[str, List[str]] = {}
+        for field, by_value in self._values.items():
+            for value in by_value:
+                if text in value:
+                    (field_prefix if word_prefix(value, text) else field_infix).setdefault(field, []).append(value)
+
+        complete = (
+            take(self._id_prefix(text))
+            and take(self._field_ranks(field_prefix))
+            and take(self._id_infix(text))
+            and take(self._field_ranks(field_infix))
+            # Without a trigram there are no id infix matches to narrow from
+            and len(text) >= 3
+        )
+        if not ranked:
+            return self._fuzzy(text), False
+        return tuple(ranked[:SEARCH_MATCH_CAP]), complete
+
+    def _id_prefix(self, text: str) -> Iterable[int]:
+        """Ranks of ids starting with `text` (the exact match, if any, first)"""
+        rank = bisect_left(self._ids, text)
+        while rank < len(self._ids) and self._ids[rank].startswith(text):
+            yield rank
+            rank += 1
+
+    def _id_infix(self, text: str) -> Iterable[int]:
+        """Ranks of ids containing `text` not at their start"""
+        grams = trigrams(text)
+        if not grams:
+            return
+        postings = [self._trigrams.get(gram) for gram in grams]
+        if any(posting is None for posting in postings):
+            return
+        for rank in min(postings, key=len):
+            trade_id = self._ids[rank]
+            if text in trade_id and not trade_id.startswith(text):
+                yield rank
+
+    def _field_ranks(self, matched: Dict[str, List[str]]) -> Iterable[int]:
+        """Ranks having any of the matched values (field -> values), in rank order"""
+        postings = [self._values[field][value] for field, values in matched.items() for value in values]
+        if sum(len(ranks) for ranks in postings) <= FIELD_SORT_MAX:
+            return sorted(set(chain.from_iterable(postings)))
+        if len(postings) <= FIELD_MERGE_LISTS:
+            return heapq.merge(*postings)
+        checks = [(self._rank_values[field], set(values)) for field, values in matched.items()]
+        return (
+            rank for rank in range(len(self._ids))
+            if any(per_rank[rank] in values for per_rank, values in checks)
+        )
+
+    def _fuzzy(self, text: str) -> Tuple[int, ...]:
+        """Ranks of ids and field values similar to `text`, most similar first"""
+        query_grams = trigrams(text)
+        if not query_grams:
+            return ()
+        scored: List[Tuple[float, int]] = []
+
+        counts = Counter()
+        for gram in query_grams:
+            posting = self._trigrams.get(gram)
+            if posting is not None and len(posting) <= FUZZY_MAX_POSTING:
+                counts.update(posting)
+        for rank, _ in counts.most_common(SEARCH_MATCH_CAP):
+            score = similarity(query_grams, trigrams(self._ids[rank]))
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, rank))
+
+        candidates = set(chain.from_iterable(self._value_trigrams.get(gram, ()) for gram in query_grams))
+        for field, value in candidates:
+            score = similarity(query_grams, self._value_gram_sets[(field, value)])
+            if score >= FUZZY_THRESHOLD:
+                # Only the best SEARCH_MATCH_CAP are kept, so that many ranks per value suffice
+                scored.extend((-score, rank) for rank in self._values[field][value][:SEARCH_MATCH_CAP])
+
+        best, seen = [], set()
+        for _, rank in sorted(scored):
+            if rank not in seen:
+                seen.add(rank)
+                best.append(rank)
+                if len(best) == SEARCH_MATCH_CAP:
+                    break
+        return tuple(best)
@@ -1,8 +1,8 @@
 """
 Data transformation utilities to convert database/CDM format to frontend TypeScript types
 """
-from typing import Dict, Any, List, Optional, Union
-from common.diff import notional
+from typing import Dict, Any, List, Optional, Union, Tuple, NamedTuple
+from common.diff import PAYOUT_TYPES
 
 # Helpful defaults for demo trades when CDM payloads omit commercial fields
 DEFAULT_TRADE_METADATA: Dict[str, Dict[str, Union[str, float]]] = {
@@ -83,75 +83,89 @@ def map_event_type(backend_event_type: str) -> str:
     return EVENT_TYPE_MAP.get(backend_event_type, "Execution")
 
 
-def extract_product_type(trade_state_payload: Dict[str, Any]) -> str:
-    """Extract product type from TradeState CDM payload"""
-    try:
-        trade = trade_state_payload.get('trade', {})
-        tradable_product = trade.get('tradableProduct', {})
-        product = tradable_product.get('product', {})
-        product_type_obj = product.get('productType', {})
-        if isinstance(product_type_obj, dict):
-            return product_type_obj.get('value', 'Unknown')
-        return str(product_type_obj) if product_type_obj else 'Unknown'
-    except (KeyError, TypeError, AttributeError):
-        return 'Unknown'
+def map_intent_to_event_type(intent: Optional[str] = None, position_state: Optional[str] = None) -> str:
+    """Map CDM intent and position_state to UI-friendly event type"""
+    # Map intent first (more specific)
+    intent_mapping = {
+        "Execution": "Execution",
+        "ContractFormation": "Confirmation",
+        "ContractAmendment": "Amendment",
+        "Termination": "Termination",
+        "Settlement": "Settlement",
+        "Reset": "Reset",
+        "Transfer": "Transfer"
+    }
+    
+    if intent and intent in intent_mapping:
+        return intent_mapping[intent]
+    
+    # Fallback to position_state mapping
+    position_mapping = {
+        "EXECUTED": "Execution",
+        "CONFIRMED": "Confirmation",
+        "CLEARED": "Settlement",
+        "TERMINATED": "Termination",
+        "AMENDED": "Amendment"
+    }
+    
+    return position_mapping.get(position_state, position_state or "Unknown")
 
 
-def extract_parties(trade_state_payload: Dict[str, Any]) -> Dict[str, str]:
-    """Extract bank and counterparty names from TradeState CDM payload
-    
-    Returns: {'bank': 'Bank Name', 'counterparty': 'Counterparty Name'}
-    """
-    result = {'bank': 'Unknown', 'counterparty': 'Unknown'}
+def _product_type_from_node(product_type_obj: Any) -> str:
+    """Resolve product type from a trade.tradableProduct.product.productType node"""
+    if isinstance(product_type_obj, dict):
+        return product_type_obj.get('value', 'Unknown')
+    return str(product_type_obj) if product_type_obj else 'Unknown'
+
+
+def _parties_from_roles(party_roles: Any) -> Tuple[str, str]:
+    """Resolve (bank, counterparty) names from a trade.partyRole node"""
+    bank, counterparty = 'Unknown', 'Unknown'
+    multi_party = None
     try:
-        trade = trade_state_payload.get('trade', {})
-        party_roles = trade.get('partyRole', [])
+        party_roles = party_roles or []
         
         for role in party_roles:
-            role_type = role.get('role', {})
-            role_name = role_type.get('value', '').upper() if isinstance(role_type, dict) else str(role_type).upper()
             party = role.get('party', {})
             party_ids = party.get('partyId', [])
+            if not party_ids:
+                continue
+            
+            role_type = role.get('role', {})
+            role_name = role_type.get('value', '').upper() if isinstance(role_type, dict) else str(role_type).upper()
+            identifier = party_ids[0].get('identifier', {})
+            party_name = identifier.get('value', '') if isinstance(identifier, dict) else str(identifier)
+            
+            # Map role to bank/counterparty
+            if 'BANK' in role_name or 'PARTY' in role_name or 'SELLER' in role_name:
+                if bank == 'Unknown':
+                    bank = party_name
+            else:
+                if counterparty == 'Unknown':
+                    counterparty = party_name
             
-            if party_ids:
-                identifier = party_ids[0].get('identifier', {})
-                party_name = identifier.get('value', '') if isinstance(identifier, dict) else str(identifier)
-                
-                # Map role to bank/counterparty
-                if 'BANK' in role_name or 'PARTY' in role_name or 'SELLER' in role_name:
-                    if result['bank'] == 'Unknown':
-                        result['bank'] = party_name
-                else:
-                    if result['counterparty'] == 'Unknown':
-                        result['counterparty'] = party_name
-                
-                # If we have two parties but bank is still Unknown, use first as bank
-                if len([p for p in party_roles if p.get('party', {}).get('partyId')]) >= 2:
-                    if result['counterparty'] != 'Unknown' and result['bank'] == 'Unknown':
-                        result['bank'] = result['counterparty']
+            # If we have two parties but bank is still Unknown, use first as bank
+            if counterparty != 'Unknown' and bank == 'Unknown':
+                if multi_party is None:
+                    multi_party = len([p for p in party_roles if p.get('party', {}).get('partyId')]) >= 2
+                if multi_party:
+                    bank = counterparty
     except (KeyError, TypeError, AttributeError, IndexError):
         pass
     
-    return result
+    return bank, counterparty
 
 
-def extract_dates(trade_state_payload: Dict[str, Any]) -> Dict[str, Optional[str]]:
-    """Extract start date and maturity date from TradeState CDM payload
-    
-    Returns: {'startDate': 'YYYY-MM-DD', 'maturityDate': 'YYYY-MM-DD'}
-    """
-    result = {'startDate': None, 'maturityDate': None}
+def _dates_from_contract_terms(contract_terms: Any) -> Tuple[Optional[str], Optional[str]]:
+    """Resolve (startDate, maturityDate) from an economicTerms.contractTerms node"""
+    start_date, maturity_date = None, None
     try:
-        trade = trade_state_payload.get('trade', {})
-        tradable_product = trade.get('tradableProduct', {})
-        product = tradable_product.get('product', {})
-        economic_terms = product.get('economicTerms', {})
-        contract_terms = economic_terms.get('contractTerms', {})
+        contract_terms = contract_terms or {}
         
         # Extract dates from contractTerms
         dated = contract_terms.get('dated', {})
         if isinstance(dated, dict):
-            result['startDate'] = dated.get('value', '').split('T')[0] if dated.get('value') else None
+            start_date = dated.get('value', '').split('T')[0] if dated.get('value') else None
         
         # Extract maturity/termination date
         termination_events = contract_terms.get('terminationEvent', [])
@@ -161,11 +175,11 @@ def extract_dates(trade_state_payload: Dict[str, Any]) -> Dict[str, Optional[str
                 if isinstance(event_date, dict):
                     date_val = event_date.get('value', '').split('T')[0] if event_date.get('value') else None
                     if date_val:
-                        result['maturityDate'] = date_val
+                        maturity_date = date_val
                         break
         
         # Fallback: try to get from schedule
-        if not result['maturityDate']:
+        if not maturity_date:
             schedule = contract_terms.get('schedule', {})
             if schedule:
                 schedule_period = schedule.get('period', [])
@@ -173,57 +187,153 @@ def extract_dates(trade_state_payload: Dict[str, Any]) -> Dict[str, Optional[str
                     last_period = schedule_period[-1]
                     end_date = last_period.get('endDate', {})
                     if isinstance(end_date, dict):
-                        result['maturityDate'] = end_date.get('value', '').split('T')[0] if end_date.get('value') else None
+                        maturity_date = end_date.get('value', '').split('T')[0] if end_date.get('value') else None
     except (KeyError, TypeError, AttributeError, IndexError):
         pass
     
-    return result
+    return start_date, maturity_date
 
 
-def extract_currency(trade_state_payload: Dict[str, Any]) -> str:
-    """Extract currency from TradeState CDM payload"""
+def _currency_from_payout(payout: Any) -> str:
+    """Resolve currency from an economicTerms.payout node (first payout quantity unit)"""
     try:
-        notional_val = notional(trade_state_payload)
-        if notional_val is None:
-            # Try to get from quantity
-            trade = trade_state_payload.get('trade', {})
-            tradable_product = trade.get('tradableProduct', {})
-            product = tradable_product.get('product', {})
-            economic_terms = product.get('economicTerms', {})
-            payout = economic_terms.get('payout', {})
-            
-            for payout_type in ['interestRatePayout', 'equityPayout', 'creditDefaultSwapPayout']:
-                if payout_type in payout:
-                    payouts = payout[payout_type]
-                    if isinstance(payouts, list) and payouts:
-                        quantity = payouts[0].get('quantity', {})
-                        if isinstance(quantity, dict):
-                            unit = quantity.get('unit', {})
-                            if isinstance(unit, dict):
-                                return unit.get('value', 'USD')
-        else:
-            # Try to get currency from notional context
-            trade = trade_state_payload.get('trade', {})
-            tradable_product = trade.get('tradableProduct', {})
-            product = tradable_product.get('product', {})
-            economic_terms = product.get('economicTerms', {})
-            payout = economic_terms.get('payout', {})
-            
-            for payout_type in ['interestRatePayout', 'equityPayout', 'creditDefaultSwapPayout']:
-                if payout_type in payout:
-                    payouts = payout[payout_type]
-                    if isinstance(payouts, list) and payouts:
-                        quantity = payouts[0].get('quantity', {})
-                        if isinstance(quantity, dict):
-                            unit = quantity.get('unit', {})
-                            if isinstance(unit, dict):
-                                return unit.get('value', 'USD')
+        for payout_type in PAYOUT_TYPES:
+            if payout_type in payout:
+                payouts = payout[payout_type]
+                if isinstance(payouts, list) and payouts:
+                    quantity = payouts[0].get('quantity', {})
+                    if isinstance(quantity, dict):
+                        unit = quantity.get('unit', {})
+                        if isinstance(unit, dict):
+                            return unit.get('value', 'USD')
     except (KeyError, TypeError, AttributeError, IndexError):
         pass
     
     return 'USD'  # Default currency
 
 
+def _notional_and_currency_from_payout(payout: Any) -> Tuple[Optional[float], str]:
+    """Resolve (notional, currency) from an economicTerms.payout node in one scan
+    
+    Notional comes from the first payout type present (as common.diff.notional);
+    currency from the first payout quantity carrying a unit (as extract_currency).
+    """
+    notional_val, notional_found = None, False
+    try:
+        for payout_type in PAYOUT_TYPES:
+            if payout_type in payout:
+                payouts = payout[payout_type]
+                if isinstance(payouts, list) and payouts:
+                    quantity = payouts[0].get('quantity', {})
+                    if not isinstance(quantity, dict):
+                        notional_found = True
+                        continue
+                    if not notional_found:
+                        notional_val, notional_found = quantity.get('value'), True
+                    unit = quantity.get('unit', {})
+                    if isinstance(unit, dict):
+                        return notional_val, unit.get('value', 'USD')
+    except (KeyError, TypeError, AttributeError, IndexError):
+        pass
+    
+    return notional_val, 'USD'
+
+
+class TradeFields(NamedTuple):
+    """Compact record of the summary fields extracted from one TradeState payload"""
+    productType: Optional[str] = None
+    bank: Optional[str] = None
+    counterparty: Optional[str] = None
+    currentNotional: Optional[float] = None
+    currency: Optional[str] = None
+    startDate: Optional[str] = None
+    maturityDate: Optional[str] = None
+
+
+_PRODUCT_PATH = ('trade', 'tradableProduct', 'product')
+_ECONOMIC_TERMS_PATH = _PRODUCT_PATH + ('economicTerms',)
+
+# Positional tuple construction skips NamedTuple keyword handling on the hot path
+_new_record = tuple.__new__
+
+
+def _trade_nodes(trade_state_payload: Any) -> Tuple[Any, Any, Any]:
+    """(trade, product, economicTerms) nodes of a payload, None past the first non-dict"""
+    trade = trade_state_payload.get('trade') if isinstance(trade_state_payload, dict) else None
+    tradable = trade.get('tradableProduct') if isinstance(trade, dict) else None
+    product = tradable.get('product') if isinstance(tradable, dict) else None
+    economic_terms = product.get('economicTerms') if isinstance(product, dict) else None
+    return trade, product, economic_terms
+
+
+def extract_trade_fields(trade_state_payload: Dict[str, Any]) -> TradeFields:
+    """Extract every summary field from a TradeState payload in a single pass
+
+    trade -> tradableProduct -> product -> economicTerms is walked once for all
+    fields; use this instead of calling the extract_* helpers one by one.
+    """
+    trade, product, economic_terms = _trade_nodes(trade_state_payload)
+    if not isinstance(economic_terms, dict):
+        economic_terms = {}
+    bank, counterparty = _parties_from_roles(trade.get('partyRole') if isinstance(trade, dict) else None)
+    start_date, maturity_date = _dates_from_contract_terms(economic_terms.get('contractTerms'))
+    notional_val, currency = _notional_and_currency_from_payout(economic_terms.get('payout'))
+    return _new_record(TradeFields, (
+        _product_type_from_node(product.get('productType') if isinstance(product, dict) else None),
+        bank, counterparty, notional_val, currency, start_date, maturity_date
+    ))
+
+
+def _extract_event_fields(trade_state_payload: Dict[str, Any]) -> TradeFields:
+    """Extract only the parties, notional and currency (what timeline events show)"""
+    trade, _, economic_terms = _trade_nodes(trade_state_payload)
+    bank, counterparty = _parties_from_roles(trade.get('partyRole') if isinstance(trade, dict) else None)
+    notional_val, currency = _notional_and_currency_from_payout(
+        economic_terms.get('payout') if isinstance(economic_terms, dict) else None
+    )
+    return _new_record(TradeFields, (None, bank, counterparty, notional_val, currency, None, None))
+
+
+def _node_at(payload: Any, path: Tuple[str, ...]) -> Any:
+    """Follow a key path through nested dicts, returning None when it breaks"""
+    node = payload
+    for key in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+
+def extract_product_type(trade_state_payload: Dict[str, Any]) -> str:
+    """Extract product type from TradeState CDM payload"""
+    return _product_type_from_node(_node_at(trade_state_payload, _PRODUCT_PATH + ('productType',)))
+
+
+def extract_parties(trade_state_payload: Dict[str, Any]) -> Dict[str, str]:
+    """Extract bank and counterparty names from TradeState CDM payload
+    
+    Returns: {'bank': 'Bank Name', 'counterparty': 'Counterparty Name'}
+    """
+    bank, counterparty = _parties_from_roles(_node_at(trade_state_payload, ('trade', 'partyRole')))
+    return {'bank': bank, 'counterparty': counterparty}
+
+
+def extract_dates(trade_state_payload: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Extract start date and maturity date from TradeState CDM payload
+    
+    Returns: {'startDate': 'YYYY-MM-DD', 'maturityDate': 'YYYY-MM-DD'}
+    """
+    start_date, maturity_date = _dates_from_contract_terms(
+        _node_at(trade_state_payload, _ECONOMIC_TERMS_PATH + ('contractTerms',))
+    )
+    return {'startDate': start_date, 'maturityDate': maturity_date}
+
+
+def extract_currency(trade_state_payload: Dict[str, Any]) -> str:
+    """Extract currency from TradeState CDM payload"""
+    return _currency_from_payout(_node_at(trade_state_payload, _ECONOMIC_TERMS_PATH + ('payout',)))
+
+
 def generate_event_description(event_type: str, intent: str, position_state: str) -> str:
     """Generate a human-readable description for an event"""
     if event_type == "Execution":
@@ -265,13 +375,13 @@ def transform_timeline_to_events(
         trade_state_id = entry.get('trade_state_id')
         payload = trade_state_payloads.get(trade_state_id, {})
         
-        # Extract notional and currency from payload
-        notional_val = notional(payload)
-        currency = extract_currency(payload)
+        # Extract notional, currency and parties in a single pass over the payload
+        fields = _extract_event_fields(payload)
+        notional_val = fields.currentNotional
+        currency = fields.currency
         
         # Extract party (simplified - use first party found)
-        parties = extract_parties(payload)
-        party = parties.get('bank', parties.get('counterparty', 'Unknown'))
+        party = fields.bank
         if _is_missing(party):
             party = defaults.get('counterparty') or defaults.get('bank') or 'Unknown'
         
@@ -326,17 +436,8 @@ def transform_to_trade(
         Trade dictionary matching frontend Trade interface
     """
     # Extract basic info from latest state
-    parties = extract_parties(latest_trade_state_payload)
-    dates = extract_dates(latest_trade_state_payload)
-    extracted = {
-        "productType": extract_product_type(latest_trade_state_payload),
-        "counterparty": parties.get('counterparty'),
-        "bank": parties.get('bank'),
-        "currentNotional": notional(latest_trade_state_payload) or 0.0,
-        "currency": extract_currency(latest_trade_state_payload),
-        "startDate": dates.get('startDate'),
-        "maturityDate": dates.get('maturityDate'),
-    }
+    extracted = extract_trade_fields(latest_trade_state_payload)._asdict()
+    extracted["currentNotional"] = extracted["currentNotional"] or 0.0
     enriched = apply_default_trade_metadata(trade_id, extracted)
     product_type = enriched["productType"]
     notional_val = enriched["currentNotional"]
@@ -0,0 +1,17 @@
+-- Migration: Create state_diff_cache table for precomputed trade state diffs
+-- Stores consecutive-version diffs along the lineage chain; longer ranges are composed from them
+
+CREATE TABLE IF NOT EXISTS state_diff_cache (
+    from_state_id VARCHAR(100) NOT NULL,
+    to_state_id VARCHAR(100) NOT NULL,
+    from_payload_sha256 VARCHAR(64) NOT NULL,
+    to_payload_sha256 VARCHAR(64) NOT NULL,
+    diff_json JSONB NOT NULL, -- diff_states result: header, changes, appends, patch
+    created_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (from_state_id, to_state_id)
+);
+
+-- Comments for documentation
+COMMENT ON TABLE state_diff_cache IS 'Precomputed diffs between consecutive trade states (before_state_id -> trade_state_id)';
+COMMENT ON COLUMN state_diff_cache.from_payload_sha256 IS 'payload_sha256 of the from-state payload the diff was computed against; a mismatch means the entry is stale';
+COMMENT ON COLUMN state_diff_cache.to_payload_sha256 IS 'payload_sha256 of the to-state payload the diff was computed against; a mismatch means the entry is stale';
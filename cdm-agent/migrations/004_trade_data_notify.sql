@@ -0,0 +1,23 @@
+-- Migration: Notify listeners when trade data is ingested
+-- The API's MCP client LISTENs on cdm_trade_data_changed and drops its tool-result cache
+
+CREATE OR REPLACE FUNCTION notify_trade_data_changed() RETURNS trigger AS $$
+BEGIN
+    -- Identical notifications within one transaction are delivered once
+    PERFORM pg_notify('cdm_trade_data_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trade_state_notify ON trade_state;
+CREATE TRIGGER trade_state_notify
+    AFTER INSERT OR UPDATE OR DELETE ON trade_state
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_trade_data_changed();
+
+DROP TRIGGER IF EXISTS cdm_outputs_notify ON cdm_outputs;
+CREATE TRIGGER cdm_outputs_notify
+    AFTER INSERT OR UPDATE OR DELETE ON cdm_outputs
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_trade_data_changed();
+
+-- Comments for documentation
+COMMENT ON FUNCTION notify_trade_data_changed() IS 'Sends NOTIFY cdm_trade_data_changed (payload: table name) after writes to trade data';
@@ -0,0 +1,21 @@
+-- Migration: Create narrative_templates table for reusable event narrative templates
+-- Event narratives generated by the LLM are parameterized and keyed by event signature
+-- (event type, intent, changed fields, product type), so structurally identical events reuse them
+
+CREATE TABLE IF NOT EXISTS narrative_templates (
+    signature_key VARCHAR(64) PRIMARY KEY,
+    signature JSONB NOT NULL, -- [event_type, intent, changed fields, product type]
+    template_text TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Comments for documentation
+COMMENT ON TABLE narrative_templates IS 'Parameterized event narratives keyed by event signature, filled in for structurally identical events';
+COMMENT ON COLUMN narrative_templates.signature_key IS 'SHA256 of the JSON event signature';
+COMMENT ON COLUMN narrative_templates.template_text IS 'Narrative with concrete values replaced by {fact|format} placeholders';
+COMMENT ON COLUMN narrative_templates.confidence IS 'Share of data values (numbers, dates, identifiers) in the source narrative that were parameterized';
+COMMENT ON COLUMN narrative_templates.samples IS 'LLM narratives observed for this signature';
@@ -0,0 +1,34 @@
+-- Migration: Indexes for the hottest provider and API queries
+-- The "latest cdm_outputs row" lookups filter on object_type and an id, then sort by
+-- created_at DESC LIMIT 1; with only (object_type, trade_state_id) to use, every
+-- matching row is fetched and sorted. Partial indexes per object type that end in
+-- created_at DESC answer them with a single index probe, and INCLUDE payload_sha256
+-- so the hash-only revalidation in the cdm_db provider is an index-only scan.
+-- bench_queries.py shows the plans of these queries with and without the indexes.
+
+-- Latest TradeState payload (or hash) of a trade state, and _payload_hashes' DISTINCT ON
+CREATE INDEX IF NOT EXISTS idx_cdm_outputs_trade_state_latest
+    ON cdm_outputs (trade_state_id, created_at DESC)
+    INCLUDE (payload_sha256)
+    WHERE object_type = 'TradeState';
+
+-- Latest BusinessEvent payload of an event
+CREATE INDEX IF NOT EXISTS idx_cdm_outputs_business_event_latest
+    ON cdm_outputs (event_id, created_at DESC)
+    WHERE object_type = 'BusinessEvent';
+
+-- MAX(created_at) of TradeState rows and the created_at >= since filter of get_latest_trade_states
+CREATE INDEX IF NOT EXISTS idx_cdm_outputs_trade_state_created
+    ON cdm_outputs (created_at DESC)
+    WHERE object_type = 'TradeState';
+
+-- get_trade_states: all states of a trade in version order
+CREATE INDEX IF NOT EXISTS idx_trade_state_trade_version
+    ON trade_state (trade_id, version);
+
+ANALYZE cdm_outputs;
+ANALYZE trade_state;
+
+-- Comments for documentation
+COMMENT ON INDEX idx_cdm_outputs_trade_state_latest IS 'Latest TradeState row per trade_state_id (ORDER BY created_at DESC LIMIT 1); covers payload_sha256';
+COMMENT ON INDEX idx_cdm_outputs_business_event_latest IS 'Latest BusinessEvent row per event_id (ORDER BY created_at DESC LIMIT 1)';
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Precompute consecutive trade state diffs into state_diff_cache
+Run after ingesting new trade states (or pass trade ids to limit the run)
+"""
+import sys
+from common.db import q
+from providers.cdm_db.provider import cnx, precompute_lineage_diffs
+
+def precompute(trade_ids=None):
+    """Precompute diffs for the given trades (default: all trades)"""
+    if not trade_ids:
+        trade_ids = [r["trade_id"] for r in q(cnx, "SELECT DISTINCT trade_id FROM trade_state ORDER BY trade_id")]
+    
+    print(f"Precomputing state diffs for {len(trade_ids)} trades...")
+    total = 0
+    for trade_id in trade_ids:
+        count = precompute_lineage_diffs(trade_id)
+        total += count
+        print(f"  ✓ {trade_id}: {count} consecutive diffs")
+    
+    print(f"\nDone. {total} diffs available in state_diff_cache.")
+
+if __name__ == "__main__":
+    precompute(sys.argv[1:])
@@ -3,10 +3,12 @@ CDM Database MCP Provider
 Read-only MCP server for querying CDM trade states and business events
 """
 import asyncio
+import logging
 import os
 import sys
+from collections import OrderedDict
 from pathlib import Path
-from typing import Annotated, Dict, Any, List
+from typing import Annotated, Dict, Any, List, Optional
 
 # Add parent directory to path for imports when running as MCP server
 if __name__ == "__main__":
@@ -25,10 +27,53 @@ except ImportError:
     stdio_server = None  # type: ignore[assignment]
     Tool = Any  # type: ignore[assignment]
     MCP_ENABLED = False
-from common.db import conn, q, one
-from common.diff import notional, fixed_rate, changed, appended
+from common import codec
+from common.mcp_server import Session, register_cache_stats, serve
+from common.db import conn, q, one, execute, LazyConnection
+from common.payload_cache import PayloadCache
+from common.diff import notional, fixed_rate, changed, appended, structural_diff, compose_state_diffs
+from common.transform import map_intent_to_event_type
 
-cnx = conn()
+logger = logging.getLogger(__name__)
+
+# Connected on the first query, so the provider starts and answers initialize/tools/list
+# without waiting for the database
+cnx = LazyConnection(conn)
+
+# Client-side result cache policies, advertised in tools/list as _meta.cache.
+# The API drops cached results when trade data is ingested (NOTIFY), so the TTLs
+# only bound staleness when that notification is unavailable
+TOOL_CACHE_POLICIES = {
+    "get_trade_states": {"ttlSeconds": 120, "keyArgs": ["trade_id"]},
+    "get_lineage": {"ttlSeconds": 120, "keyArgs": ["trade_state_id"]},
+    "get_trade_lineage": {"ttlSeconds": 120, "keyArgs": ["trade_id"]},
+    # Addressed by immutable state/event ids
+    "get_tradestate_payload": {"ttlSeconds": 600, "keyArgs": ["trade_state_id"]},
+    "get_business_event": {"ttlSeconds": 600, "keyArgs": ["event_id"]},
+    "diff_states": {"ttlSeconds": 600, "keyArgs": ["from_state_id", "to_state_id"]},
+}
+
+# Batch read of the whole book for the API's portfolio summary (not offered to the LLM)
+LATEST_STATES_DESCRIPTION = (
+    "Get the latest state and TradeState payload of every trade, a page at a time in trade id order"
+)
+LATEST_STATES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "after": {
+            "type": "string",
+            "description": "return trades whose id sorts after this one (previous page's next_after)"
+        },
+        "limit": {
+            "type": "integer",
+            "description": "trades per page"
+        },
+        "since": {
+            "type": "string",
+            "description": "only trades with a TradeState output created at or after this ISO timestamp"
+        }
+    }
+}
 
 # Create server instance
 def create_server():
@@ -100,7 +145,7 @@ def create_server():
             ),
             Tool(
                 name="diff_states",
-                description="Compare two trade states showing changes and appends",
+                description="Compare two trade states showing key field changes, history appends and a full JSON Patch",
                 inputSchema={
                     "type": "object",
                     "properties": {
@@ -116,6 +161,11 @@ def create_server():
                     "required": ["from_state_id", "to_state_id"]
                 }
             ),
+            Tool(
+                name="get_latest_trade_states",
+                description=LATEST_STATES_DESCRIPTION,
+                inputSchema=LATEST_STATES_SCHEMA
+            ),
             Tool(
                 name="get_trade_lineage",
                 description="Get complete timeline lineage for a trade with enriched event data (intent, effectiveDate, relationships) - optimized for UI timeline views",
@@ -135,8 +185,6 @@ def create_server():
     @s.call_tool()
     async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         """Handle tool calls"""
-        import json
-        
         result = None
         if name == "get_trade_states":
             result = await get_trade_states(arguments["trade_id"])
@@ -150,11 +198,13 @@ def create_server():
             result = await diff_states(arguments["from_state_id"], arguments["to_state_id"])
         elif name == "get_trade_lineage":
             result = await get_trade_lineage(arguments["trade_id"])
+        elif name == "get_latest_trade_states":
+            result = await get_latest_trade_states(**arguments)
         else:
             raise ValueError(f"Unknown tool: {name}")
         
         # Return as TextContent
-        return [TextContent(type="text", text=json.dumps(result, cls=DateTimeEncoder))]
+        return [TextContent(type="text", text=codec.dumps(result))]
     
     return s
 
@@ -203,14 +253,48 @@ async def get_lineage(trade_state_id: str) -> Dict[str, Any]:
         "intent": intent or "UNKNOWN"
     }
 
+# Decoded TradeState payloads keyed by cdm_outputs.payload_sha256
+payload_cache = PayloadCache(
+    max_bytes=int(os.getenv("CDM_PAYLOAD_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    id_ttl_s=float(os.getenv("CDM_PAYLOAD_ID_TTL_S", "30"))
+)
+register_cache_stats("payload_cache", payload_cache.stats)
+
 def _get_ts_payload(state_id: str) -> Dict[str, Any]:
-    """Helper to get TradeState payload"""
-    rec = one(cnx, """SELECT payload_json FROM cdm_outputs
+    """Helper to get TradeState payload
+    
+    Served from payload_cache when the state's current payload_sha256 is known.
+    An expired hash whose payload is still cached is revalidated with a hash-only
+    query; otherwise hash and payload are read in one query and decoded into the cache.
+    """
+    sha = payload_cache.lookup_hash(state_id)
+    if sha is None and payload_cache.stale_hash(state_id) is not None:
+        # Lightweight revalidation: fetch the hash only, not the JSONB payload
+        rec = one(cnx, """SELECT payload_sha256 FROM cdm_outputs
+                          WHERE object_type='TradeState' AND trade_state_id=%s
+                          ORDER BY created_at DESC LIMIT 1""", (state_id,))
+        if not rec: 
+            raise ValueError(f"TradeState payload not found: {state_id}")
+        sha = rec["payload_sha256"]
+        if sha:
+            payload_cache.remember_hash(state_id, sha)
+    
+    if sha:
+        cached = payload_cache.get(sha)
+        if cached is not None:
+            return cached
+    
+    rec = one(cnx, """SELECT payload_sha256, payload_json::text AS payload_text FROM cdm_outputs
                       WHERE object_type='TradeState' AND trade_state_id=%s
                       ORDER BY created_at DESC LIMIT 1""", (state_id,))
     if not rec: 
         raise ValueError(f"TradeState payload not found: {state_id}")
-    return rec["payload_json"].get("tradeState") or rec["payload_json"].get("trade_state")
+    payload_json = codec.loads(rec["payload_text"])
+    payload = payload_json.get("tradeState") or payload_json.get("trade_state")
+    if rec["payload_sha256"]:
+        payload_cache.remember_hash(state_id, rec["payload_sha256"])
+        payload_cache.put(rec["payload_sha256"], payload, len(rec["payload_text"]))
+    return payload
 
 async def get_tradestate_payload(trade_state_id: str) -> Dict[str, Any]:
     """Get full TradeState JSON payload"""
@@ -225,8 +309,8 @@ async def get_business_event(event_id: str) -> Dict[str, Any]:
         raise ValueError(f"BusinessEvent not found: {event_id}")
     return rec["payload_json"].get("businessEvent") or rec["payload_json"].get("business_event")
 
-async def diff_states(from_state_id: str, to_state_id: str) -> Dict[str, Any]:
-    """Compare two trade states showing changes and appends"""
+def _compute_diff(from_state_id: str, to_state_id: str) -> Dict[str, Any]:
+    """Compute a diff_states result from the two payloads"""
     A = _get_ts_payload(from_state_id)
     B = _get_ts_payload(to_state_id)
     
@@ -246,35 +330,105 @@ async def diff_states(from_state_id: str, to_state_id: str) -> Dict[str, Any]:
         "appends": {
             "resetHistory": appended(resetsA, resetsB),
             "transferHistory": appended(transA, transB)
-        }
+        },
+        # Full structural diff as an RFC 6902 JSON Patch
+        "patch": structural_diff(A, B)
     }
 
-def _map_intent_to_event_type(intent: str = None, position_state: str = None) -> str:
-    """Map CDM intent and position_state to UI-friendly event type"""
-    # Map intent first (more specific)
-    intent_mapping = {
-        "Execution": "Execution",
-        "ContractFormation": "Confirmation",
-        "ContractAmendment": "Amendment",
-        "Termination": "Termination",
-        "Settlement": "Settlement",
-        "Reset": "Reset",
-        "Transfer": "Transfer"
-    }
+# LRU of consecutive-state diffs keyed by (from_state_id, to_state_id, from_sha256, to_sha256)
+_diff_memo: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+DIFF_MEMO_MAX_ENTRIES = int(os.getenv("CDM_DIFF_MEMO_MAX_ENTRIES", "2048"))
+register_cache_stats("diff_memo", lambda: {"entries": len(_diff_memo), "max_entries": DIFF_MEMO_MAX_ENTRIES})
+
+def _payload_hashes(state_ids: List[str]) -> Dict[str, str]:
+    """Latest payload_sha256 per trade state id"""
+    rows = q(cnx, """SELECT DISTINCT ON (trade_state_id) trade_state_id, payload_sha256
+                     FROM cdm_outputs
+                     WHERE object_type='TradeState' AND trade_state_id = ANY(%s)
+                     ORDER BY trade_state_id, created_at DESC""", (list(state_ids),))
+    return {r["trade_state_id"]: r["payload_sha256"] for r in rows}
+
+def _consecutive_diff(from_state_id: str, to_state_id: str, hashes: Dict[str, str]) -> Dict[str, Any]:
+    """Get a consecutive-state diff from the memo or state_diff_cache, computing it on first use"""
+    from_sha, to_sha = hashes.get(from_state_id), hashes.get(to_state_id)
+    if not from_sha or not to_sha:
+        # Without payload hashes there is nothing to validate a stored diff against
+        return _compute_diff(from_state_id, to_state_id)
     
-    if intent and intent in intent_mapping:
-        return intent_mapping[intent]
+    key = (from_state_id, to_state_id, from_sha, to_sha)
+    if key in _diff_memo:
+        _diff_memo.move_to_end(key)
+        return _diff_memo[key]
     
-    # Fallback to position_state mapping
-    position_mapping = {
-        "EXECUTED": "Execution",
-        "CONFIRMED": "Confirmation",
-        "CLEARED": "Settlement",
-        "TERMINATED": "Termination",
-        "AMENDED": "Amendment"
-    }
+    rec = one(cnx, """SELECT diff_json FROM state_diff_cache
+                      WHERE from_state_id=%s AND to_state_id=%s
+                        AND from_payload_sha256=%s AND to_payload_sha256=%s""",
+              (from_state_id, to_state_id, from_sha, to_sha))
+    if rec:
+        diff = rec["diff_json"]
+    else:
+        diff = _compute_diff(from_state_id, to_state_id)
+        try:
+            execute(cnx, """INSERT INTO state_diff_cache (
+                                from_state_id, to_state_id, from_payload_sha256, to_payload_sha256, diff_json
+                            ) VALUES (%s, %s, %s, %s, %s)
+                            ON CONFLICT (from_state_id, to_state_id) DO UPDATE SET
+                                from_payload_sha256 = EXCLUDED.from_payload_sha256,
+                                to_payload_sha256 = EXCLUDED.to_payload_sha256,
+                                diff_json = EXCLUDED.diff_json,
+                                created_at = NOW()""",
+                    (from_state_id, to_state_id, from_sha, to_sha, codec.dumps(diff)))
+        except Exception as e:
+            # Storage is an optimization; keep serving from the in-process memo
+            logger.warning(f"Could not store diff {from_state_id} -> {to_state_id}: {e}")
+    
+    _diff_memo[key] = diff
+    while len(_diff_memo) > DIFF_MEMO_MAX_ENTRIES:
+        _diff_memo.popitem(last=False)
+    return diff
+
+def _lineage_path(from_state_id: str, to_state_id: str) -> Optional[List[str]]:
+    """State ids from from_state_id to to_state_id following before_state_id links, or None"""
+    rows = q(cnx, """SELECT trade_state_id, before_state_id FROM trade_state
+                     WHERE trade_id = (SELECT trade_id FROM trade_state WHERE trade_state_id=%s)""",
+             (to_state_id,))
+    before = {r["trade_state_id"]: r["before_state_id"] for r in rows}
+    path = [to_state_id]
+    while path[-1] != from_state_id:
+        previous = before.get(path[-1])
+        if previous is None or previous in path:
+            return None
+        path.append(previous)
+    return list(reversed(path))
+
+async def diff_states(from_state_id: str, to_state_id: str) -> Dict[str, Any]:
+    """Compare two trade states showing changes and appends
+    
+    Consecutive-state diffs are computed once and stored in state_diff_cache;
+    a range along the lineage chain is composed from those stored deltas.
+    """
+    path = _lineage_path(from_state_id, to_state_id) if from_state_id != to_state_id else None
+    if not path:
+        return _compute_diff(from_state_id, to_state_id)
     
-    return position_mapping.get(position_state, position_state or "Unknown")
+    hashes = _payload_hashes(path)
+    steps = [_consecutive_diff(a, b, hashes) for a, b in zip(path, path[1:])]
+    return steps[0] if len(steps) == 1 else compose_state_diffs(steps)
+
+def precompute_lineage_diffs(trade_id: str) -> int:
+    """Compute and store every consecutive-state diff of a trade (e.g. right after ingest)
+    
+    Returns:
+        Number of consecutive pairs processed
+    """
+    rows = q(cnx, """SELECT trade_state_id, before_state_id FROM trade_state
+                     WHERE trade_id=%s AND before_state_id IS NOT NULL""", (trade_id,))
+    if not rows:
+        return 0
+    hashes = _payload_hashes({r["trade_state_id"] for r in rows} | {r["before_state_id"] for r in rows})
+    for r in rows:
+        _consecutive_diff(r["before_state_id"], r["trade_state_id"], hashes)
+    return len(rows)
 
 async def get_trade_lineage(trade_id: str) -> Dict[str, Any]:
     """Get complete timeline lineage for a trade with enriched event data"""
@@ -297,7 +451,7 @@ async def get_trade_lineage(trade_id: str) -> Dict[str, Any]:
             lineage = await get_lineage(trade_state_id)
             
             # Map intent to UI-friendly event type
-            event_type = _map_intent_to_event_type(
+            event_type = map_intent_to_event_type(
                 lineage.get("intent"),
                 state.get("position_state")
             )
@@ -323,7 +477,7 @@ async def get_trade_lineage(trade_id: str) -> Dict[str, Any]:
             
         except ValueError as e:
             # If lineage lookup fails, still include basic state info
-            event_type = _map_intent_to_event_type(None, state.get("position_state"))
+            event_type = map_intent_to_event_type(None, state.get("position_state"))
             timeline_entry = {
                 "trade_state_id": trade_state_id,
                 "version": state.get("version"),
@@ -345,217 +499,249 @@ async def get_trade_lineage(trade_id: str) -> Dict[str, Any]:
         "timeline": timeline
     }
 
-async def main():
-    """Run a simple MCP-compatible JSON-RPC server via stdio"""
-    if not MCP_ENABLED:
-        raise RuntimeError("MCP not enabled")
+# Upper bound on trades per get_latest_trade_states page
+LATEST_STATES_MAX_PAGE = int(os.getenv("CDM_LATEST_STATES_MAX_PAGE", "5000"))
 
-    # Implement simple MCP JSON-RPC over stdio
-    import json
-    import sys
-    import asyncio
-
-    # Custom JSON encoder to handle datetime objects
-    class DateTimeEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if hasattr(obj, 'isoformat'):  # datetime/date objects
-                return obj.isoformat()
-            return super().default(obj)
-
-    async def read_message():
-        """Read a JSON-RPC message from stdin"""
-        for line in sys.stdin:
-            line = line.strip()
-            if line:
-                try:
-                    return json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-        return None
+async def get_latest_trade_states(after: str = "", limit: int = 1000, since: Optional[str] = None) -> Dict[str, Any]:
+    """Latest state of each trade with its TradeState payload, one page in trade id order
 
-    async def write_message(msg):
-        """Write a JSON-RPC message to stdout"""
-        print(json.dumps(msg), flush=True)
+    Two queries per page, whatever its size: DISTINCT ON picks each trade's latest
+    state (idx_trade_state_trade_version), then each state's latest payload
+    (idx_cdm_outputs_trade_state_latest).
 
-    # Main MCP protocol loop
-    while True:
-        try:
-            # Read incoming message
-            message = await asyncio.get_event_loop().run_in_executor(None, lambda: input().strip() if sys.stdin.isatty() else sys.stdin.readline().strip())
-            if not message:
-                continue
-
-            try:
-                request = json.loads(message)
-            except json.JSONDecodeError:
-                continue
-
-            # Handle MCP protocol messages
-            if request.get("method") == "initialize":
-                # Respond to initialize request
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request.get("id"),
-                    "result": {
-                        "protocolVersion": "2024-11-05",
-                        "capabilities": {
-                            "tools": {}
-                        },
-                        "serverInfo": {
-                            "name": "cdm-db",
-                            "version": "1.0.0"
-                        }
-                    }
+    Args:
+        after: Only trades whose id sorts after this one (the previous page's next_after)
+        limit: Trades per page (capped at LATEST_STATES_MAX_PAGE)
+        since: Only trades with a TradeState output created at or after this timestamp
+    """
+    limit = max(1, min(int(limit), LATEST_STATES_MAX_PAGE))
+    # Read before the page, so a caller passing it back as `since` misses nothing written meanwhile
+    latest = one(cnx, "SELECT MAX(created_at) AS latest FROM cdm_outputs WHERE object_type='TradeState'")
+    
+    if since:
+        states = q(cnx, """SELECT DISTINCT ON (trade_id) trade_id, trade_state_id, position_state
+                           FROM trade_state
+                           WHERE trade_id > %s
+                             AND trade_id IN (SELECT trade_id FROM cdm_outputs
+                                              WHERE object_type='TradeState' AND created_at >= %s)
+                           ORDER BY trade_id, version DESC LIMIT %s""", (after, since, limit))
+    else:
+        states = q(cnx, """SELECT DISTINCT ON (trade_id) trade_id, trade_state_id, position_state
+                           FROM trade_state WHERE trade_id > %s
+                           ORDER BY trade_id, version DESC LIMIT %s""", (after, limit))
+    
+    outputs = {}
+    if states:
+        rows = q(cnx, """SELECT DISTINCT ON (trade_state_id) trade_state_id, payload_json::text AS payload_text
+                         FROM cdm_outputs
+                         WHERE object_type='TradeState' AND trade_state_id = ANY(%s)
+                         ORDER BY trade_state_id, created_at DESC""", ([r["trade_state_id"] for r in states],))
+        outputs = {r["trade_state_id"]: r["payload_text"] for r in rows}
+    
+    trades, pending = [], []
+    for state in states:
+        payload_text = outputs.get(state["trade_state_id"])
+        if payload_text is None:
+            # Latest state written, its payload not yet; it is returned once the payload lands
+            pending.append(state["trade_id"])
+            continue
+        payload_json = codec.loads(payload_text)
+        trades.append({
+            "trade_id": state["trade_id"],
+            "trade_state_id": state["trade_state_id"],
+            "position_state": state["position_state"],
+            "payload": payload_json.get("tradeState") or payload_json.get("trade_state"),
+        })
+    
+    return {
+        "trades": trades,
+        "pending": pending,
+        "next_after": states[-1]["trade_id"] if len(states) == limit else None,
+        "as_of": latest["latest"].isoformat() if latest and latest["latest"] else None,
+    }
+
+async def handle_message(request: Dict[str, Any], session: Session) -> Optional[Dict[str, Any]]:
+    """Handle one MCP JSON-RPC message and return its response (None if there is none)"""
+    # Handle MCP protocol messages
+    if request.get("method") == "initialize":
+        # Negotiates structured results and framing for this connection
+        experimental = session.negotiate(request.get("params", {}))
+
+        # Respond to initialize request
+        response = {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {
+                    "tools": {},
+                    "experimental": experimental
+                },
+                "serverInfo": {
+                    "name": "cdm-db",
+                    "version": "1.0.0"
                 }
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response, cls=DateTimeEncoder), flush=True))
-
-            elif request.get("method") == "tools/list":
-                # List available tools
-                tools = [
-                    {
-                        "name": "get_trade_states",
-                        "description": "Get all states for a trade ordered by version",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "trade_id": {
-                                    "type": "string",
-                                    "description": "logical trade id"
-                                }
-                            },
-                            "required": ["trade_id"]
+            }
+        }
+        return response
+
+    elif request.get("method") == "tools/list":
+        # List available tools
+        tools = [
+            {
+                "name": "get_trade_states",
+                "description": "Get all states for a trade ordered by version",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "trade_id": {
+                            "type": "string",
+                            "description": "logical trade id"
                         }
                     },
-                    {
-                        "name": "get_lineage",
-                        "description": "Get before/after relationships, intent, and effective date for a trade state",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "trade_state_id": {
-                                    "type": "string",
-                                    "description": "state id"
-                                }
-                            },
-                            "required": ["trade_state_id"]
+                    "required": ["trade_id"]
+                }
+            },
+            {
+                "name": "get_lineage",
+                "description": "Get before/after relationships, intent, and effective date for a trade state",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "trade_state_id": {
+                            "type": "string",
+                            "description": "state id"
                         }
                     },
-                    {
-                        "name": "get_tradestate_payload",
-                        "description": "Get full TradeState JSON payload",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "trade_state_id": {
-                                    "type": "string",
-                                    "description": "state id"
-                                }
-                            },
-                            "required": ["trade_state_id"]
+                    "required": ["trade_state_id"]
+                }
+            },
+            {
+                "name": "get_tradestate_payload",
+                "description": "Get full TradeState JSON payload",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "trade_state_id": {
+                            "type": "string",
+                            "description": "state id"
                         }
                     },
-                    {
-                        "name": "get_business_event",
-                        "description": "Get full BusinessEvent JSON payload",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "event_id": {
-                                    "type": "string",
-                                    "description": "event id"
-                                }
-                            },
-                            "required": ["event_id"]
+                    "required": ["trade_state_id"]
+                }
+            },
+            {
+                "name": "get_business_event",
+                "description": "Get full BusinessEvent JSON payload",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "event_id": {
+                            "type": "string",
+                            "description": "event id"
                         }
                     },
-                    {
-                        "name": "diff_states",
-                        "description": "Compare two trade states showing changes and appends",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "from_state_id": {
-                                    "type": "string",
-                                    "description": "from"
-                                },
-                                "to_state_id": {
-                                    "type": "string",
-                                    "description": "to"
-                                }
-                            },
-                            "required": ["from_state_id", "to_state_id"]
+                    "required": ["event_id"]
+                }
+            },
+            {
+                "name": "diff_states",
+                "description": "Compare two trade states showing key field changes, history appends and a full JSON Patch",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "from_state_id": {
+                            "type": "string",
+                            "description": "from"
+                        },
+                        "to_state_id": {
+                            "type": "string",
+                            "description": "to"
                         }
                     },
-                    {
-                        "name": "get_trade_lineage",
-                        "description": "Get complete timeline lineage for a trade with enriched event data (intent, effectiveDate, relationships) - optimized for UI timeline views",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "trade_id": {
-                                    "type": "string",
-                                    "description": "logical trade id"
-                                }
-                            },
-                            "required": ["trade_id"]
+                    "required": ["from_state_id", "to_state_id"]
+                }
+            },
+            {
+                "name": "get_latest_trade_states",
+                "description": LATEST_STATES_DESCRIPTION,
+                "inputSchema": LATEST_STATES_SCHEMA
+            },
+            {
+                "name": "get_trade_lineage",
+                "description": "Get complete timeline lineage for a trade with enriched event data (intent, effectiveDate, relationships) - optimized for UI timeline views",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "trade_id": {
+                            "type": "string",
+                            "description": "logical trade id"
                         }
-                    }
-                ]
-
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request.get("id"),
-                    "result": {"tools": tools}
+                    },
+                    "required": ["trade_id"]
                 }
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response, cls=DateTimeEncoder), flush=True))
-
-            elif request.get("method") == "tools/call":
-                # Handle tool calls
-                tool_name = request.get("params", {}).get("name")
-                tool_args = request.get("params", {}).get("arguments", {})
-
-                result = None
-                try:
-                    if tool_name == "get_trade_states":
-                        result = await get_trade_states(tool_args["trade_id"])
-                    elif tool_name == "get_lineage":
-                        result = await get_lineage(tool_args["trade_state_id"])
-                    elif tool_name == "get_tradestate_payload":
-                        result = await get_tradestate_payload(tool_args["trade_state_id"])
-                    elif tool_name == "get_business_event":
-                        result = await get_business_event(tool_args["event_id"])
-                    elif tool_name == "diff_states":
-                        result = await diff_states(tool_args["from_state_id"], tool_args["to_state_id"])
-                    elif tool_name == "get_trade_lineage":
-                        result = await get_trade_lineage(tool_args["trade_id"])
-                    else:
-                        raise ValueError(f"Unknown tool: {tool_name}")
-
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {"content": [{"type": "text", "text": json.dumps(result, cls=DateTimeEncoder)}]}
-                    }
-
-                except Exception as e:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "error": {"code": -32000, "message": str(e)}
-                    }
-
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response, cls=DateTimeEncoder), flush=True))
-
-        except KeyboardInterrupt:
-            break
+            }
+        ]
+
+        for tool in tools:
+            if tool["name"] in TOOL_CACHE_POLICIES:
+                tool["_meta"] = {"cache": TOOL_CACHE_POLICIES[tool["name"]]}
+
+        response = {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": {"tools": tools}
+        }
+        return response
+
+    elif request.get("method") == "tools/call":
+        # Handle tool calls
+        tool_name = request.get("params", {}).get("name")
+        tool_args = request.get("params", {}).get("arguments", {})
+
+        result = None
+        try:
+            if tool_name == "get_trade_states":
+                result = await get_trade_states(tool_args["trade_id"])
+            elif tool_name == "get_lineage":
+                result = await get_lineage(tool_args["trade_state_id"])
+            elif tool_name == "get_tradestate_payload":
+                result = await get_tradestate_payload(tool_args["trade_state_id"])
+            elif tool_name == "get_business_event":
+                result = await get_business_event(tool_args["event_id"])
+            elif tool_name == "diff_states":
+                result = await diff_states(tool_args["from_state_id"], tool_args["to_state_id"])
+            elif tool_name == "get_trade_lineage":
+                result = await get_trade_lineage(tool_args["trade_id"])
+            elif tool_name == "get_latest_trade_states":
+                result = await get_latest_trade_states(**tool_args)
+            else:
+                raise ValueError(f"Unknown tool: {tool_name}")
+
+            response = {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "result": session.tool_result(result)
+            }
+
         except Exception as e:
-            # Send error response
-            error_response = {
+            response = {
                 "jsonrpc": "2.0",
-                "id": request.get("id") if 'request' in locals() else None,
-                "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+                "id": request.get("id"),
+                "error": {"code": -32000, "message": str(e)}
             }
-            await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(error_response, cls=DateTimeEncoder), flush=True))
+
+        return response
+
+    return None
+
+async def main():
+    """Run the MCP-compatible JSON-RPC server over stdio, or on a Unix socket with --socket"""
+    if not MCP_ENABLED:
+        raise RuntimeError("MCP not enabled")
+
+    # Cancellations and request deadlines abort the running query
+    await serve(handle_message, on_cancel=cnx.cancel)
 
 if __name__ == "__main__":
     asyncio.run(main())
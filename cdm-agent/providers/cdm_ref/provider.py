@@ -6,7 +6,7 @@ import asyncio
 import os
 import sys
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 # Add parent directory to path for imports when running as MCP server
 if __name__ == "__main__":
@@ -14,6 +14,8 @@ if __name__ == "__main__":
     if str(parent_dir) not in sys.path:
         sys.path.insert(0, str(parent_dir))
 
+from common import codec
+from common.mcp_server import Session, serve
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
@@ -81,8 +83,6 @@ def create_server():
     @s.call_tool()
     async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
         """Handle tool calls"""
-        import json
-        
         result = None
         if name == "cdm_reference":
             result = await cdm_reference(arguments["pathOrType"])
@@ -92,7 +92,7 @@ def create_server():
             raise ValueError(f"Unknown tool: {name}")
         
         # Return as TextContent
-        return [TextContent(type="text", text=json.dumps(result))]
+        return [TextContent(type="text", text=codec.dumps(result))]
     
     return s
 
@@ -107,127 +107,109 @@ async def validate_payload(object_type: str, json_payload: Dict[str, Any]) -> Di
     """Validate CDM JSON payload against object type"""
     return jar_validate(object_type, json_payload)
 
-async def main():
-    """Run a simple MCP-compatible JSON-RPC server via stdio"""
-    # Implement simple MCP JSON-RPC over stdio
-    import json
-    import sys
-
-    # Main MCP protocol loop
-    while True:
-        try:
-            # Read incoming message
-            message = await asyncio.get_event_loop().run_in_executor(None, lambda: input().strip() if sys.stdin.isatty() else sys.stdin.readline().strip())
-            if not message:
-                continue
-
-            try:
-                request = json.loads(message)
-            except json.JSONDecodeError:
-                continue
-
-            # Handle MCP protocol messages
-            if request.get("method") == "initialize":
-                # Respond to initialize request
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request.get("id"),
-                    "result": {
-                        "protocolVersion": "2024-11-05",
-                        "capabilities": {
-                            "tools": {}
-                        },
-                        "serverInfo": {
-                            "name": "cdm-ref",
-                            "version": "1.0.0"
-                        }
-                    }
+async def handle_message(request: Dict[str, Any], session: Session) -> Optional[Dict[str, Any]]:
+    """Handle one MCP JSON-RPC message and return its response (None if there is none)"""
+    # Handle MCP protocol messages
+    if request.get("method") == "initialize":
+        # Negotiates structured results and framing for this connection
+        experimental = session.negotiate(request.get("params", {}))
+
+        # Respond to initialize request
+        response = {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {
+                    "tools": {},
+                    "experimental": experimental
+                },
+                "serverInfo": {
+                    "name": "cdm-ref",
+                    "version": "1.0.0"
                 }
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response), flush=True))
-
-            elif request.get("method") == "tools/list":
-                # List available tools
-                tools = [
-                    {
-                        "name": "cdm_reference",
-                        "description": "Get CDM type definition, fields, and enums for a given path or type",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "pathOrType": {
-                                    "type": "string",
-                                    "description": "CDM path or object type (e.g., 'BusinessEvent', 'cdm.product.template.EconomicTerms')"
-                                }
-                            },
-                            "required": ["pathOrType"]
+            }
+        }
+        return response
+
+    elif request.get("method") == "tools/list":
+        # List available tools
+        tools = [
+            {
+                "name": "cdm_reference",
+                "description": "Get CDM type definition, fields, and enums for a given path or type",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pathOrType": {
+                            "type": "string",
+                            "description": "CDM path or object type (e.g., 'BusinessEvent', 'cdm.product.template.EconomicTerms')"
                         }
                     },
-                    {
-                        "name": "validate_payload",
-                        "description": "Validate CDM JSON payload against object type",
-                        "inputSchema": {
+                    "required": ["pathOrType"]
+                }
+            },
+            {
+                "name": "validate_payload",
+                "description": "Validate CDM JSON payload against object type",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "object_type": {
+                            "type": "string",
+                            "description": "CDM object type (e.g., 'BusinessEvent', 'TradeState')"
+                        },
+                        "json_payload": {
                             "type": "object",
-                            "properties": {
-                                "object_type": {
-                                    "type": "string",
-                                    "description": "CDM object type (e.g., 'BusinessEvent', 'TradeState')"
-                                },
-                                "json_payload": {
-                                    "type": "object",
-                                    "description": "CDM JSON payload to validate"
-                                }
-                            },
-                            "required": ["object_type", "json_payload"]
+                            "description": "CDM JSON payload to validate"
                         }
-                    }
-                ]
-
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request.get("id"),
-                    "result": {"tools": tools}
+                    },
+                    "required": ["object_type", "json_payload"]
                 }
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response), flush=True))
-
-            elif request.get("method") == "tools/call":
-                # Handle tool calls
-                tool_name = request.get("params", {}).get("name")
-                tool_args = request.get("params", {}).get("arguments", {})
-
-                result = None
-                try:
-                    if tool_name == "cdm_reference":
-                        result = await cdm_reference(tool_args["pathOrType"])
-                    elif tool_name == "validate_payload":
-                        result = await validate_payload(tool_args["object_type"], tool_args["json_payload"])
-                    else:
-                        raise ValueError(f"Unknown tool: {tool_name}")
-
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "result": {"content": [{"type": "text", "text": json.dumps(result)}]}
-                    }
-
-                except Exception as e:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request.get("id"),
-                        "error": {"code": -32000, "message": str(e)}
-                    }
-
-                await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(response), flush=True))
-
-        except KeyboardInterrupt:
-            break
+            }
+        ]
+
+        response = {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": {"tools": tools}
+        }
+        return response
+
+    elif request.get("method") == "tools/call":
+        # Handle tool calls
+        tool_name = request.get("params", {}).get("name")
+        tool_args = request.get("params", {}).get("arguments", {})
+
+        result = None
+        try:
+            if tool_name == "cdm_reference":
+                result = await cdm_reference(tool_args["pathOrType"])
+            elif tool_name == "validate_payload":
+                result = await validate_payload(tool_args["object_type"], tool_args["json_payload"])
+            else:
+                raise ValueError(f"Unknown tool: {tool_name}")
+
+            response = {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "result": session.tool_result(result)
+            }
+
         except Exception as e:
-            # Send error response
-            error_response = {
+            response = {
                 "jsonrpc": "2.0",
-                "id": request.get("id") if 'request' in locals() else None,
-                "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
+                "id": request.get("id"),
+                "error": {"code": -32000, "message": str(e)}
             }
-            await asyncio.get_event_loop().run_in_executor(None, lambda: print(json.dumps(error_response), flush=True))
+
+        return response
+
+    return None
+
+async def main():
+    """Run the MCP-compatible JSON-RPC server over stdio, or on a Unix socket with --socket"""
+    await serve(handle_message)
 
 if __name__ == "__main__":
     asyncio.run(main())
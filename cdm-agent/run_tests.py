@@ -128,12 +128,586 @@ class TestRunner:
             else:
                 print(f"⚠️  fixed_rate() returned {rate_val}, expected 0.045")
             
-            return True
+            # Test single-pass field extraction against the individual extractors
+            from common.transform import extract_trade_fields, extract_currency
+            fields = extract_trade_fields(sample_state)
+            assert fields.currentNotional == notional_val
+            assert fields.currency == extract_currency(sample_state)
+            from common.transform import extract_product_type, extract_parties, extract_dates
+            full_state = {"trade": {
+                "partyRole": [{"party": {"partyId": [{"identifier": {"value": "Northwind Bank"}}]}, "role": {"value": "PARTY_1"}}],
+                "tradableProduct": {"product": {"productType": {"value": "Interest Rate Swap"}, "economicTerms": {
+                    "contractTerms": {"dated": {"value": "2025-01-15T00:00:00"}, "terminationEvent": [{"dated": {"value": "2035-01-15"}}]},
+                    "payout": {"interestRatePayout": [{"quantity": {"value": 1e8, "unit": {"value": "EUR"}}}]}
+                }}}
+            }}
+            for payload in (full_state, sample_state, {}):
+                fields = extract_trade_fields(payload)
+                assert fields._asdict() == {
+                    "productType": extract_product_type(payload), **extract_parties(payload),
+                    "currentNotional": notional(payload), "currency": extract_currency(payload), **extract_dates(payload)
+                }, payload
+            assert extract_trade_fields(full_state).maturityDate == "2035-01-15"
+            print("✅ extract_trade_fields() extraction works")
             
+            # Test structural diff round-trip
+            from common.diff import structural_diff, apply_patch
+            amended = {**sample_state, "resetHistory": [{"resetDate": "2025-04-01", "resetValue": 0.05}]}
+            patch = structural_diff(sample_state, amended)
+            assert patch == [{"op": "add", "path": "/resetHistory", "value": amended["resetHistory"]}]
+            assert apply_patch(sample_state, patch) == amended
+            # Colliding digests must not hide a change or an appended item
+            from common import diff as diff_module
+            real_digest = diff_module.subtree_digest
+            diff_module.subtree_digest = lambda node, memo=None: 0
+            try:
+                history = [{"resetDate": "2025-01-01", "resetValue": 0.04}]
+                collided = {**amended, "resetHistory": history + [{"resetDate": "2025-04-01", "resetValue": 0.06}]}
+                assert apply_patch(amended, structural_diff(amended, collided)) == collided
+                assert appended(history, collided["resetHistory"]) == collided["resetHistory"][1:]
+            finally:
+                diff_module.subtree_digest = real_digest
+            print("✅ structural_diff() works")
+
+            # Test composing consecutive diffs into one A -> C diff
+            from common.diff import compose_state_diffs
+
+            def state_diff(from_id, to_id, a, b):
+                return {
+                    "header": {"from_state_id": from_id, "to_state_id": to_id},
+                    "changes": {"notional": changed(notional(a), notional(b)),
+                                "positionState": changed(a["state"]["positionState"], b["state"]["positionState"])},
+                    "appends": {"resetHistory": appended(a.get("resetHistory", []), b.get("resetHistory", []))},
+                    "patch": structural_diff(a, b)
+                }
+
+            state_a = {**sample_state, "state": {"positionState": "EXECUTED"}}
+            state_b = {**amended, "state": {"positionState": "CONFIRMED"}}
+            july_reset = {"resetDate": "2025-07-01", "resetValue": 0.055}
+            state_c = {**state_b, "resetHistory": amended["resetHistory"] + [july_reset], "trade": {"tradableProduct": {
+                "product": {"economicTerms": {"payout": {"interestRatePayout": [{"quantity": {"value": 2000000.0}}]}}}
+            }}}
+            composed = compose_state_diffs([state_diff("A", "B", state_a, state_b), state_diff("B", "C", state_b, state_c)])
+            assert apply_patch(state_a, composed["patch"]) == state_c
+            assert composed["header"] == {"from_state_id": "A", "to_state_id": "C"}
+            assert composed["changes"]["notional"] == changed(1000000.0, 2000000.0)
+            assert composed["changes"]["positionState"] == changed("EXECUTED", "CONFIRMED")
+            assert composed["appends"]["resetHistory"] == amended["resetHistory"] + [july_reset]
+            round_trip = compose_state_diffs([state_diff("A", "B", state_a, state_b), state_diff("B", "A", state_b, state_a)])
+            assert apply_patch(state_a, round_trip["patch"]) == state_a
+            assert not round_trip["changes"]["notional"]["changed"]
+            print("✅ compose_state_diffs() works")
+
+            # Test the provider's diff memo evicts the least recently used diff
+            from providers.cdm_db import provider as cdm_db
+            stored_lookups = []
+            real_one, real_max = cdm_db.one, cdm_db.DIFF_MEMO_MAX_ENTRIES
+            cdm_db.one = lambda cnx, sql, params: stored_lookups.append(params[:2]) or {"diff_json": {"pair": params[:2]}}
+            cdm_db.DIFF_MEMO_MAX_ENTRIES = 2
+            cdm_db._diff_memo.clear()
+            try:
+                hashes = {state_id: f"sha-{state_id}" for state_id in "ABCD"}
+                for from_id, to_id in ("AB", "BC", "AB", "CD", "AB", "BC"):
+                    assert cdm_db._consecutive_diff(from_id, to_id, hashes)["pair"] == (from_id, to_id)
+                assert stored_lookups == [("A", "B"), ("B", "C"), ("C", "D"), ("B", "C")]
+            finally:
+                cdm_db.one, cdm_db.DIFF_MEMO_MAX_ENTRIES = real_one, real_max
+                cdm_db._diff_memo.clear()
+            print("✅ diff memo works")
+
+            # Test tool result compaction keeps only changed fields and stays valid JSON
+            from agent.compaction import compact_result
+            from common import codec
+            diff = {
+                "header": {"from_state_id": "a", "to_state_id": "b"},
+                "changes": {"notional": changed(1.0, 1.0), "fixedRate": changed(0.045, 0.05)},
+                "appends": {"resetHistory": [], "transferHistory": []},
+                "patch": patch
+            }
+            compacted, text = compact_result("diff_states", diff, max_tokens=600)
+            assert compacted["changes"] == {"fixedRate": [0.045, 0.05]} and "appends" not in compacted
+            assert codec.loads(text) == compacted
+            # Nulls inside [from, to] pairs and [op, path, value] entries are kept in place
+            nulls = {
+                "changes": {"closedState": changed(None, {"state": "TERMINATED"}), "notional": changed(1e6, None)},
+                "patch": [{"op": "replace", "path": "/x", "value": None}]
+            }
+            compacted, _ = compact_result("diff_states", nulls, max_tokens=600)
+            assert compacted["changes"] == {"closedState": [None, {"state": "TERMINATED"}], "notional": [1e6, None]}
+            assert compacted["patch"] == [["replace", "/x", None]]
+            print("✅ compact_result() works")
+
+            # Test narrative templates round-trip with another event's values
+            from agent.narrative_templates import make_template, render_template
+            facts = {"trade_id": "T-1", "reset_value": 0.0412, "effective_date": "2025-04-01", "notional": 10000000}
+            template, confidence = make_template("On April 1, 2025 trade T-1 reset to 4.12% on 10,000,000.", facts)
+            assert template == "On {effective_date|mdy} trade {trade_id|raw} reset to {reset_value|pct} on {notional|comma}."
+            assert confidence == 1.0
+            other = {"trade_id": "T-2", "reset_value": 0.05, "effective_date": "2025-07-01", "notional": 2500000}
+            assert render_template(template, other) == "On July 1, 2025 trade T-2 reset to 5% on 2,500,000."
+            assert render_template(template, {"trade_id": "T-2"}) is None
+            # An increase and a decrease need different verbs, so they must not share a template
+            from agent.narrative_templates import event_signature
+            lineage = {"trade_id": "T-1", "intent": "ContractFormation", "position_state": "EXECUTED"}
+            increase = {"changes": {"notional": changed(10e6, 15e6)}}
+            decrease = {"changes": {"notional": changed(20e6, 5e6)}}
+            assert event_signature(lineage, increase, "Swap") != event_signature(lineage, decrease, "Swap")
+            # A hardcoded name the facts don't cover keeps the template from being trusted
+            amended_facts = {"trade_id": "T-1", "notional_from": 10e6, "notional_to": 15e6}
+            _, confidence = make_template(
+                "Trade T-1 notional was increased from 10 million to 15 million with Globex as agent.", amended_facts
+            )
+            assert confidence < 0.9
+            print("✅ narrative templates work")
+
+            # Test rule narratives: status-only diffs are trivial, economic changes go to the LLM
+            from agent.rule_narratives import is_trivial, rule_narrative
+            confirmed = {
+                "changes": {"positionState": changed("EXECUTED", "CONFIRMED")},
+                "patch": [{"op": "replace", "path": "/state/positionState", "value": "CONFIRMED"}],
+            }
+            amended_notional = {"changes": {"positionState": changed("EXECUTED", "CONFIRMED"), "notional": changed(1e6, 2e6)}}
+            assert is_trivial(None) and is_trivial(confirmed)
+            assert not is_trivial(amended_notional)
+            assert not is_trivial({"appends": {"resetHistory": [{"resetValue": 0.05}]}})
+            assert not is_trivial({"patch": [{"op": "replace", "path": "/trade/tradableProduct/product", "value": {}}]})
+            assert is_trivial({"patch": [{"op": "replace", "path": "/trade/party/0/meta/globalKey", "value": "k"}]})
+
+            def rule_lineage(intent, position_state):
+                return {"trade_id": "T-1", "intent": intent, "position_state": position_state, "effectiveDate": "2025-04-01"}
+
+            executed = rule_narrative(rule_lineage("Execution", "EXECUTED"), None, sample_state)
+            assert executed.startswith("Trade T-1 was executed on April 1, 2025")
+            assert "1,000,000 notional and a fixed rate of 4.50%" in executed
+            assert rule_narrative(rule_lineage("ContractFormation", "CONFIRMED"), confirmed, sample_state).startswith(
+                "Trade T-1 was confirmed on April 1, 2025, moving its position from Executed to Confirmed."
+            )
+            terminated = {
+                "changes": {
+                    "positionState": changed("CONFIRMED", "TERMINATED"),
+                    "closedState": changed(None, {"state": "MATURED"}),
+                },
+                "patch": [{"op": "add", "path": "/state/closedState", "value": {"state": "MATURED"}}],
+            }
+            terminated_text = rule_narrative(rule_lineage("Termination", "TERMINATED"), terminated, sample_state)
+            assert terminated_text.startswith("Trade T-1 was terminated on April 1, 2025 (closed state: Matured)")
+            assert "At termination the trade carried" in terminated_text
+            assert rule_narrative(rule_lineage("ContractFormation", "CONFIRMED"), amended_notional, sample_state) is None
+            print("✅ rule narratives work")
+
+            # Test trade search ranking, narrowing from a cached prefix and fuzzy fallback
+            from common.trade_search import TradeSearchIndex
+            search_columns = {
+                "id": ["IRS-2024-010", "IRS-2024-001", "CDS-2024-001"],
+                "counterparty": ["Goldman Sachs", "JPMorgan", "Barclays"],
+                "bank": ["Bank of America"] * 3,
+                "productType": ["Interest Rate Swap", "Interest Rate Swap", "Credit Default Swap"],
+            }
+            index = TradeSearchIndex(search_columns)
+            assert index.search("irs-2024-001") == [1]
+            assert index.search("irs") == [1, 0]
+            assert index.search("2024-0") == [2, 1, 0] and index.search("2024-001") == [2, 1]
+            assert index.search("goldmn") == [0]
+            print("✅ trade search works")
+
+            # Test portfolio aggregation never sums notionals across currencies
+            from array import array
+            from common.portfolio import aggregate_columns, notional_by_currency
+            aggregate_input = {
+                "currentNotional": array("d", [5e6, 1e9, 2e6]),
+                "currency": ["USD", "JPY", "USD"],
+                "counterparty": ["JPMorgan", "Nomura", "JPMorgan"],
+            }
+            groups = aggregate_columns(aggregate_input, ["counterparty"])
+            assert [group["key"]["counterparty"] for group in groups] == ["JPMorgan", "Nomura"]
+            assert groups[0]["notionalByCurrency"] == {"USD": 7e6} and "totalNotional" not in groups[0]
+            assert notional_by_currency(aggregate_input) == {"USD": 7e6, "JPY": 1e9}
+            print("✅ portfolio aggregation works")
+
+            # Test incremental summary refresh: replaced, appended and inserted trades
+            from common.portfolio import merge_columns
+            book = {"id": ["T1", "T3"], "currentNotional": array("d", [1.0, 3.0]), "status": ["Active", "Active"]}
+            assert merge_columns(book, {"id": ["T3"], "currentNotional": array("d", [3.0]), "status": ["Active"]}) is None
+            merged = merge_columns(book, {
+                "id": ["T2", "T3", "T4"], "currentNotional": array("d", [2.0, 30.0, 4.0]), "status": ["Active", "Terminated", "Active"]
+            })
+            assert merged["id"] == ["T1", "T2", "T3", "T4"] and list(merged["currentNotional"]) == [1.0, 2.0, 30.0, 4.0]
+            assert merged["status"][2] == "Terminated" and book["id"] == ["T1", "T3"]
+            print("✅ summary merge works")
+
+            # Test payload cache: expired id entries stay a revalidation hint while their payload is cached
+            from common.payload_cache import PayloadCache
+            payloads = PayloadCache(max_bytes=100, id_ttl_s=-1)
+            payloads.remember_hash("TS-1", "sha-1")
+            assert payloads.lookup_hash("TS-1") is None and payloads.stale_hash("TS-1") is None
+            payloads.put("sha-1", {"trade": {}}, 60)
+            assert payloads.stale_hash("TS-1") == "sha-1"
+            payloads.put("sha-2", {"trade": {}}, 60)  # evicts sha-1
+            assert payloads.stale_hash("TS-1") is None
+            print("✅ payload cache works")
+
+            # Test request cancellation: queued, running and finished requests
+            from common.mcp_server import CancelRegistry
+            interrupts = []
+            registry = CancelRegistry(on_cancel=lambda: interrupts.append(1))
+            registry.received("q")
+            registry.cancel("q")
+            assert registry.start("q") is False and not interrupts
+            assert registry.start("r") is True
+            registry.cancel("r")
+            registry.cancel("r")
+            assert registry.finish("r") is True and len(interrupts) == 2
+            interrupts.clear()
+            registry.start("s")
+            assert registry.finish("s") is False
+            registry.cancel("s")
+            assert not interrupts and registry.start("t") is True and registry.finish("t") is False
+            print("✅ cancel registry works")
+
+            # Test request deadlines: nested blocks only tighten, expiry raises
+            from common.deadline import deadline, remaining, timeout_for, DeadlineExceeded
+            assert remaining() is None and timeout_for(5) == 5
+            with deadline(10):
+                with deadline(60):
+                    assert 0 < remaining() <= 10 and timeout_for(30) <= 10 and timeout_for(1) == 1
+                with deadline(0):
+                    try:
+                        timeout_for(5)
+                        raise AssertionError("expired deadline did not raise")
+                    except DeadlineExceeded:
+                        pass
+            assert remaining() is None
+            print("✅ request deadlines work")
+
+            # Test metrics exposition: cumulative buckets, escaping, remote series, NaN
+            from common import metrics
+            from common.query_log import normalize, fingerprint
+            requests_total = metrics.counter("cdm_test_requests_total", "Test requests", ("route",))
+            requests_total.inc(route='/a"b')
+            requests_total.inc(2, route='/a"b')
+            latency = metrics.histogram("cdm_test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+            latency.observe(0.05, route="/a")
+            latency.observe(0.5, route="/a")
+            latency.observe(5, route="/a")
+            remote = [({"process": "cdm_db"}, [
+                {"name": "cdm_test_requests_total", "type": "counter", "help": "Test requests",
+                 "series": [{"labels": {"route": "/q"}, "value": float("nan")}]}
+            ])]
+            lines = metrics.render(remote).splitlines()
+            for line in (
+                "# TYPE cdm_test_requests_total counter",
+                'cdm_test_requests_total{route="/a\\"b"} 3',
+                'cdm_test_requests_total{process="cdm_db",route="/q"} NaN',
+                'cdm_test_latency_seconds_bucket{route="/a",le="0.1"} 1',
+                'cdm_test_latency_seconds_bucket{route="/a",le="1"} 2',
+                'cdm_test_latency_seconds_bucket{route="/a",le="+Inf"} 3',
+                'cdm_test_latency_seconds_sum{route="/a"} 5.55',
+                'cdm_test_latency_seconds_count{route="/a"} 3',
+            ):
+                assert line in lines, line
+            assert lines.count("# TYPE cdm_test_requests_total counter") == 1
+            # Statement labels are the query log's normalized statements
+            sql = "SELECT payload_json FROM cdm_outputs WHERE trade_state_id = 'TS-1' AND version IN (1, 2)"
+            assert metrics.statement_label(sql) == normalize(sql) == metrics.statement_label(sql.replace("TS-1", "TS-2"))
+            long_sql = "SELECT " + ", ".join(f"column_{i}" for i in range(40)) + " FROM trade_state"
+            label = metrics.statement_label(long_sql)
+            assert len(label) == metrics.STATEMENT_LABEL_CHARS and label.endswith(f"[{fingerprint(normalize(long_sql))}]")
+            print("✅ metrics rendering works")
+
+            # Test trace context: traceparent parsing and propagation into child spans
+            import tempfile
+            from common import tracing
+            trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+            assert tracing.parse_traceparent(f"00-{trace_id}-{parent_id}-01") == (trace_id, parent_id)
+            assert tracing.parse_traceparent(f" 00-{trace_id.upper()}-{parent_id}-00\n") == (trace_id, parent_id)
+            for malformed in (None, "", f"01-{trace_id}-{parent_id}-01", f"00-{trace_id[:-1]}-{parent_id}-01",
+                              f"00-{trace_id}-{parent_id}", f"00-{trace_id}-{parent_id}-01-extra", "00-xyz"):
+                assert tracing.parse_traceparent(malformed) is None, malformed
+            with tracing.start_trace("untraced", f"00-{trace_id}-{parent_id}-01") as root:
+                assert root is None and tracing.current_traceparent() is None
+            trace_file = tracing.TRACE_FILE
+            with tempfile.TemporaryDirectory() as spans_dir:
+                tracing.TRACE_FILE = os.path.join(spans_dir, "spans.jsonl")
+                try:
+                    with tracing.start_trace("tools/call", f"00-{trace_id}-{parent_id}-01") as root:
+                        assert (root.trace_id, root.parent_id) == (trace_id, parent_id)
+                        with tracing.span("db.query") as child:
+                            assert tracing.current_traceparent() == child.traceparent
+                            assert tracing.parse_traceparent(child.traceparent) == (trace_id, child.span_id)
+                            assert child.parent_id == root.span_id
+                    assert tracing.current_traceparent() is None
+                    with tracing.start_trace("new", "garbage") as fresh:
+                        assert fresh.parent_id is None and len(fresh.trace_id) == 32 and fresh.trace_id != trace_id
+                    with open(tracing.TRACE_FILE, "rb") as f:
+                        exported = [codec.loads(line) for line in f]
+                finally:
+                    tracing.TRACE_FILE = trace_file
+            spans = [span for batch in exported for span in batch["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+            assert [(span["name"], span.get("parentSpanId")) for span in spans] == [
+                ("db.query", root.span_id), ("tools/call", parent_id), ("new", None)
+            ]
+            print("✅ trace context works")
+
+            # Test query log: literal-free statement keys, EXPLAIN only for side-effect-free statements
+            from common.query_log import QueryLog, explainable
+            assert normalize("SELECT *\n  FROM trade_state WHERE trade_id = 'O''Brien-1' AND version > -2.5") == \
+                "SELECT * FROM trade_state WHERE trade_id = ? AND version > ?"
+            assert normalize("SELECT 1 FROM t WHERE id IN (%s, %s, %s) AND v2 = $1") == "SELECT ? FROM t WHERE id IN (?...) AND v2 = $1"
+            assert normalize("SELECT x FROM t WHERE id IN (1, 2)") == normalize("SELECT x FROM t WHERE id IN (7, 8, 9)")
+            assert normalize("SELECT col1 FROM t2") == "SELECT col1 FROM t2"
+            assert explainable("SELECT 1") and explainable("  with s AS (SELECT 1) SELECT * FROM s")
+            for statement in ("INSERT INTO t VALUES (1)", "UPDATE t SET v = 1", "EXPLAIN SELECT 1",
+                              "WITH gone AS (DELETE FROM t RETURNING *) SELECT * FROM gone", "LISTEN cdm_trade_data_changed"):
+                assert not explainable(statement), statement
+            statements = QueryLog(slow_ms=100, explain=True, explain_interval_s=300)
+            select = normalize("SELECT * FROM trade_state WHERE trade_id = 'T-1'")
+            assert statements.record(select, 0.01) is False
+            assert statements.record(select, 0.2) is True and statements.record(select, 0.3) is False
+            assert statements.record(normalize("DELETE FROM t WHERE id = 1"), 0.5) is False
+            assert statements.record(select, 0.5, failed=True) is False
+            row = next(row for row in statements.report() if row["statement"] == select)
+            assert (row["calls"], row["errors"], row["slow_calls"]) == (4, 1, 2) and row["fingerprint"] == fingerprint(select)
+            print("✅ query log works")
+
+            return True
+
         except Exception as e:
             print(f"❌ Utilities test failed: {e}")
             return False
-    
+
+    async def run_concurrency_test(self) -> bool:
+        """Test request cancellation, deadlines, caching and message framing"""
+        print("\n🔀 Testing Concurrency")
+        print("-" * 40)
+
+        try:
+            from common.mcp_server import CancelRegistry, Session, _dispatch
+
+            # Test the timeoutMs deadline timer: interrupts the handler, drops the response
+            interrupts = []
+            registry = CancelRegistry(on_cancel=lambda: interrupts.append(1))
+
+            async def slow_handler(request, session):
+                await asyncio.sleep(0.2)
+                return {"jsonrpc": "2.0", "id": request["id"], "result": {}}
+
+            request = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"_meta": {"timeoutMs": 20}}}
+            assert await _dispatch(slow_handler, request, Session(), registry, 1) is None
+            assert len(interrupts) == 1
+            request = {"jsonrpc": "2.0", "id": 2, "method": "tools/call", "params": {"_meta": {"timeoutMs": 1000}}}
+            response = await _dispatch(slow_handler, request, Session(), registry, 2)
+            assert response["id"] == 2 and len(interrupts) == 1
+            print("✅ request deadline timer works")
+
+            # Test tool result cache: single flight, invalidation, failures and cancellation
+            from agent.tool_cache import ToolResultCache
+            cache = ToolResultCache()
+            loads = []
+
+            async def load_result(value, delay=0.01):
+                loads.append(value)
+                await asyncio.sleep(delay)
+                return {"value": value}
+
+            results = await asyncio.gather(*(cache.get_or_load("k", 60, lambda: load_result(1)) for _ in range(5)))
+            assert loads == [1] and all(result is results[0] for result in results)
+            assert await cache.get_or_load("k", 60, lambda: load_result(2)) is results[0]
+            assert (cache.misses, cache.shared, cache.hits) == (1, 4, 1)
+
+            # A result loaded across an invalidation is returned but not stored
+            loads.clear()
+            cache.invalidate()
+            stale = asyncio.ensure_future(cache.get_or_load("k", 60, lambda: load_result(3)))
+            await asyncio.sleep(0)
+            cache.invalidate()
+            assert (await stale)["value"] == 3
+            assert (await cache.get_or_load("k", 60, lambda: load_result(4)))["value"] == 4 and loads == [3, 4]
+
+            # Failures reach every waiter and are not cached
+            loads.clear()
+
+            async def failing_load():
+                loads.append("fail")
+                await asyncio.sleep(0.01)
+                raise ValueError("provider down")
+
+            failures = await asyncio.gather(
+                *(cache.get_or_load("f", 60, failing_load) for _ in range(3)), return_exceptions=True
+            )
+            assert all(isinstance(failure, ValueError) for failure in failures) and loads == ["fail"]
+            assert (await cache.get_or_load("f", 60, lambda: load_result(5)))["value"] == 5
+
+            # A cancelled waiter leaves the load running for the others;
+            # a cancelled loader hands the load over to a waiter
+            loads.clear()
+            loader = asyncio.ensure_future(cache.get_or_load("c", 60, lambda: load_result(6, 0.05)))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(cache.get_or_load("c", 60, lambda: load_result(7))) for _ in range(2)]
+            await asyncio.sleep(0)
+            waiters[0].cancel()
+            assert (await loader)["value"] == 6 and (await waiters[1])["value"] == 6 and waiters[0].cancelled()
+            loader = asyncio.ensure_future(cache.get_or_load("d", 60, lambda: load_result(8, 0.05)))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(cache.get_or_load("d", 60, lambda: load_result(9))) for _ in range(2)]
+            await asyncio.sleep(0)
+            loader.cancel()
+            assert [(await waiter)["value"] for waiter in waiters] == [9, 9] and loads == [6, 8, 9]
+            print("✅ tool result cache works")
+
+            # Test request memo: identical calls inside one request run once, nothing outlives it
+            from agent.tool_cache import request_memo, memoized
+            loads.clear()
+            assert (await memoized("get_lineage", {"trade_state_id": "TS-1"}, lambda: load_result(10)))["value"] == 10
+            with request_memo() as memo:
+                with request_memo() as nested:
+                    assert nested is memo
+                first, second = await asyncio.gather(
+                    memoized("get_lineage", {"trade_state_id": "TS-1"}, lambda: load_result(11)),
+                    memoized("get_lineage", {"trade_state_id": "TS-1"}, lambda: load_result(12)),
+                )
+                other = await memoized("get_lineage", {"trade_state_id": "TS-2"}, lambda: load_result(13))
+                assert first is second and first["value"] == 11 and other["value"] == 13
+            with request_memo() as fresh:
+                assert fresh is not memo
+                assert (await memoized("get_lineage", {"trade_state_id": "TS-1"}, lambda: load_result(14)))["value"] == 14
+            assert loads == [10, 11, 13, 14]
+            print("✅ request memo works")
+
+            # Test MCP message framing: plain and zlib frames, several per buffer, truncation
+            import io
+            import zlib
+            from common import codec
+            from common.framing import (
+                COMPRESS_MIN_BYTES, FRAMING_LENGTH_PREFIXED, FRAMING_NDJSON, COMPRESSION_ZLIB,
+                StdioTransport, encode_frame, negotiate_framing, read_frame
+            )
+            small = codec.dumpb({"jsonrpc": "2.0", "id": 1, "result": {}})
+            large = codec.dumpb({"rows": ["x" * 100] * (COMPRESS_MIN_BYTES // 50)})
+            assert encode_frame(small, compress=True)[4] == 0
+            compressed = encode_frame(large, compress=True)
+            assert compressed[4] == 1 and zlib.decompress(compressed[5:]) == large
+            frames = encode_frame(small) + compressed + encode_frame(b"")
+
+            reader = asyncio.StreamReader()
+            reader.feed_data(frames + encode_frame(small)[:7])
+            reader.feed_eof()
+            assert [await read_frame(reader) for _ in range(3)] == [small, large, b""]
+            try:
+                await read_frame(reader)
+                raise AssertionError("truncated frame was read")
+            except asyncio.IncompleteReadError:
+                pass
+
+            class Trickle(io.BytesIO):
+                """stdin returning a few bytes per read, like a pipe"""
+                def readinto(self, view):
+                    return super().readinto(view[:3])
+
+            transport = StdioTransport(stdin=Trickle(b'\n{"id": 1}\n' + frames + encode_frame(small)[:7]))
+            assert transport.read_message() == b'{"id": 1}'
+            transport.set_framing(FRAMING_LENGTH_PREFIXED, COMPRESSION_ZLIB)
+            assert [bytes(transport.read_message()) for _ in range(3)] == [small, large, b""]
+            assert transport.read_message() is None
+            assert StdioTransport(stdin=io.BytesIO(b"\n")).read_message() is None
+
+            stdout = io.BytesIO()
+            transport = StdioTransport(stdin=io.BytesIO(), stdout=stdout)
+            transport.write_message(small)
+            transport.set_framing(FRAMING_LENGTH_PREFIXED, COMPRESSION_ZLIB)
+            transport.write_message(large)
+            assert stdout.getvalue() == small + b"\n" + compressed
+
+            assert negotiate_framing(None) == (FRAMING_NDJSON, None)
+            assert negotiate_framing({"compression": [COMPRESSION_ZLIB]}) == (FRAMING_NDJSON, None)
+            assert negotiate_framing({"framing": ["cbor", FRAMING_LENGTH_PREFIXED]}) == (FRAMING_LENGTH_PREFIXED, None)
+            assert negotiate_framing(
+                {"framing": [FRAMING_LENGTH_PREFIXED], "compression": ["lz4", COMPRESSION_ZLIB]}
+            ) == (FRAMING_LENGTH_PREFIXED, COMPRESSION_ZLIB)
+            print("✅ message framing works")
+
+            # Test LLM admission: priority order, 429 halving and recovery, Retry-After pauses
+            import time
+            import httpx
+            from openai import RateLimitError
+            from agent.llm_backend import ReplayBackend
+            from agent.llm_scheduler import LLMScheduler, INTERACTIVE, BACKGROUND
+
+            class RecordingClient:
+                """Replay backend that records admissions and can answer 429 first"""
+                def __init__(self, profile, rate_limits=()):
+                    self.backend = ReplayBackend(profile=profile)
+                    self.chat = self
+                    self.completions = self
+                    self.admitted = []
+                    self.rate_limits = list(rate_limits)
+
+                async def create(self, **kwargs):
+                    self.admitted.append((kwargs["messages"][0]["content"], time.monotonic()))
+                    if self.rate_limits:
+                        headers = {"retry-after-ms": str(self.rate_limits.pop(0))}
+                        response = httpx.Response(429, request=httpx.Request("POST", "replay://"), headers=headers)
+                        raise RateLimitError("Rate limit exceeded", response=response, body=None)
+                    return await self.backend.create(**kwargs)
+
+            def chat(name, priority=INTERACTIVE):
+                messages = [{"role": "user", "content": f"Trade ID: {name}"}]
+                return scheduler.complete(client, priority=priority, model="replay", messages=messages, max_tokens=50)
+
+            scheduler = LLMScheduler(max_concurrency=1)
+            client = RecordingClient("10,inf")
+            await asyncio.gather(chat("A"), chat("B", BACKGROUND), chat("C"), chat("D", BACKGROUND), chat("E"))
+            assert [prompt for prompt, _ in client.admitted] == [f"Trade ID: {name}" for name in "ACEBD"]
+
+            scheduler = LLMScheduler(max_concurrency=4)
+            client = RecordingClient("instant", rate_limits=[50])
+            first = asyncio.ensure_future(chat("X"))
+            await asyncio.sleep(0.01)
+            assert scheduler.limit == 2 and scheduler.rate_limited == 1
+            await asyncio.gather(first, chat("Y"))
+            rejected_at = client.admitted[0][1]
+            assert all(at - rejected_at >= 0.045 for _, at in client.admitted[1:]) and scheduler.retries == 1
+            # Grown back by one after `limit` successes (the retry and Y), up to max_concurrency
+            assert scheduler.limit == 3
+            limits = []
+            for _ in range(5):
+                await chat("Z")
+                limits.append(scheduler.limit)
+            assert limits == [3, 3, 4, 4, 4] and scheduler.active == 0
+
+            # Admitted just as the caller is cancelled: the slot goes to the next waiter
+            scheduler = LLMScheduler(max_concurrency=1)
+            charge = await scheduler._acquire(10, INTERACTIVE)
+            cancelled = asyncio.ensure_future(scheduler._acquire(10, INTERACTIVE))
+            waiting = asyncio.ensure_future(scheduler._acquire(10, BACKGROUND))
+            await asyncio.sleep(0)
+            scheduler._release(charge, None)
+            cancelled.cancel()
+            await asyncio.wait_for(waiting, 1)
+            assert cancelled.cancelled() and scheduler.active == 1
+            print("✅ LLM scheduler works")
+
+            # Test quota window: waits for the oldest charges to expire, settles only live charges
+            from agent.llm_backend import QuotaWindow
+            quota = QuotaWindow(600, window_s=10)  # 100 tokens per window
+            first_charge = quota.charge(80, now=0)
+            assert quota.wait(20, now=1) == 0 and quota.wait(50, now=1) == 9
+            quota.settle(first_charge, 40)
+            assert quota.tokens == 40 and quota.wait(50, now=1) == 0
+            second_charge = quota.charge(60, now=2)
+            assert quota.wait(500, now=3) == 9  # larger than the window: waits for it to empty
+            assert quota.wait(0, now=10) == 0 and quota.tokens == 60
+            quota.settle(first_charge, 5)
+            assert quota.tokens == 60
+            quota.settle(second_charge, 10)
+            assert quota.tokens == 10 and quota.wait(0, now=12) == 0 and quota.tokens == 0
+            print("✅ quota window works")
+
+            return True
+
+        except Exception as e:
+            print(f"❌ Concurrency test failed: {e}")
+            return False
+
     async def run_provider_test(self) -> bool:
         """Test MCP provider tools"""
         print("\n🔌 Testing MCP Provider Tools")
@@ -226,6 +800,7 @@ class TestRunner:
             "Environment": self.run_environment_test(),
             "Database": self.run_database_test(),
             "Utilities": self.run_utilities_test(),
+            "Concurrency": await self.run_concurrency_test(),
             "Provider": await self.run_provider_test()
         }
         
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Show one trace from the CDM_TRACE_FILE span log as a waterfall
+
+Run the API (and so its providers) with tracing on, e.g.
+
+    CDM_TRACE_FILE=/tmp/cdm-traces.jsonl uvicorn api.app:app
+
+make a request, then
+
+    python trace_waterfall.py /tmp/cdm-traces.jsonl              # latest trace
+    python trace_waterfall.py /tmp/cdm-traces.jsonl --trace <id>  # X-Trace-Id of a response
+
+Each row is a span: its offset and duration on the trace's timeline, the process
+that recorded it, and its self time (duration not covered by child spans), which
+is where time went that no deeper span accounts for (Python code, pipes, queueing).
+"""
+import argparse
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from common import codec
+
+
+def _value(attribute: Dict[str, Any]) -> Any:
+    value = attribute.get("value") or {}
+    for key in ("stringValue", "intValue", "doubleValue", "boolValue"):
+        if key in value:
+            return value[key]
+    return None
+
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    """Every span in an OTLP/JSON lines file, with its service name attached"""
+    spans = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                request = codec.loads(line)
+            except codec.DecodeError:
+                continue
+            for resource_spans in request.get("resourceSpans", []):
+                resource = {a["key"]: _value(a) for a in (resource_spans.get("resource") or {}).get("attributes", [])}
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for span in scope_spans.get("spans", []):
+                        spans.append({
+                            **span,
+                            "service": resource.get("service.name", "?"),
+                            "start": int(span["startTimeUnixNano"]),
+                            "end": int(span["endTimeUnixNano"]),
+                            "attrs": {a["key"]: _value(a) for a in span.get("attributes", [])},
+                        })
+    return spans
+
+
+def _covered(intervals: List[Tuple[int, int]]) -> int:
+    """Total length of the union of intervals"""
+    total, end = 0, None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+def _label(span: Dict[str, Any]) -> str:
+    attrs = span["attrs"]
+    detail = attrs.get("db.statement") or attrs.get("http.status_code")
+    if "llm.prompt_tokens" in attrs:
+        detail = f"{attrs['llm.prompt_tokens']} in ({attrs.get('llm.cached_tokens', 0)} cached) / {attrs.get('llm.completion_tokens')} out"
+    error = (span.get("status") or {}).get("message")
+    text = f"{span['name']}" + (f"  [{detail}]" if detail is not None else "")
+    return text + (f"  ERROR {error}" if error else "")
+
+
+def render(spans: List[Dict[str, Any]], width: int) -> str:
+    """Waterfall of one trace's spans, children under their parents in start order"""
+    by_id = {span["spanId"]: span for span in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for span in spans:
+        parent = span.get("parentSpanId")
+        children.setdefault(parent if parent in by_id else None, []).append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda s: s["start"])
+
+    origin = min(span["start"] for span in spans)
+    total = max(max(span["end"] for span in spans) - origin, 1)
+    lines = [f"trace {spans[0]['traceId']}  {total / 1e6:.1f}ms  {len(spans)} spans", ""]
+    lines.append(f"{'offset':>9} {'duration':>9} {'self':>9}  {'service':<8} {'timeline':<{width}}  span")
+
+    def walk(span: Dict[str, Any], depth: int):
+        kids = children.get(span["spanId"], [])
+        self_ns = (span["end"] - span["start"]) - _covered([(k["start"], k["end"]) for k in kids])
+        begin = int((span["start"] - origin) / total * width)
+        length = max(1, int((span["end"] - span["start"]) / total * width))
+        bar = (" " * begin + "█" * length)[:width]
+        lines.append(
+            f"{(span['start'] - origin) / 1e6:>7.1f}ms {(span['end'] - span['start']) / 1e6:>7.1f}ms "
+            f"{max(self_ns, 0) / 1e6:>7.1f}ms  {span['service'][:8]:<8} {bar:<{width}}  {'  ' * depth}{_label(span)}"
+        )
+        for kid in kids:
+            walk(kid, depth + 1)
+
+    for root in children.get(None, []):
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a trace from an OTLP/JSON lines file as a waterfall")
+    parser.add_argument("file", help="Span log written with CDM_TRACE_FILE")
+    parser.add_argument("--trace", help="Trace id (default: the most recently started trace)")
+    parser.add_argument("--width", type=int, default=50, help="Timeline width in characters")
+    args = parser.parse_args()
+
+    spans = load_spans(args.file)
+    if not spans:
+        print(f"❌ No spans in {args.file}")
+        sys.exit(1)
+    trace_id = args.trace
+    if trace_id is None:
+        roots = [span for span in spans if not span.get("parentSpanId")] or spans
+        trace_id = max(roots, key=lambda s: s["start"])["traceId"]
+    trace = [span for span in spans if span["traceId"] == trace_id]
+    if not trace:
+        print(f"❌ Trace {trace_id} not found in {args.file}")
+        sys.exit(1)
+    print(render(trace, args.width))
+
+
+if __name__ == "__main__":
+    main()
@@ -85,7 +85,7 @@ export const api = {
   },
 
   /**
-   * Search trades by trade ID (case-insensitive)
+   * Search trades by trade ID, counterparty, bank or product type (best match first)
    */
   async searchTrades(query: string): Promise<TradeSummary[]> {
     return fetchApi<TradeSummary[]>(`/trades/search?q=${encodeURIComponent(query)}`);